@@ -0,0 +1,80 @@
+"""Move image and user file bytes to the blob storage
+
+Revision ID: 5c1e2b7d9a40
+Revises: 01a9d6bf4579
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.storage import get_storage
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e2b7d9a40'
+down_revision: Union[str, None] = '01a9d6bf4579'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _move_to_storage(table: str, data_column: str, prefix: str,
+                     content_type_column: str, content_type: str) -> None:
+    # Copia um registro por vez para não trazer todos os binários para a memória
+    conn = op.get_bind()
+    storage = get_storage()
+    ids = [row[0] for row in conn.execute(
+        sa.text(f"SELECT id FROM {table} WHERE {data_column} IS NOT NULL"))]
+    for row_id in ids:
+        data = conn.execute(
+            sa.text(f"SELECT {data_column} FROM {table} WHERE id = :id"), {"id": row_id}
+        ).scalar()
+        stored = storage.save(bytes(data))
+        conn.execute(
+            sa.text(f"UPDATE {table} SET {prefix}_hash = :hash, {prefix}_size = :size, "
+                    f"{content_type_column} = :content_type WHERE id = :id"),
+            {"hash": stored.sha256, "size": stored.size, "content_type": content_type, "id": row_id},
+        )
+
+
+def upgrade() -> None:
+    op.add_column('images', sa.Column('image_hash', sa.String(length=64), nullable=True))
+    op.add_column('images', sa.Column('image_size', sa.Integer(), nullable=True))
+    op.add_column('images', sa.Column('content_type', sa.String(), nullable=True))
+    op.create_index(op.f('ix_images_image_hash'), 'images', ['image_hash'], unique=False)
+    op.add_column('users', sa.Column('file_hash', sa.String(length=64), nullable=True))
+    op.add_column('users', sa.Column('file_size', sa.Integer(), nullable=True))
+    op.add_column('users', sa.Column('file_content_type', sa.String(), nullable=True))
+    op.create_index(op.f('ix_users_file_hash'), 'users', ['file_hash'], unique=False)
+
+    _move_to_storage('images', 'image_data', 'image', 'content_type', 'image/jpeg')
+    _move_to_storage('users', 'file', 'file', 'file_content_type', 'application/pdf')
+
+    op.drop_column('images', 'image_data')
+    op.drop_column('users', 'file')
+
+
+def downgrade() -> None:
+    op.add_column('users', sa.Column('file', sa.LargeBinary(), nullable=True))
+    op.add_column('images', sa.Column('image_data', sa.LargeBinary(), nullable=True))
+
+    conn = op.get_bind()
+    storage = get_storage()
+    for table, data_column, hash_column in (('images', 'image_data', 'image_hash'),
+                                            ('users', 'file', 'file_hash')):
+        rows = conn.execute(
+            sa.text(f"SELECT id, {hash_column} FROM {table} WHERE {hash_column} IS NOT NULL")).all()
+        for row_id, blob_hash in rows:
+            with storage.open(blob_hash) as f:
+                conn.execute(sa.text(f"UPDATE {table} SET {data_column} = :data WHERE id = :id"),
+                             {"data": f.read(), "id": row_id})
+
+    op.drop_index(op.f('ix_users_file_hash'), table_name='users')
+    op.drop_column('users', 'file_content_type')
+    op.drop_column('users', 'file_size')
+    op.drop_column('users', 'file_hash')
+    op.drop_index(op.f('ix_images_image_hash'), table_name='images')
+    op.drop_column('images', 'content_type')
+    op.drop_column('images', 'image_size')
+    op.drop_column('images', 'image_hash')
@@ -0,0 +1,41 @@
+"""Unique rating per evaluator, user, category and criteria
+
+Revision ID: 8d3f4a6b2c17
+Revises: 5c1e2b7d9a40
+Create Date: 2026-10-18 10:02:17.554120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3f4a6b2c17'
+down_revision: Union[str, None] = '5c1e2b7d9a40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Remove notas duplicadas antes de criar a constraint, mantendo a gravada por último.
+    # image_ratings não tem data e o id é um uuid4 aleatório, então a ordem vem do xmin
+    # (transação que gravou a linha: menor idade = mais recente) e, na mesma
+    # transação, do ctid (posição física, que cresce com as inserções)
+    op.execute("""
+        DELETE FROM image_ratings a
+        USING image_ratings b
+        WHERE a.evaluator_id = b.evaluator_id
+          AND a.evaluated_user_id = b.evaluated_user_id
+          AND a.category = b.category
+          AND a.criteria = b.criteria
+          AND (age(a.xmin) > age(b.xmin) OR (age(a.xmin) = age(b.xmin) AND a.ctid < b.ctid))
+    """)
+    op.create_unique_constraint(
+        'uq_image_ratings_evaluator_user_category_criteria',
+        'image_ratings',
+        ['evaluator_id', 'evaluated_user_id', 'category', 'criteria']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_image_ratings_evaluator_user_category_criteria', 'image_ratings', type_='unique')
@@ -0,0 +1,37 @@
+"""Users keyset pagination indexes
+
+Revision ID: a3e5c7d9f1b2
+Revises: f41d0c7e9a65
+Create Date: 2026-10-18 14:02:11.583204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3e5c7d9f1b2'
+down_revision: Union[str, None] = 'f41d0c7e9a65'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_name_id', 'users', ['name', 'id'], unique=False)
+    op.create_index('ix_users_category_name_id', 'users', ['category', 'name', 'id'], unique=False)
+    op.create_index('ix_users_user_type_name_id', 'users', ['user_type', 'name', 'id'], unique=False)
+    op.create_index('ix_users_institution_name_id', 'users', ['institution', 'name', 'id'], unique=False)
+    # Cobertos pelos índices compostos acima (mesmo prefixo)
+    op.drop_index('ix_users_name', table_name='users')
+    op.execute('DROP INDEX IF EXISTS ix_users_category')
+    # Atualiza reltuples, usado como estimativa do total em crud.count_users
+    op.execute('ANALYZE users')
+
+
+def downgrade() -> None:
+    op.create_index('ix_users_category', 'users', ['category'], unique=False)
+    op.create_index('ix_users_name', 'users', ['name'], unique=False)
+    op.drop_index('ix_users_institution_name_id', table_name='users')
+    op.drop_index('ix_users_user_type_name_id', table_name='users')
+    op.drop_index('ix_users_category_name_id', table_name='users')
+    op.drop_index('ix_users_name_id', table_name='users')
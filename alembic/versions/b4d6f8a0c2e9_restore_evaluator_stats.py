@@ -0,0 +1,58 @@
+"""Restore evaluator_stats for per-evaluator z-scores
+
+Revision ID: b4d6f8a0c2e9
+Revises: f3a7c9e1b5d8
+Create Date: 2026-10-18 19:12:40.218734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4d6f8a0c2e9'
+down_revision: Union[str, None] = 'f3a7c9e1b5d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # O z-score do ranking volta a ser por avaliador (corrige avaliadores rigorosos ou generosos)
+    op.create_table(
+        'evaluator_stats',
+        sa.Column('evaluator_id', sa.UUID(), nullable=False),
+        sa.Column('rating_sum', sa.BigInteger(), nullable=False),
+        sa.Column('rating_sq_sum', sa.BigInteger(), nullable=False),
+        sa.Column('rating_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['evaluator_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('evaluator_id'),
+    )
+    op.execute("""
+        INSERT INTO evaluator_stats (evaluator_id, rating_sum, rating_sq_sum, rating_count)
+        SELECT evaluator_id, SUM(rating), SUM(rating::bigint * rating), COUNT(*)
+        FROM image_ratings
+        GROUP BY evaluator_id
+    """)
+    op.drop_table('criterion_stats')
+
+
+def downgrade() -> None:
+    op.create_table(
+        'criterion_stats',
+        sa.Column('category', sa.String(length=1), nullable=False),
+        sa.Column('criteria', sa.String(), nullable=False),
+        sa.Column('rating_sum', sa.BigInteger(), nullable=False),
+        sa.Column('rating_sq_sum', sa.BigInteger(), nullable=False),
+        sa.Column('rating_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('category', 'criteria'),
+    )
+    op.execute("""
+        INSERT INTO criterion_stats (category, criteria, rating_sum, rating_sq_sum, rating_count)
+        SELECT category, criteria, SUM(rating), SUM(rating::bigint * rating), COUNT(*)
+        FROM image_ratings
+        GROUP BY category, criteria
+    """)
+    op.drop_table('evaluator_stats')
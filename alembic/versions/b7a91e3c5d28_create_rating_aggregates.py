@@ -0,0 +1,44 @@
+"""Create rating_aggregates
+
+Revision ID: b7a91e3c5d28
+Revises: 8d3f4a6b2c17
+Create Date: 2026-10-18 10:41:09.207335
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7a91e3c5d28'
+down_revision: Union[str, None] = '8d3f4a6b2c17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'rating_aggregates',
+        sa.Column('evaluated_user_id', sa.UUID(), nullable=False),
+        sa.Column('category', sa.String(length=1), nullable=False),
+        sa.Column('rating_sum', sa.Integer(), nullable=False),
+        sa.Column('rating_count', sa.Integer(), nullable=False),
+        sa.Column('average', sa.Numeric(),
+                  sa.Computed('rating_sum::numeric / NULLIF(rating_count, 0)', persisted=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['evaluated_user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('evaluated_user_id', 'category'),
+    )
+    # Backfill a partir das notas existentes
+    op.execute("""
+        INSERT INTO rating_aggregates (evaluated_user_id, category, rating_sum, rating_count)
+        SELECT r.evaluated_user_id::uuid, r.category, SUM(r.rating), COUNT(*)
+        FROM image_ratings r
+        JOIN users u ON u.id = r.evaluated_user_id::uuid
+        GROUP BY r.evaluated_user_id, r.category
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('rating_aggregates')
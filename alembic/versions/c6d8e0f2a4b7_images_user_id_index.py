@@ -0,0 +1,24 @@
+"""Images user_id index
+
+Revision ID: c6d8e0f2a4b7
+Revises: a3e5c7d9f1b2
+Create Date: 2026-10-18 14:41:37.902116
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6d8e0f2a4b7'
+down_revision: Union[str, None] = 'a3e5c7d9f1b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_images_user_id_subcategory', 'images', ['user_id', 'subcategory'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_images_user_id_subcategory', table_name='images')
@@ -0,0 +1,27 @@
+"""Images subcategory, user_id, id index
+
+Revision ID: d1e3f5a7b9c0
+Revises: b4d6f8a0c2e9
+Create Date: 2026-10-18 18:12:45.207391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'd1e3f5a7b9c0'
+down_revision: Union[str, None] = 'b4d6f8a0c2e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Fila do avaliador: participantes da categoria em ordem, sem Sort; cobre também ix_images_subcategory
+    op.create_index('ix_images_subcategory_user_id_id', 'images', ['subcategory', 'user_id', 'id'], unique=False)
+    op.drop_index('ix_images_subcategory', table_name='images')
+
+
+def downgrade() -> None:
+    op.create_index('ix_images_subcategory', 'images', ['subcategory'], unique=False)
+    op.drop_index('ix_images_subcategory_user_id_id', table_name='images')
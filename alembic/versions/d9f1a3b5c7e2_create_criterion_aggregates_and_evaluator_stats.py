@@ -0,0 +1,59 @@
+"""Create criterion_aggregates and evaluator_stats
+
+Revision ID: d9f1a3b5c7e2
+Revises: c6d8e0f2a4b7
+Create Date: 2026-10-18 15:27:53.310874
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9f1a3b5c7e2'
+down_revision: Union[str, None] = 'c6d8e0f2a4b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'criterion_aggregates',
+        sa.Column('evaluated_user_id', sa.UUID(), nullable=False),
+        sa.Column('category', sa.String(length=1), nullable=False),
+        sa.Column('criteria', sa.String(), nullable=False),
+        sa.Column('rating_sum', sa.Integer(), nullable=False),
+        sa.Column('rating_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['evaluated_user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('evaluated_user_id', 'category', 'criteria'),
+    )
+    op.create_table(
+        'evaluator_stats',
+        sa.Column('evaluator_id', sa.UUID(), nullable=False),
+        sa.Column('rating_sum', sa.BigInteger(), nullable=False),
+        sa.Column('rating_sq_sum', sa.BigInteger(), nullable=False),
+        sa.Column('rating_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['evaluator_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('evaluator_id'),
+    )
+    # Backfill a partir das notas existentes
+    op.execute("""
+        INSERT INTO criterion_aggregates (evaluated_user_id, category, criteria, rating_sum, rating_count)
+        SELECT evaluated_user_id, category, criteria, SUM(rating), COUNT(*)
+        FROM image_ratings
+        GROUP BY evaluated_user_id, category, criteria
+    """)
+    op.execute("""
+        INSERT INTO evaluator_stats (evaluator_id, rating_sum, rating_sq_sum, rating_count)
+        SELECT evaluator_id, SUM(rating), SUM(rating::bigint * rating), COUNT(*)
+        FROM image_ratings
+        GROUP BY evaluator_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('evaluator_stats')
+    op.drop_table('criterion_aggregates')
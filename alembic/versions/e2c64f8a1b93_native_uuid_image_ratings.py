@@ -0,0 +1,80 @@
+"""Native UUID columns, foreign keys and indexes on image_ratings
+
+Revision ID: e2c64f8a1b93
+Revises: b7a91e3c5d28
+Create Date: 2026-10-18 11:20:33.871045
+
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2c64f8a1b93'
+down_revision: Union[str, None] = 'b7a91e3c5d28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Notas de usuários que não existem mais impediriam a criação das foreign keys
+    delete_orphans = sa.text("""
+        DELETE FROM image_ratings r
+        WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id::text = r.evaluator_id)
+           OR NOT EXISTS (SELECT 1 FROM users u WHERE u.id::text = r.evaluated_user_id)
+    """)
+    if context.is_offline_mode():
+        # Gerando SQL (--sql) não há como contar; o DELETE vai para o script
+        op.execute(delete_orphans)
+    else:
+        removed = op.get_bind().execute(delete_orphans).rowcount
+        if removed:
+            logger.warning("%d notas órfãs (avaliador ou participante inexistente) removidas de image_ratings",
+                           removed)
+        else:
+            logger.info("Nenhuma nota órfã em image_ratings")
+    op.alter_column('image_ratings', 'evaluator_id',
+                    existing_type=sa.String(),
+                    type_=sa.UUID(),
+                    existing_nullable=False,
+                    postgresql_using='evaluator_id::uuid')
+    op.alter_column('image_ratings', 'evaluated_user_id',
+                    existing_type=sa.String(),
+                    type_=sa.UUID(),
+                    existing_nullable=False,
+                    postgresql_using='evaluated_user_id::uuid')
+    op.create_foreign_key('image_ratings_evaluator_id_fkey', 'image_ratings', 'users',
+                          ['evaluator_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('image_ratings_evaluated_user_id_fkey', 'image_ratings', 'users',
+                          ['evaluated_user_id'], ['id'], ondelete='CASCADE')
+    op.create_index('ix_image_ratings_evaluated_user_category_evaluator', 'image_ratings',
+                    ['evaluated_user_id', 'category', 'evaluator_id'], unique=False)
+    # Recalcula os agregados sem as notas órfãs removidas acima
+    op.execute("DELETE FROM rating_aggregates")
+    op.execute("""
+        INSERT INTO rating_aggregates (evaluated_user_id, category, rating_sum, rating_count)
+        SELECT evaluated_user_id, category, SUM(rating), COUNT(*)
+        FROM image_ratings
+        GROUP BY evaluated_user_id, category
+    """)
+    op.execute("ANALYZE image_ratings")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_image_ratings_evaluated_user_category_evaluator', table_name='image_ratings')
+    op.drop_constraint('image_ratings_evaluated_user_id_fkey', 'image_ratings', type_='foreignkey')
+    op.drop_constraint('image_ratings_evaluator_id_fkey', 'image_ratings', type_='foreignkey')
+    op.alter_column('image_ratings', 'evaluated_user_id',
+                    existing_type=sa.UUID(),
+                    type_=sa.String(),
+                    existing_nullable=False,
+                    postgresql_using='evaluated_user_id::text')
+    op.alter_column('image_ratings', 'evaluator_id',
+                    existing_type=sa.UUID(),
+                    type_=sa.String(),
+                    existing_nullable=False,
+                    postgresql_using='evaluator_id::text')
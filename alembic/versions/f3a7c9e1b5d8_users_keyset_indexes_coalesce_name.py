@@ -0,0 +1,40 @@
+"""Users keyset pagination indexes on coalesce(name, '')
+
+Revision ID: f3a7c9e1b5d8
+Revises: e8b2d4f6a1c3
+Create Date: 2026-10-18 16:40:12.304918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a7c9e1b5d8'
+down_revision: Union[str, None] = 'e8b2d4f6a1c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (nome do índice, coluna do filtro antes do nome)
+INDEXES = (
+    ('ix_users_name_id', None),
+    ('ix_users_category_name_id', 'category'),
+    ('ix_users_user_type_name_id', 'user_type'),
+    ('ix_users_institution_name_id', 'institution'),
+)
+
+
+def upgrade() -> None:
+    # name aceita NULL: o cursor compara (coalesce(name, ''), id) para não pular usuários sem nome
+    for name, prefix in INDEXES:
+        op.drop_index(name, table_name='users')
+        op.create_index(name, 'users', [*filter(None, [prefix]), sa.text("coalesce(name, '')"), 'id'],
+                        unique=False)
+    op.execute('ANALYZE users')
+
+
+def downgrade() -> None:
+    for name, prefix in INDEXES:
+        op.drop_index(name, table_name='users')
+        op.create_index(name, 'users', [*filter(None, [prefix]), 'name', 'id'], unique=False)
@@ -0,0 +1,316 @@
+"""
+Estatísticas das notas para os organizadores: distribuição e variância por critério,
+concordância entre avaliadores e avaliadores fora da curva.
+
+As notas saem do banco de uma vez por COPY, já codificadas como inteiros
+(dense_rank de avaliador, participante e categoria+critério), e viram a matriz
+avaliador × participante × critério (NaN onde não há nota). Todas as contas são
+vetorizadas com NumPy, o que mantém a análise em segundos com centenas de milhares de notas.
+"""
+import asyncio
+import csv
+import io
+import logging
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import reports
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Limite de células da matriz (8 bytes cada); acima disso a análise é recusada
+ANALYTICS_MAX_CELLS = int(os.getenv("ANALYTICS_MAX_CELLS", "20000000"))
+# Avaliador é marcado como fora da curva com |z do viés| acima deste valor...
+ANALYTICS_OUTLIER_Z = float(os.getenv("ANALYTICS_OUTLIER_Z", "2.0"))
+# ...ou com correlação com o consenso dos outros avaliadores abaixo deste
+ANALYTICS_MIN_CORRELATION = float(os.getenv("ANALYTICS_MIN_CORRELATION", "0.3"))
+
+TABLES = ("criteria", "evaluators", "distribution")
+FORMATS = ("json", "csv", "parquet")
+
+RATINGS_COPY_SQL = """
+    COPY (
+        SELECT dense_rank() OVER (ORDER BY evaluator_id) - 1,
+               dense_rank() OVER (ORDER BY evaluated_user_id) - 1,
+               dense_rank() OVER (ORDER BY category, criteria) - 1,
+               rating
+        FROM image_ratings
+    ) TO STDOUT
+"""
+
+
+class RatingsData:
+    def __init__(self, codes: np.ndarray, evaluators: list, participants: list, items: list):
+        # codes: (N, 4) com avaliador, participante, item (categoria+critério) e nota
+        self.codes = codes
+        self.evaluators = evaluators
+        self.participants = participants
+        self.items = items
+
+    @property
+    def shape(self) -> tuple:
+        return len(self.evaluators), len(self.participants), len(self.items)
+
+
+async def load_ratings(db: AsyncSession) -> RatingsData:
+    """
+    Lê image_ratings por COPY na conexão do asyncpg. Os rótulos são lidos antes, na
+    mesma transação REPEATABLE READ, para que a ordem do dense_rank bata com eles.
+    """
+    conn = await db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    result = await conn.execute(text("""
+        SELECT r.evaluator_id, u.name
+        FROM (SELECT DISTINCT evaluator_id FROM image_ratings) r
+        JOIN users u ON u.id = r.evaluator_id
+        ORDER BY r.evaluator_id
+    """))
+    evaluators = [(str(row.evaluator_id), row.name) for row in result.all()]
+    result = await conn.execute(text("SELECT DISTINCT evaluated_user_id FROM image_ratings ORDER BY 1"))
+    participants = [str(row[0]) for row in result.all()]
+    result = await conn.execute(text("SELECT DISTINCT category, criteria FROM image_ratings ORDER BY 1, 2"))
+    items = [(row.category, row.criteria) for row in result.all()]
+
+    buffer = io.BytesIO()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_from_query(RATINGS_COPY_SQL, output=buffer)
+    await db.rollback()
+
+    buffer.seek(0)
+    if buffer.getbuffer().nbytes:
+        codes = np.loadtxt(buffer, delimiter="\t", dtype=np.int64, ndmin=2)
+    else:
+        codes = np.empty((0, 4), dtype=np.int64)
+    return RatingsData(codes, evaluators, participants, items)
+
+
+def build_matrix(data: RatingsData) -> np.ndarray:
+    evaluators, participants, items = data.shape
+    if evaluators * participants * items > ANALYTICS_MAX_CELLS:
+        raise ValueError(f"Matriz grande demais para a análise ({evaluators}x{participants}x{items}).")
+    matrix = np.full(data.shape, np.nan)
+    matrix[data.codes[:, 0], data.codes[:, 1], data.codes[:, 2]] = data.codes[:, 3]
+    return matrix
+
+
+def _pearson(x: np.ndarray, y: np.ndarray, mask: np.ndarray, axis) -> np.ndarray:
+    # Correlação de Pearson só nas posições de mask, ao longo de axis
+    n = mask.sum(axis=axis)
+    x = np.where(mask, x, 0.0)
+    y = np.where(mask, y, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = x.sum(axis=axis, keepdims=True) / np.expand_dims(n, axis)
+        mean_y = y.sum(axis=axis, keepdims=True) / np.expand_dims(n, axis)
+        dx = np.where(mask, x - mean_x, 0.0)
+        dy = np.where(mask, y - mean_y, 0.0)
+        return (dx * dy).sum(axis=axis) / np.sqrt((dx ** 2).sum(axis=axis) * (dy ** 2).sum(axis=axis))
+
+
+def pairwise_correlation(matrix: np.ndarray) -> np.ndarray:
+    """
+    Correlação entre cada par de avaliadores, usando só as células que os dois avaliaram.
+    Calculada com produtos de matrizes (E x E) em vez de um laço sobre os pares.
+    """
+    flat = matrix.reshape(matrix.shape[0], matrix.shape[1] * matrix.shape[2])
+    observed = (~np.isnan(flat)).astype(np.float64)
+    values = np.nan_to_num(flat)
+    n = observed @ observed.T
+    sum_x = values @ observed.T
+    sum_xx = (values ** 2) @ observed.T
+    sum_xy = values @ values.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sum_xy - sum_x * sum_x.T / n
+        var_x = sum_xx - sum_x ** 2 / n
+        corr = cov / np.sqrt(var_x * var_x.T)
+    corr[n < 2] = np.nan
+    np.fill_diagonal(corr, np.nan)
+    return corr
+
+
+def icc_by_item(matrix: np.ndarray) -> np.ndarray:
+    """
+    ICC(1) de cada critério (ANOVA de um fator com grupos desbalanceados): quanto da
+    variância das notas vem da diferença entre participantes e não entre avaliadores.
+    """
+    observed = ~np.isnan(matrix)
+    k = observed.sum(axis=0)                                  # (P, C) notas por célula
+    total = k.sum(axis=0)                                     # (C,)
+    groups = (k > 0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cell_mean = np.nansum(matrix, axis=0) / k
+        grand_mean = np.nansum(matrix, axis=(0, 1)) / total
+        ss_between = np.nansum(k * (cell_mean - grand_mean) ** 2, axis=0)
+        ss_within = np.nansum((matrix - cell_mean) ** 2, axis=(0, 1))
+        ms_between = ss_between / (groups - 1)
+        ms_within = ss_within / (total - groups)
+        k0 = (total - (k ** 2).sum(axis=0) / total) / (groups - 1)
+        return (ms_between - ms_within) / (ms_between + (k0 - 1) * ms_within)
+
+
+def compute_statistics(data: RatingsData) -> dict:
+    matrix = build_matrix(data)
+    observed = ~np.isnan(matrix)
+    ratings = data.codes[:, 3].astype(np.float64)
+
+    # Por critério
+    item_count = observed.sum(axis=(0, 1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        item_mean = np.nansum(matrix, axis=(0, 1)) / item_count
+        item_var = np.nansum((matrix - item_mean) ** 2, axis=(0, 1)) / item_count
+        cell_count = observed.sum(axis=0)
+        cell_std = np.sqrt(np.nansum((matrix - np.nansum(matrix, axis=0) / cell_count) ** 2, axis=0) / cell_count)
+    cell_std[cell_count < 2] = np.nan
+    item_icc = icc_by_item(matrix)
+
+    # Por avaliador: viés em relação à média dos outros avaliadores na mesma célula
+    cell_sum = np.nansum(matrix, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        others_mean = (cell_sum - np.nan_to_num(matrix)) / (cell_count - 1)
+    compared = observed & (cell_count > 1)
+    deviation = np.where(compared, matrix - others_mean, np.nan)
+    evaluator_count = observed.sum(axis=(1, 2))
+    compared_count = compared.sum(axis=(1, 2))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        evaluator_mean = np.nansum(matrix, axis=(1, 2)) / evaluator_count
+        evaluator_std = np.sqrt(np.nansum((matrix - evaluator_mean[:, None, None]) ** 2, axis=(1, 2))
+                                / evaluator_count)
+        bias = np.nansum(deviation, axis=(1, 2)) / compared_count
+        mean_abs_deviation = np.nansum(np.abs(deviation), axis=(1, 2)) / compared_count
+        bias_z = (bias - np.nanmean(bias)) / np.nanstd(bias) if np.isfinite(bias).sum() > 1 else np.full_like(bias, np.nan)
+    consensus_corr = _pearson(matrix, others_mean, compared, axis=(1, 2))
+    pair_corr = pairwise_correlation(matrix)
+    with np.errstate(invalid="ignore"):
+        mean_pair_corr = np.array([np.nanmean(row) if np.isfinite(row).any() else np.nan for row in pair_corr])
+
+    evaluator_reasons = []
+    for z, corr in zip(bias_z, consensus_corr):
+        reasons = []
+        if np.isfinite(z) and abs(z) > ANALYTICS_OUTLIER_Z:
+            reasons.append("vies")
+        if np.isfinite(corr) and corr < ANALYTICS_MIN_CORRELATION:
+            reasons.append("baixa_correlacao")
+        evaluator_reasons.append(reasons)
+
+    # Distribuição das notas por critério
+    pairs, counts = np.unique(data.codes[:, [2, 3]], axis=0, return_counts=True) if len(data.codes) \
+        else (np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    upper = np.triu_indices(len(data.evaluators), k=1)
+    return {
+        "summary": {
+            "ratings": int(len(ratings)),
+            "evaluators": len(data.evaluators),
+            "participants": len(data.participants),
+            "criteria": len(data.items),
+            "mean": float(ratings.mean()) if len(ratings) else None,
+            "variance": float(ratings.var()) if len(ratings) else None,
+            "mean_pairwise_correlation": _nanmean(pair_corr[upper]),
+            "outlier_evaluators": sum(1 for reasons in evaluator_reasons if reasons),
+        },
+        "criteria": {
+            "category": [category for category, _ in data.items],
+            "criteria": [criteria for _, criteria in data.items],
+            "count": item_count,
+            "mean": item_mean,
+            "variance": item_var,
+            "std": np.sqrt(item_var),
+            "icc": item_icc,
+            "within_cell_std": np.array([_nanmean(cell_std[:, c]) for c in range(len(data.items))]),
+        },
+        "evaluators": {
+            "evaluator_id": [evaluator_id for evaluator_id, _ in data.evaluators],
+            "name": [name for _, name in data.evaluators],
+            "count": evaluator_count,
+            "mean": evaluator_mean,
+            "std": evaluator_std,
+            "bias": bias,
+            "bias_z": bias_z,
+            "mean_abs_deviation": mean_abs_deviation,
+            "consensus_correlation": consensus_corr,
+            "mean_pairwise_correlation": mean_pair_corr,
+            "outlier": [bool(reasons) for reasons in evaluator_reasons],
+            "outlier_reasons": [",".join(reasons) for reasons in evaluator_reasons],
+        },
+        "distribution": {
+            "category": [data.items[item][0] for item in pairs[:, 0]],
+            "criteria": [data.items[item][1] for item in pairs[:, 0]],
+            "rating": pairs[:, 1],
+            "count": counts,
+        },
+    }
+
+
+def _nanmean(values: np.ndarray) -> Optional[float]:
+    finite = values[np.isfinite(values)]
+    return float(finite.mean()) if len(finite) else None
+
+
+def _plain(value):
+    # numpy -> tipos do Python, NaN/inf -> None (JSON não tem NaN)
+    if isinstance(value, (np.floating, float)):
+        return float(value) if np.isfinite(value) else None
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return value
+
+
+def table_rows(columns: Dict[str, list]) -> List[dict]:
+    names = list(columns)
+    return [dict(zip(names, map(_plain, values))) for values in zip(*columns.values())]
+
+
+def to_json(statistics: dict) -> dict:
+    result = {"summary": statistics["summary"]}
+    for table in TABLES:
+        result[table] = table_rows(statistics[table])
+    return result
+
+
+def to_csv(statistics: dict, table: str) -> bytes:
+    columns = statistics[table]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in table_rows(columns):
+        writer.writerow("" if value is None else value for value in row.values())
+    return buffer.getvalue().encode("utf-8")
+
+
+def to_parquet(statistics: dict, table: str) -> bytes:
+    columns = {name: [_plain(value) for value in values] for name, values in statistics[table].items()}
+    buffer = io.BytesIO()
+    pq.write_table(pa.table(columns), buffer)
+    return buffer.getvalue()
+
+
+_statistics: Dict[str, dict] = {}
+_lock = asyncio.Lock()
+
+
+async def get_statistics(db: AsyncSession) -> Optional[dict]:
+    """
+    Estatísticas da versão atual das notas (mesma chave do relatório em PDF).
+    São recalculadas só quando alguma nota muda. Retorna None se não há notas.
+    """
+    version = await reports.ratings_version_key(db)
+    if version is None:
+        return None
+    async with _lock:
+        if version not in _statistics:
+            async with SessionLocal() as session:
+                data = await load_ratings(session)
+            # As contas liberam o GIL na maior parte; fora do loop para não travar as requisições
+            statistics = await asyncio.to_thread(compute_statistics, data)
+            statistics["summary"]["version"] = version
+            _statistics.clear()
+            _statistics[version] = statistics
+            logger.info("Estatísticas das notas recalculadas: %s", statistics["summary"])
+    return _statistics[version]
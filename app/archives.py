@@ -0,0 +1,104 @@
+"""
+ZIP com as imagens de uma categoria, de um conjunto de participantes ou de uma
+categoria de participante, gerado em streaming.
+
+As linhas vêm do cursor do servidor (crud.stream_images_archive) e cada blob é lido
+em blocos de CHUNK_SIZE e enviado logo em seguida, sem compressão (JPEG já é
+comprimido). A memória fica limitada a um bloco por vez, qualquer que seja o
+tamanho do arquivo final.
+
+Estrutura: <categoria>/<nome do participante>/<título>.jpg, com nomes repetidos
+numerados ("Foto (2).jpg").
+"""
+import logging
+import mimetypes
+import re
+import unicodedata
+import zipfile
+from functools import partial
+from typing import AsyncIterator, List, Optional
+from uuid import UUID
+
+from starlette.concurrency import iterate_in_threadpool
+
+from app import crud
+from app.database import stream_session
+from app.storage import CHUNK_SIZE, get_storage
+from app.zipstream import ZipStream
+
+logger = logging.getLogger(__name__)
+
+MAX_NAME_LENGTH = 80
+EXTENSIONS = {"image/jpeg": ".jpg", "image/jpg": ".jpg", "image/png": ".png"}
+
+# Proibidos no Windows e separadores de caminho; controle removido à parte
+_UNSAFE_CHARS = re.compile(r'[<>:"/\\|?*]')
+
+
+def safe_name(value: Optional[str], fallback: str) -> str:
+    # Tabulações e quebras de linha viram espaço antes de remover os caracteres de controle
+    value = re.sub(r"\s+", " ", unicodedata.normalize("NFC", value or ""))
+    value = "".join(char for char in value if unicodedata.category(char)[0] != "C")
+    value = _UNSAFE_CHARS.sub("_", value)
+    value = value.strip(" .")[:MAX_NAME_LENGTH].strip(" .")
+    return value or fallback
+
+
+class UniqueNames:
+    # Numera nomes repetidos dentro do mesmo diretório: "Foto", "Foto (2)", ...
+    def __init__(self):
+        self._used = set()
+
+    def take(self, directory: str, name: str, extension: str = "") -> str:
+        candidate, counter = name, 1
+        while (directory, (candidate + extension).lower()) in self._used:
+            counter += 1
+            candidate = f"{name} ({counter})"
+        self._used.add((directory, (candidate + extension).lower()))
+        return candidate + extension
+
+
+def extension_for(content_type: Optional[str]) -> str:
+    content_type = content_type or "image/jpeg"
+    return EXTENSIONS.get(content_type) or mimetypes.guess_extension(content_type) or ""
+
+
+async def images_archive(subcategory: Optional[str] = None, user_ids: List[UUID] = (),
+                         user_category: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+    Gera o ZIP. Abre a própria sessão, como exports.export_user_media. Blobs que
+    sumiram do storage são pulados e falhas de leitura no meio de uma entrada a
+    deixam incompleta (as duas registradas no log), já que a resposta já começou.
+    """
+    storage = get_storage()
+    archive = ZipStream(compression=zipfile.ZIP_STORED)
+    names = UniqueNames()
+    user_folders = {}
+    async with stream_session() as db:
+        async for row in crud.stream_images_archive(db, subcategory, user_ids, user_category):
+            # Abre o blob antes de criar a entrada: se foi liberado depois da consulta,
+            # fica fora do ZIP; aberto, continua legível mesmo se apagado em seguida
+            try:
+                source = storage.open(row.image_hash)
+            except OSError as e:
+                logger.warning("Blob %s da imagem %s indisponível (%s); fora do ZIP", row.image_hash, row.id, e)
+                continue
+
+            category_dir = safe_name(row.subcategory, "sem_categoria")
+            folder_key = (category_dir, row.user_id)
+            if folder_key not in user_folders:
+                user_folders[folder_key] = names.take(category_dir, safe_name(row.user_name, str(row.user_id)[:8]))
+            directory = f"{category_dir}/{user_folders[folder_key]}"
+            filename = names.take(directory, safe_name(row.title, str(row.id)[:8]), extension_for(row.content_type))
+
+            with source, archive.open(f"{directory}/{filename}", size=row.image_size) as entry:
+                try:
+                    async for chunk in iterate_in_threadpool(iter(partial(source.read, CHUNK_SIZE), b"")):
+                        entry.write(chunk)
+                        yield archive.drain()
+                except OSError:
+                    logger.exception("Falha ao ler o blob %s da imagem %s; entrada incompleta no ZIP",
+                                     row.image_hash, row.id)
+            # Data descriptor da entrada
+            yield archive.drain()
+    yield archive.close()
@@ -0,0 +1,215 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "avaliacao:")
+
+
+class CacheBackend:
+    """
+    Interface dos backends de cache. Os valores já chegam serializados (str),
+    então qualquer backend devolve uma cópia independente do objeto original.
+    """
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        raise NotImplementedError
+
+    async def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """
+    Cache no processo com expiração por TTL e remoção LRU acima de max_entries.
+    Cada worker do uvicorn tem o seu; use o RedisCache para compartilhar entre processos.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache(CacheBackend):
+    """
+    Backend compatível com Redis. Recebe qualquer cliente assíncrono com
+    get/set(ex=)/delete, o que permite trocar o servidor por um substituto local.
+    """
+
+    def __init__(self, client, prefix: str = CACHE_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = CACHE_PREFIX) -> "RedisCache":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requer o pacote 'redis' instalado.")
+        return cls(redis.from_url(url, decode_responses=True), prefix)
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.client.get(self.prefix + key)
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        return value
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        await self.client.set(self.prefix + key, value, ex=ttl)
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+
+class NullCache(CacheBackend):
+    # CACHE_BACKEND=none: desliga o cache sem mudar os chamadores
+    async def get(self, key: str) -> Optional[str]:
+        return None
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        pass
+
+    async def delete(self, *keys: str) -> None:
+        pass
+
+
+CACHE_BACKENDS = {
+    "memory": lambda: MemoryCache(),
+    "redis": lambda: RedisCache.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")),
+    "none": lambda: NullCache(),
+}
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+        self.invalidations: Dict[str, int] = defaultdict(int)
+        self.errors = 0
+
+    def as_dict(self) -> dict:
+        namespaces = set(self.hits) | set(self.misses) | set(self.invalidations)
+        result = {}
+        for namespace in sorted(namespaces):
+            hits, misses = self.hits[namespace], self.misses[namespace]
+            result[namespace] = {
+                "hits": hits,
+                "misses": misses,
+                "invalidations": self.invalidations[namespace],
+                "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+            }
+        return result
+
+
+cache_stats = CacheStats()
+_cache: Optional[CacheBackend] = None
+
+
+def get_cache() -> CacheBackend:
+    global _cache
+    if _cache is None:
+        if CACHE_BACKEND not in CACHE_BACKENDS:
+            raise RuntimeError(f"Backend de cache desconhecido: {CACHE_BACKEND}")
+        _cache = CACHE_BACKENDS[CACHE_BACKEND]()
+    return _cache
+
+
+def set_cache(backend: CacheBackend) -> None:
+    # Permite injetar outro backend (ex.: RedisCache com um cliente local)
+    global _cache
+    _cache = backend
+
+
+def _key(namespace: str, key: Any) -> str:
+    return f"{namespace}:{key}"
+
+
+async def get_or_load(namespace: str, key: Any, loader: Callable[[], Awaitable[Optional[dict]]],
+                      ttl: int = CACHE_TTL) -> Optional[dict]:
+    """
+    Leitura com cache: devolve o dict em cache ou chama loader() e guarda o resultado.
+    None (registro inexistente) não é guardado. Falhas do backend caem para o loader.
+    """
+    cache_key = _key(namespace, key)
+    try:
+        cached = await get_cache().get(cache_key)
+    except Exception as e:
+        cache_stats.errors += 1
+        logger.warning("Falha ao ler do cache: %s", e)
+        return await loader()
+
+    if cached is not None:
+        cache_stats.hits[namespace] += 1
+        return json.loads(cached)
+
+    cache_stats.misses[namespace] += 1
+    value = await loader()
+    if value is None:
+        return None
+    serialized = json.dumps(value, default=str)
+    try:
+        await get_cache().set(cache_key, serialized, ttl)
+    except Exception as e:
+        cache_stats.errors += 1
+        logger.warning("Falha ao gravar no cache: %s", e)
+    # Mesmo formato de um acerto (UUIDs e datas como texto), com ou sem cache
+    return json.loads(serialized)
+
+
+async def invalidate(namespace: str, *keys: Any) -> None:
+    if not keys:
+        return
+    cache_stats.invalidations[namespace] += len(keys)
+    try:
+        await get_cache().delete(*(_key(namespace, key) for key in keys))
+    except Exception as e:
+        cache_stats.errors += 1
+        logger.error("Falha ao invalidar o cache (%s): %s", namespace, e)
+
+
+def cache_status() -> dict:
+    backend = get_cache()
+    status = {"backend": type(backend).__name__, "ttl": CACHE_TTL, "errors": cache_stats.errors,
+              "namespaces": cache_stats.as_dict()}
+    if isinstance(backend, MemoryCache):
+        status["entries"] = len(backend)
+        status["max_entries"] = backend.max_entries
+    return status
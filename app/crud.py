@@ -1,118 +1,438 @@
+import os
 import uuid
+from datetime import timezone
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, load_only, selectinload, undefer, undefer_group
 from . import models, schemas
-from typing import List, Optional
+from typing import BinaryIO, List, Optional, Union
 from app.utils import *
 from uuid import UUID
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 import logging
 from .models import ImageRating
 from app.schemas import RatingItem
-from sqlalchemy import and_, cast, or_
+from sqlalchemy import and_, any_, bindparam, delete, literal_column, or_, select, text, true, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, JSON, aggregate_order_by, insert
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import UUID
-logging.basicConfig(level=logging.DEBUG)
+from app.storage import get_storage, CHUNK_SIZE
+from app.mailer import enqueue_email
+from app import cache, ranking
 logger = logging.getLogger(__name__)
 
-def create_user(db: Session, user: schemas.UserCreate, file_content: bytes = None):
+# "stateless": o login não grava nada no banco; "db": mantém o registro em tokens a cada login
+TOKEN_STORE_MODE = os.getenv("TOKEN_STORE_MODE", "stateless")
+TOKEN_EXPIRATION = timedelta(days=5)
+# Revogações persistidas na tabela tokens usam este prefixo no lugar do token completo
+REVOKED_TOKEN_PREFIX = "jti:"
+# Linhas por lote no cursor do servidor das exportações em streaming (médias, ZIP de imagens)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate, file_content: Union[bytes, BinaryIO] = None,
+                      file_content_type: str = "application/pdf", email: Optional[schemas.EmailContent] = None):
     if user.document or user.email:
-        db_user_existing = db.query(models.User).filter(
+        result = await db.execute(select(models.User.id).filter(
             (models.User.email == user.email) | (models.User.document == user.document)
-        ).first()
+        ).limit(1))
 
-        if db_user_existing:
+        if result.first():
             return None
 
-    hashed_password = hash_password(user.password)
+    hashed_password = await hash_password_async(user.password)
+    stored_file = await store_blob(db, file_content) if file_content else None
     db_user = models.User(name=user.name,
                           document=user.document,
                           email=user.email,
                           user_type=user.user_type,
-                          file=file_content,
+                          file_hash=stored_file.sha256 if stored_file else None,
+                          file_size=stored_file.size if stored_file else None,
+                          file_content_type=file_content_type if stored_file else None,
                           password=hashed_password,
                           category=user.category,
                           cep=user.cep,
                           complete_address=user.complete_address,
                           institution=user.institution)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    if email:
+        # Vai para a outbox na mesma transação do cadastro
+        enqueue_email(db, user.email, email.subject, email.content)
+    await commit_or_release_blob(db, stored_file.sha256 if stored_file else None)
+    await db.refresh(db_user)
     return db_user
 
-def get_user_by_id(db: Session, user_id: UUID):
-    return db.query(models.User).filter(models.User.id == user_id).first()
-
-def get_users(db: Session, skip: int = 0, limit: int = 10) -> List[models.User]:
-    return db.query(models.User).offset(skip).limit(limit).all()
-
-def update_password(db: Session, user_id: UUID, password: str):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+async def get_existing_emails_and_documents(db: AsyncSession, emails: List[str], documents: List[str]):
+    # Uma consulta para deduplicar um lote inteiro contra os usuários já cadastrados
+    result = await db.execute(
+        select(models.User.email, models.User.document)
+        .filter(or_(models.User.email.in_(emails), models.User.document.in_(documents)))
+    )
+    rows = result.all()
+    return {row.email for row in rows}, {row.document for row in rows}
+
+async def create_users_bulk(db: AsyncSession, users: List[dict], emails: dict) -> set:
+    """
+    Insere vários usuários (colunas já prontas, com a senha em hash) e seus e-mails
+    de boas-vindas em uma única transação. emails mapeia e-mail -> schemas.EmailContent.
+    Retorna os e-mails efetivamente inseridos; conflitos com cadastros concorrentes são ignorados.
+    """
+    if not users:
+        return set()
+    result = await db.execute(
+        insert(models.User)
+        .values([{"id": uuid.uuid4(), **user} for user in users])
+        .on_conflict_do_nothing()
+        .returning(models.User.email)
+    )
+    inserted = set(result.scalars().all())
+    for email in inserted:
+        enqueue_email(db, email, emails[email].subject, emails[email].content)
+    await db.commit()
+    return inserted
+
+async def get_user_by_id(db: AsyncSession, user_id: UUID):
+    result = await db.execute(select(models.User).filter(models.User.id == user_id))
+    return result.scalars().first()
+
+async def get_user_metadata(db: AsyncSession, user_id: UUID):
+    """
+    Leitura com cache (app/cache.py) para permissões, perfil e download do documento.
+    Devolve um models.User fora da sessão e sem a senha: use get_user_by_id para alterar o usuário.
+    """
+    async def load():
+        db_user = await get_user_by_id(db, user_id)
+        return _to_cache_dict(db_user) if db_user else None
+
+    data = await cache.get_or_load("user", user_id, load)
+    return _from_cache_dict(models.User, data) if data else None
+
+USER_COUNT_CACHE_TTL = int(os.getenv("USER_COUNT_CACHE_TTL", "60"))
+
+def users_filter(category: Optional[str] = None, user_type: Optional[str] = None,
+                 institution: Optional[str] = None) -> list:
+    conditions = []
+    if category:
+        conditions.append(models.User.category == category)
+    if user_type:
+        conditions.append(models.User.user_type == user_type)
+    if institution:
+        conditions.append(models.User.institution == institution)
+    return conditions
+
+def users_page_statement(limit: int = 10, after: Optional[tuple] = None, category: Optional[str] = None,
+                         user_type: Optional[str] = None, institution: Optional[str] = None, skip: int = 0):
+    # Mesma expressão dos índices ix_users_*_name_id: usuários sem nome entram como "".
+    # O '' vai literal no SQL; como parâmetro o Postgres não reconhece o índice de expressão
+    sort_name = func.coalesce(models.User.name, literal_column("''"))
+    query = (
+        select(models.User)
+        .filter(*users_filter(category, user_type, institution))
+        .order_by(sort_name, models.User.id)
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.filter(tuple_(sort_name, models.User.id) > tuple_(*after))
+    elif skip:
+        query = query.offset(skip)
+    return query
+
+async def get_users(db: AsyncSession, limit: int = 10, after: Optional[tuple] = None,
+                    category: Optional[str] = None, user_type: Optional[str] = None,
+                    institution: Optional[str] = None, skip: int = 0) -> List[models.User]:
+    """
+    Página de usuários ordenada por (name, id), com nome nulo como "". `after` é o (name, id) do último
+    usuário da página anterior: a busca continua do índice a partir desse ponto,
+    então páginas profundas custam o mesmo que a primeira. `skip` (offset) só existe
+    por compatibilidade.
+    """
+    result = await db.execute(users_page_statement(limit, after, category, user_type, institution, skip))
+    return result.scalars().all()
+
+async def count_users(db: AsyncSession, category: Optional[str] = None, user_type: Optional[str] = None,
+                      institution: Optional[str] = None) -> int:
+    """
+    Total aproximado para a paginação. Sem filtros usa a estimativa do planner
+    (pg_class.reltuples, atualizada pelo ANALYZE/autovacuum); com filtros faz o
+    COUNT, que fica em cache por USER_COUNT_CACHE_TTL segundos.
+    """
+    async def load():
+        conditions = users_filter(category, user_type, institution)
+        if not conditions:
+            estimate = await db.scalar(text(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass"
+            ))
+            # -1: tabela ainda não analisada
+            if estimate is not None and estimate >= 0:
+                return {"count": estimate}
+        total = await db.scalar(select(func.count()).select_from(models.User).filter(*conditions))
+        return {"count": total}
+
+    key = f"{category or ''}|{user_type or ''}|{institution or ''}"
+    data = await cache.get_or_load("user_count", key, load, ttl=USER_COUNT_CACHE_TTL)
+    return data["count"]
+
+async def update_password(db: AsyncSession, user_id: UUID, password: str):
+    db_user = await get_user_by_id(db, user_id)
     if db_user:
-        hashed_password = hash_password(password)
+        hashed_password = await hash_password_async(password)
         db_user.password = hashed_password
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+        await cache.invalidate("user", user_id)
     return db_user
 
-def delete_user(db: Session, user_id: UUID):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+async def delete_user(db: AsyncSession, user_id: UUID):
+    # As notas dadas e recebidas por este usuário são apagadas em cascata; desconta-as antes dos agregados
+    result = await db.execute(evaluator_contributions_statement(user_id))
+    aggregate_deltas, criterion_deltas = {}, {}
+    for row in result.all():
+        key = (row.evaluated_user_id, row.category)
+        rating_sum, rating_count = aggregate_deltas.get(key, (0, 0))
+        aggregate_deltas[key] = (rating_sum - row.rating_sum, rating_count - row.rating_count)
+        criterion_deltas[key + (row.criteria,)] = (-row.rating_sum, -row.rating_count)
+    await apply_rating_aggregate_deltas(db, aggregate_deltas)
+    await apply_criterion_aggregate_deltas(db, criterion_deltas)
+
+    # A linha do próprio usuário em evaluator_stats sai em cascata; as dos avaliadores dele perdem as notas
+    result = await db.execute(received_ratings_statement(user_id))
+    stats_deltas = {
+        row.evaluator_id: (-row.rating_sum, -row.rating_sq_sum, -row.rating_count)
+        for row in result.all()
+    }
+    await apply_evaluator_stats_deltas(db, stats_deltas)
+
+    # As imagens precisam estar carregadas para o ORM desvincular o usuário (sem lazy load no async)
+    result = await db.execute(
+        select(models.User).options(selectinload(models.User.images)).filter(models.User.id == user_id)
+    )
+    db_user = result.scalars().first()
     if db_user:
-        db.delete(db_user)
-        db.commit()
+        file_hash = db_user.file_hash
+        # As imagens ficam sem dono; o user_id em cache delas também precisa sair
+        image_ids = [image.id for image in db_user.images]
+        await db.delete(db_user)
+        await db.commit()
+        ranking.apply_deltas(user_id, criterion_deltas, stats_deltas)
+        ranking.remove_user(user_id)
+        await cache.invalidate("user", user_id)
+        await cache.invalidate("image", *image_ids)
+        await release_blob(db, file_hash)
     return db_user
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if user and verify_password(password, user.password):
-        return user
-    return None
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    result = await db.execute(
+        select(models.User)
+        .options(load_only(models.User.id, models.User.name, models.User.email, models.User.user_type),
+                 undefer(models.User.password))
+        .filter(models.User.email == email)
+    )
+    user = result.scalars().first()
+    if not user:
+        return None
+
+    valid, new_hash = await verify_and_update_password(password, user.password)
+    if not valid:
+        return None
+    if new_hash:
+        # Custo do bcrypt mudou: regrava o hash de forma transparente
+        user.password = new_hash
+        await db.commit()
+    return user
 
 
-def generate_token_for_user(db: Session, user_id: UUID):
+async def generate_token_for_user(db: AsyncSession, user_id: UUID):
     token_data = {"sub": str(user_id)}
-    token = create_access_token(token_data)
+    expiration_date = datetime.utcnow() + TOKEN_EXPIRATION
+    token = create_access_token(token_data, expires_delta=TOKEN_EXPIRATION)
 
-    db_token = models.Token(token=token, expiration_date=datetime.utcnow() + timedelta(days=5))
-    db.add(db_token)
-    db.commit()
+    if TOKEN_STORE_MODE == "db":
+        db.add(models.Token(token=token, expiration_date=expiration_date))
+        await db.commit()
 
     return {
-        "token": db_token.token,
-        "expiration_date": db_token.expiration_date
+        "token": token,
+        "expiration_date": expiration_date
     }
 
-def upload_image(db: Session, image: schemas.ImageCreate):
+async def save_revoked_tokens(db: AsyncSession, revoked: List[tuple]):
+    """
+    Grava as revogações pendentes da denylist (jti, expiração em epoch) para que
+    sobrevivam a um restart.
+    """
+    if not revoked:
+        return
+    rows = [
+        {"token": REVOKED_TOKEN_PREFIX + jti, "expiration_date": datetime.utcfromtimestamp(expires_at)}
+        for jti, expires_at in revoked
+    ]
+    await db.execute(insert(models.Token).values(rows).on_conflict_do_nothing(index_elements=["token"]))
+    await db.commit()
+
+async def get_revoked_tokens(db: AsyncSession) -> List[tuple]:
+    result = await db.execute(
+        select(models.Token.token, models.Token.expiration_date).filter(
+            models.Token.token.startswith(REVOKED_TOKEN_PREFIX),
+            models.Token.expiration_date > datetime.utcnow()
+        )
+    )
+    return [
+        (row.token[len(REVOKED_TOKEN_PREFIX):], row.expiration_date.replace(tzinfo=timezone.utc).timestamp())
+        for row in result.all()
+    ]
+
+async def purge_expired_tokens(db: AsyncSession, batch_size: int = 1000) -> int:
+    # Apaga em lotes para não segurar locks nem gerar uma transação enorme
+    total = 0
+    while True:
+        expired = (
+            select(models.Token.token)
+            .filter(models.Token.expiration_date < datetime.utcnow())
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        result = await db.execute(delete(models.Token).where(models.Token.token.in_(expired)))
+        await db.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+
+async def upload_image(db: AsyncSession, image: schemas.ImageCreate):
     db_image = models.Image(
         user_id=image.user_id,
-        image_data=image.image_data,
+        image_hash=image.image_hash,
+        image_size=image.image_size,
+        content_type=image.content_type,
         subcategory=image.subcategory,
         description=image.description,
         title=image.title,
         place=image.place,
         equipment=image.equipment
     )
-    print(db_image.__dict__)
     db.add(db_image)
-    db.commit()
-    db.refresh(db_image)
+    await commit_or_release_blob(db, image.image_hash)
+    await db.refresh(db_image)
 
     return db_image
 
-def get_image_by_id(db:Session,image_id: UUID):
-    return db.query(models.Image).filter(models.Image.id == image_id).first()
+async def get_image_by_id(db: AsyncSession, image_id: UUID):
+    result = await db.execute(select(models.Image).filter(models.Image.id == image_id))
+    return result.scalars().first()
 
-def delete_image(db: Session, image_id: UUID):
-    db_image = db.query(models.Image).filter(models.Image.id == image_id).first()
+async def load_image_metadata(db: AsyncSession, image_id: UUID):
+    # Carrega os campos descritivos (deferidos por padrão) em uma única consulta
+    result = await db.execute(
+        select(models.Image)
+        .options(undefer_group("details"))
+        .filter(models.Image.id == image_id)
+    )
+    return result.scalars().first()
+
+async def get_image_metadata(db: AsyncSession, image_id: UUID):
+    """
+    Leitura com cache dos metadados da imagem (incluindo hash e campos descritivos).
+    Devolve um models.Image fora da sessão, só para leitura.
+    """
+    async def load():
+        db_image = await load_image_metadata(db, image_id)
+        return _to_cache_dict(db_image) if db_image else None
+
+    data = await cache.get_or_load("image", image_id, load)
+    return _from_cache_dict(models.Image, data) if data else None
+
+def images_metadata_bulk_statement(image_ids: List[UUID] = (), user_ids: List[UUID] = (),
+                                   subcategory: Optional[str] = None):
+    # Um único parâmetro array por lista: o texto do SQL não muda com a quantidade de IDs
+    # e o prepared statement do asyncpg é reaproveitado
+    uuid_array = ARRAY(UUID(as_uuid=True))
+    conditions = []
+    if image_ids:
+        conditions.append(models.Image.id == any_(bindparam("image_ids", list(image_ids), type_=uuid_array)))
+    if user_ids:
+        conditions.append(models.Image.user_id == any_(bindparam("user_ids", list(user_ids), type_=uuid_array)))
+
+    query = select(
+        models.Image.id, models.Image.user_id, models.Image.subcategory, models.Image.title,
+        models.Image.description, models.Image.place, models.Image.equipment, models.Image.image_hash,
+    ).filter(or_(*conditions))
+    if subcategory:
+        query = query.filter(models.Image.subcategory == subcategory)
+    return query.order_by(models.Image.user_id, models.Image.id)
+
+def images_archive_statement(subcategory: Optional[str] = None, user_ids: List[UUID] = (),
+                             user_category: Optional[str] = None):
+    # Imagens do arquivo ZIP com o nome do dono, na ordem de ix_images_user_id_subcategory
+    query = (
+        select(
+            models.Image.id, models.Image.user_id, models.Image.subcategory, models.Image.title,
+            models.Image.image_hash, models.Image.image_size, models.Image.content_type,
+            models.User.name.label("user_name"),
+        )
+        .join(models.User, models.Image.user_id == models.User.id)
+        .filter(models.Image.image_hash.is_not(None))
+    )
+    if subcategory:
+        query = query.filter(models.Image.subcategory == subcategory)
+    if user_ids:
+        uuid_array = ARRAY(UUID(as_uuid=True))
+        query = query.filter(models.Image.user_id == any_(bindparam("user_ids", list(user_ids), type_=uuid_array)))
+    if user_category:
+        query = query.filter(models.User.category == user_category)
+    return query.order_by(models.Image.user_id, models.Image.subcategory, models.Image.id)
+
+async def stream_images_archive(db: AsyncSession, subcategory: Optional[str] = None, user_ids: List[UUID] = (),
+                                user_category: Optional[str] = None):
+    result = await db.stream(
+        images_archive_statement(subcategory, user_ids, user_category).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    async for row in result:
+        yield row
+
+async def get_images_metadata_bulk(db: AsyncSession, image_ids: List[UUID] = (), user_ids: List[UUID] = (),
+                                   subcategory: Optional[str] = None):
+    """
+    Metadados de várias imagens em uma consulta (id = ANY(...) OR user_id = ANY(...)),
+    só com as colunas exibidas na galeria. Devolve linhas (Row), não objetos do ORM.
+    """
+    if not image_ids and not user_ids:
+        return []
+    result = await db.execute(images_metadata_bulk_statement(image_ids, user_ids, subcategory))
+    return result.all()
+
+# Colunas que nunca vão para o cache
+CACHE_EXCLUDED_COLUMNS = {"password"}
+
+def _to_cache_dict(obj) -> dict:
+    return {
+        column.key: getattr(obj, column.key)
+        for column in obj.__table__.columns
+        if column.key not in CACHE_EXCLUDED_COLUMNS
+    }
+
+def _from_cache_dict(model, data: dict):
+    values = {}
+    for column in model.__table__.columns:
+        if column.key in data:
+            value = data[column.key]
+            if value is not None and isinstance(column.type, UUID):
+                value = uuid.UUID(value)
+            values[column.key] = value
+    return model(**values)
+
+async def delete_image(db: AsyncSession, image_id: UUID):
+    db_image = await get_image_by_id(db, image_id)
 
     if db_image:
-        db.delete(db_image)
-        db.commit()
+        image_hash = db_image.image_hash
+        await db.delete(db_image)
+        await db.commit()
+        await cache.invalidate("image", image_id)
+        await release_blob(db, image_hash)
 
     return db_image
 
-async def update_image(db: Session, image_id: UUID, new_image: Optional[UploadFile], description:Optional[str] = None):
-    db_image = db.query(models.Image).filter(models.Image.id == image_id).first()
+async def update_image(db: AsyncSession, image_id: UUID, new_image: Optional[UploadFile], description:Optional[str] = None):
+    db_image = await load_image_metadata(db, image_id)
 
     if not db_image:
         return None
@@ -120,72 +440,349 @@ async def update_image(db: Session, image_id: UUID, new_image: Optional[UploadFi
     if description is not None:
         db_image.description = description
 
+    old_hash = None
     if new_image:
-        image_data = await new_image.read()
-        db_image.image_data = image_data  # Atualiza o campo binário da imagem
+        # Copia o upload em pedaços para o blob storage, sem carregar o arquivo inteiro
+        with get_storage().writer() as writer:
+            while chunk := await new_image.read(CHUNK_SIZE):
+                await run_in_threadpool(writer.write, chunk)
+            await lock_blob(db, writer.sha256)
+            stored = await run_in_threadpool(writer.commit)
+        old_hash = db_image.image_hash
+        db_image.image_hash = stored.sha256
+        db_image.image_size = stored.size
+        db_image.content_type = new_image.content_type or "image/jpeg"
 
     # Commit das alterações no banco de dados
-    db.commit()
-    db.refresh(db_image)
+    await commit_or_release_blob(db, db_image.image_hash if new_image else None)
+    await cache.invalidate("image", image_id)
+    if old_hash and old_hash != db_image.image_hash:
+        await release_blob(db, old_hash)
 
     return db_image
 
-def get_images_by_user(db: Session, user_id: UUID, subcategory: Optional[str] = None):
-    query = db.query(models.Image).filter(models.Image.user_id == user_id)
+async def lock_blob(db: AsyncSession, blob_hash: str):
+    # Serializa por hash quem publica um blob e quem o apaga; o lock vai até o fim da transação
+    await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(blob_hash))))
+
+async def store_blob(db: AsyncSession, data: Union[bytes, BinaryIO]):
+    """
+    Grava o conteúdo no storage com o hash já travado na transação de db: um
+    release_blob concorrente do mesmo conteúdo espera o commit (e vê a referência)
+    ou termina antes e o arquivo é publicado de novo.
+    """
+    with get_storage().writer() as writer:
+        await run_in_threadpool(writer.write_all, data)
+        await lock_blob(db, writer.sha256)
+        return await run_in_threadpool(writer.commit)
+
+async def commit_or_release_blob(db: AsyncSession, blob_hash: Optional[str]):
+    # O blob foi gravado antes do commit; se o commit falhar ele não pode ficar órfão no storage
+    try:
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        try:
+            await release_blob(db, blob_hash)
+        except Exception:
+            logger.exception("Erro ao liberar o blob %s após falha no commit", blob_hash)
+        raise
+
+async def release_blob(db: AsyncSession, blob_hash: Optional[str]):
+    """
+    Remove o blob do storage quando nenhuma imagem ou usuário o referencia mais.
+    Como o storage é endereçado por conteúdo, arquivos idênticos são compartilhados.
+    Verificação e remoção acontecem com o hash travado (lock_blob), na própria transação.
+    """
+    if not blob_hash:
+        return
+    await lock_blob(db, blob_hash)
+    in_use = await db.scalar(
+        select(
+            select(models.Image.id).filter(models.Image.image_hash == blob_hash).exists()
+            | select(models.User.id).filter(models.User.file_hash == blob_hash).exists()
+        )
+    )
+    if not in_use:
+        await run_in_threadpool(get_storage().delete, blob_hash)
+    await db.commit()
+
+async def get_images_by_user(db: AsyncSession, user_id: UUID, subcategory: Optional[str] = None):
+    query = select(models.Image).filter(models.Image.user_id == user_id)
 
     if subcategory:
         query = query.filter(models.Image.subcategory == subcategory)
 
-    return query.all()
+    result = await db.execute(query)
+    return result.scalars().all()
+
+async def get_image_ids_by_user(db: AsyncSession, user_id: UUID, subcategory: Optional[str] = None) -> List[UUID]:
+    query = select(models.Image.id).filter(models.Image.user_id == user_id)
+
+    if subcategory:
+        query = query.filter(models.Image.subcategory == subcategory)
 
+    result = await db.execute(query)
+    return result.scalars().all()
 
-def set_user_rating(
-    db: Session,
+async def count_images_by_user(db: AsyncSession, user_id: UUID, subcategory: Optional[str] = None) -> int:
+    query = select(func.count(models.Image.id)).filter(models.Image.user_id == user_id)
+
+    if subcategory:
+        query = query.filter(models.Image.subcategory == subcategory)
+
+    return await db.scalar(query)
+
+
+async def set_user_rating(
+    db: AsyncSession,
     evaluated_user_id: UUID,
     ratings: List[RatingItem],
     evaluator_id: UUID,
     category: str
 ):
-    user_data = get_user_by_id(db=db, user_id=evaluator_id)
-    if user_data.user_type != 'A':
-        raise HTTPException(status_code=403, detail="Apenas usuário avaliador pode dar notas.")
-
-    evaluated_user = get_user_by_id(db=db, user_id=evaluated_user_id)
-    if not evaluated_user:
-        raise HTTPException(status_code=404, detail="Usuário avaliado não encontrado.")
-
-    for rating_item in ratings:
-        # Verifica se já existe nota para o critério informado
-        existing = db.query(ImageRating).filter_by(
-            evaluator_id=str(evaluator_id),
-            evaluated_user_id=str(evaluated_user_id),
-            category=category,
-            criteria=rating_item.criteria
-        ).first()
-
-        if existing:
-            existing.rating = rating_item.score  # Atualiza nota existente
-        else:
-            new_rating = ImageRating(
-                evaluator_id=str(evaluator_id),
-                evaluated_user_id=str(evaluated_user_id),
-                category=category,
-                rating=rating_item.score,
-                criteria=rating_item.criteria
-            )
-            db.add(new_rating)
-
-    db.commit()
+    return await set_user_ratings(
+        db=db,
+        evaluator_id=evaluator_id,
+        items=[schemas.RateBatchItem(evaluated_user_id=evaluated_user_id, ratings=ratings, category=category)]
+    )
+
+async def set_user_ratings(db: AsyncSession, evaluator_id: UUID, items: List[schemas.RateBatchItem]):
+    """
+    Grava as notas de um avaliador para um ou mais participantes com uma consulta
+    de verificação dos usuários e um único INSERT ... ON CONFLICT DO UPDATE.
+    """
+    user_ids = {evaluator_id} | {item.evaluated_user_id for item in items}
+    result = await db.execute(
+        select(models.User.id, models.User.user_type, models.User.name, models.User.category)
+        .filter(models.User.id.in_(user_ids))
+    )
+    users = result.all()
+    user_types = {row.id: row.user_type for row in users}
+
+    if user_types.get(evaluator_id) != 'A':
+        raise HTTPException(status_code=400, detail="O usuario nao é avaliador.")
+
+    missing = [str(item.evaluated_user_id) for item in items if item.evaluated_user_id not in user_types]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Usuário avaliado não encontrado: {', '.join(missing)}")
+
+    # Serializa as gravações do mesmo avaliador para que o delta dos agregados seja consistente
+    await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(str(evaluator_id)))))
+    result = await db.execute(previous_ratings_statement(
+        evaluator_id, [(item.evaluated_user_id, item.category) for item in items]
+    ))
+    previous = {(row.evaluated_user_id, row.category, row.criteria): row.rating for row in result.all()}
+
+    rows = [
+        {
+            "id": str(uuid.uuid4()),
+            "evaluator_id": evaluator_id,
+            "evaluated_user_id": item.evaluated_user_id,
+            "category": item.category,
+            "rating": rating_item.score,
+            "criteria": rating_item.criteria,
+        }
+        for item in items
+        for rating_item in item.ratings
+    ]
+    stmt = insert(ImageRating).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_image_ratings_evaluator_user_category_criteria",
+        set_={"rating": stmt.excluded.rating}  # Atualiza nota existente
+    )
+    await db.execute(stmt)
+
+    deltas, criterion_deltas = {}, {}
+    stats_sum = stats_sq_sum = stats_count = 0
+    for row in rows:
+        key = (row["evaluated_user_id"], row["category"])
+        criterion_key = key + (row["criteria"],)
+        old_rating = previous.get(criterion_key)
+        new_count = 1 if old_rating is None else 0
+        old_rating = old_rating or 0
+        rating_sum, rating_count = deltas.get(key, (0, 0))
+        deltas[key] = (rating_sum + row["rating"] - old_rating, rating_count + new_count)
+        criterion_deltas[criterion_key] = (row["rating"] - old_rating, new_count)
+        stats_sum += row["rating"] - old_rating
+        stats_sq_sum += row["rating"] ** 2 - old_rating ** 2
+        stats_count += new_count
+    stats_deltas = {evaluator_id: (stats_sum, stats_sq_sum, stats_count)}
+    await apply_rating_aggregate_deltas(db, deltas)
+    await apply_criterion_aggregate_deltas(db, criterion_deltas)
+    await apply_evaluator_stats_deltas(db, stats_deltas)
+
+    await db.commit()
+    # Só depois do commit: o índice do ranking não pode ver notas que podem sofrer rollback
+    ranking.apply_deltas(evaluator_id, criterion_deltas, stats_deltas,
+                         users={row.id: (row.name, row.category) for row in users if row.id != evaluator_id})
     return True
 
-def get_image_rating(db: Session, user_id: str, category: str, evaluator_id: str):
-    image_rating = db.query(models.ImageRating).filter(
+async def _apply_additive_deltas(db: AsyncSession, model, key_columns: tuple, value_columns: tuple, deltas: dict):
+    # INSERT ... ON CONFLICT DO UPDATE somando os deltas aos valores atuais
+    rows = [
+        dict(zip(key_columns, key if isinstance(key, tuple) else (key,)), **dict(zip(value_columns, values)))
+        for key, values in deltas.items()
+        if any(values)
+    ]
+    if not rows:
+        return
+    stmt = insert(model).values(rows)
+    set_ = {column: getattr(model, column) + getattr(stmt.excluded, column) for column in value_columns}
+    set_["updated_at"] = func.now()
+    await db.execute(stmt.on_conflict_do_update(index_elements=list(key_columns), set_=set_))
+
+async def apply_rating_aggregate_deltas(db: AsyncSession, deltas: dict):
+    """
+    Soma os deltas {(evaluated_user_id, category): (soma, quantidade)} em rating_aggregates.
+    Deve rodar na mesma transação que gravou as notas.
+    """
+    await _apply_additive_deltas(db, models.RatingAggregate, ("evaluated_user_id", "category"),
+                                 ("rating_sum", "rating_count"), deltas)
+
+async def apply_criterion_aggregate_deltas(db: AsyncSession, deltas: dict):
+    # {(evaluated_user_id, category, criteria): (soma, quantidade)}
+    await _apply_additive_deltas(db, models.CriterionAggregate, ("evaluated_user_id", "category", "criteria"),
+                                 ("rating_sum", "rating_count"), deltas)
+
+async def apply_evaluator_stats_deltas(db: AsyncSession, deltas: dict):
+    # {evaluator_id: (soma, soma dos quadrados, quantidade)}
+    await _apply_additive_deltas(db, models.EvaluatorStats, ("evaluator_id",),
+                                 ("rating_sum", "rating_sq_sum", "rating_count"), deltas)
+
+async def rebuild_rating_aggregates(db: AsyncSession):
+    # Recalcula todos os agregados a partir de image_ratings (backfill ou correção)
+    await db.execute(delete(models.RatingAggregate))
+    await db.execute(text("""
+        INSERT INTO rating_aggregates (evaluated_user_id, category, rating_sum, rating_count, updated_at)
+        SELECT r.evaluated_user_id, r.category, SUM(r.rating), COUNT(*), now()
+        FROM image_ratings r
+        GROUP BY r.evaluated_user_id, r.category
+    """))
+    await db.execute(delete(models.CriterionAggregate))
+    await db.execute(text("""
+        INSERT INTO criterion_aggregates (evaluated_user_id, category, criteria, rating_sum, rating_count, updated_at)
+        SELECT r.evaluated_user_id, r.category, r.criteria, SUM(r.rating), COUNT(*), now()
+        FROM image_ratings r
+        GROUP BY r.evaluated_user_id, r.category, r.criteria
+    """))
+    await db.execute(delete(models.EvaluatorStats))
+    await db.execute(text("""
+        INSERT INTO evaluator_stats (evaluator_id, rating_sum, rating_sq_sum, rating_count, updated_at)
+        SELECT r.evaluator_id, SUM(r.rating), SUM(r.rating::bigint * r.rating), COUNT(*), now()
+        FROM image_ratings r
+        GROUP BY r.evaluator_id
+    """))
+    await db.commit()
+
+def image_rating_statement(user_id: UUID, category: str, evaluator_id: UUID):
+    # Índice ix_image_ratings_evaluated_user_category_evaluator
+    return select(models.ImageRating).filter(
         and_(
             models.ImageRating.evaluated_user_id == user_id,
             models.ImageRating.category == category,
             models.ImageRating.evaluator_id == evaluator_id
         )
-    ).all()  # Pega todas as notas da categoria para o usuário
+    )
+
+def previous_ratings_statement(evaluator_id: UUID, pairs: List[tuple]):
+    # Prefixo (evaluator_id, evaluated_user_id, category) da constraint única
+    return (
+        select(ImageRating.evaluated_user_id, ImageRating.category, ImageRating.criteria, ImageRating.rating)
+        .filter(
+            ImageRating.evaluator_id == evaluator_id,
+            tuple_(ImageRating.evaluated_user_id, ImageRating.category).in_(pairs)
+        )
+    )
+
+def evaluator_contributions_statement(evaluator_id: UUID):
+    # Soma das notas dadas por um avaliador, por participante, categoria e critério
+    return (
+        select(
+            ImageRating.evaluated_user_id,
+            ImageRating.category,
+            ImageRating.criteria,
+            func.sum(ImageRating.rating).label("rating_sum"),
+            func.count().label("rating_count"),
+        )
+        .filter(ImageRating.evaluator_id == evaluator_id)
+        .group_by(ImageRating.evaluated_user_id, ImageRating.category, ImageRating.criteria)
+    )
+
+def received_ratings_statement(user_id: UUID):
+    # Notas recebidas por um participante, por avaliador (para descontar de evaluator_stats)
+    return (
+        select(
+            ImageRating.evaluator_id,
+            func.sum(ImageRating.rating).label("rating_sum"),
+            func.sum(ImageRating.rating * ImageRating.rating).label("rating_sq_sum"),
+            func.count().label("rating_count"),
+        )
+        .filter(ImageRating.evaluated_user_id == user_id)
+        .group_by(ImageRating.evaluator_id)
+    )
+
+# Cada participante recebe uma nota por critério; com todas as notas dadas ele sai da fila
+CRITERIA_PER_RATING = 5
+
+def evaluator_queue_statement(evaluator_id: UUID, category: str, after: Optional[UUID] = None, limit: int = 50):
+    """
+    Participantes com imagens na categoria que o avaliador ainda não terminou de avaliar,
+    com os IDs das imagens e as notas já dadas, tudo em uma consulta.
+    """
+    # ix_images_subcategory_user_id_id entrega os participantes já em ordem: o LIMIT
+    # para a leitura na página, sem agrupar a categoria inteira
+    images = (
+        select(
+            models.Image.user_id,
+            func.array_agg(aggregate_order_by(models.Image.id, models.Image.id)).label("image_ids"),
+        )
+        .filter(models.Image.subcategory == category, models.Image.user_id != evaluator_id)
+        .group_by(models.Image.user_id)
+    )
+    if after is not None:
+        images = images.filter(models.Image.user_id > after)
+    images = images.subquery()
+
+    # Notas já dadas, buscadas por participante da página (LATERAL): as três igualdades
+    # (avaliador, participante, categoria) ficam na condição do índice, seja o da
+    # constraint única ou ix_image_ratings_evaluated_user_category_evaluator
+    given = (
+        select(
+            func.json_object_agg(ImageRating.criteria, ImageRating.rating, type_=JSON).label("scores"),
+            func.count().label("rated"),
+        )
+        .filter(ImageRating.evaluator_id == evaluator_id,
+                ImageRating.evaluated_user_id == images.c.user_id,
+                ImageRating.category == category)
+        .lateral()
+    )
+    return (
+        select(images.c.user_id, models.User.name, images.c.image_ids, given.c.scores, given.c.rated)
+        .join(models.User, models.User.id == images.c.user_id)
+        .join(given, true())
+        .filter(given.c.rated < CRITERIA_PER_RATING)
+        .order_by(images.c.user_id)
+        .limit(limit)
+    )
+
+async def get_evaluator_queue(db: AsyncSession, evaluator_id: UUID, category: str,
+                              after: Optional[UUID] = None, limit: int = 50) -> List[dict]:
+    result = await db.execute(evaluator_queue_statement(evaluator_id, category, after, limit))
+    return [
+        {
+            "user_id": row.user_id,
+            "name": row.name,
+            "image_ids": row.image_ids,
+            "scores": row.scores or {},
+            "rated_criteria": row.rated,
+        }
+        for row in result.all()
+    ]
+
+async def get_image_rating(db: AsyncSession, user_id: UUID, category: str, evaluator_id: UUID):
+    result = await db.execute(image_rating_statement(user_id, category, evaluator_id))
+    image_rating = result.scalars().all()  # Pega todas as notas da categoria para o usuário
 
     if image_rating:
         return [
@@ -193,41 +790,35 @@ def get_image_rating(db: Session, user_id: str, category: str, evaluator_id: str
         ]
     return False
 
-def get_user_by_email_or_document(db: Session, email: str, document: str):
-    query = db.query(models.User)
+async def get_user_by_email_or_document(db: AsyncSession, email: str, document: str):
+    query = select(models.User)
     conditions = []
     if email:
         conditions.append(models.User.email == email)
     if document:
         conditions.append(models.User.document == document)
     if conditions:
-        return query.filter(or_(*conditions)).first()
+        result = await db.execute(query.filter(or_(*conditions)))
+        return result.scalars().first()
     else:
         return None
 
-def get_user_media(db: Session):
-    medias = (
-        db.query(
-            models.ImageRating.evaluated_user_id.label("user_id"),
+async def get_user_media(db: AsyncSession):
+    # Leitura dos agregados pré-calculados (chave primária), sem varrer image_ratings
+    result = await db.execute(
+        select(
+            models.RatingAggregate.evaluated_user_id.label("user_id"),
             models.User.name,
             models.User.category.label("user_category"),
             models.User.complete_address,
             models.User.cep,
-            models.ImageRating.category,
-            func.avg(models.ImageRating.rating).label("media")
+            models.RatingAggregate.category,
+            models.RatingAggregate.average.label("media")
         )
-        # O join com User permanece
-        .join(models.User, cast(models.ImageRating.evaluated_user_id, UUID) == models.User.id)
-        .group_by(
-            models.ImageRating.evaluated_user_id,
-            models.ImageRating.category,
-            models.User.name,
-            models.User.category,
-            models.User.complete_address,
-            models.User.cep
-        )
-        .all()
+        .join(models.User, models.RatingAggregate.evaluated_user_id == models.User.id)
+        .filter(models.RatingAggregate.rating_count > 0)
     )
+    medias = result.all()
 
     usuarios = {}
     for row in medias:
@@ -244,8 +835,51 @@ def get_user_media(db: Session):
             }
 
         if row.category == "A":
-            usuarios[uid]["categoria_a_media"] = round(row.media, 2)
+            usuarios[uid]["categoria_a_media"] = round(float(row.media), 2)
         elif row.category == "B":
-            usuarios[uid]["categoria_b_media"] = round(row.media, 2)
+            usuarios[uid]["categoria_b_media"] = round(float(row.media), 2)
 
     return list(usuarios.values())
+
+def user_media_export_statement(user_category: Optional[str] = None, subcategory: Optional[str] = None):
+    """
+    Uma linha por participante com as médias A e B, na ordem de ix_users_name_id
+    (ou ix_users_category_name_id com filtro), para o banco entregar as linhas
+    à medida que lê o índice, sem ordenar o resultado inteiro antes. A ordem usa a
+    mesma expressão dos índices, coalesce(name, '') (ver users_page_statement).
+    """
+    aggregate_a = aliased(models.RatingAggregate)
+    aggregate_b = aliased(models.RatingAggregate)
+    stmt = (
+        select(
+            models.User.id.label("user_id"),
+            models.User.name,
+            models.User.category.label("user_category"),
+            func.coalesce(models.User.complete_address + ' cep = ' + models.User.cep, "Não informado")
+            .label("complete_address"),
+            func.round(aggregate_a.average, 2).label("categoria_a_media"),
+            func.round(aggregate_b.average, 2).label("categoria_b_media"),
+        )
+        .outerjoin(aggregate_a, and_(aggregate_a.evaluated_user_id == models.User.id,
+                                     aggregate_a.category == "A", aggregate_a.rating_count > 0))
+        .outerjoin(aggregate_b, and_(aggregate_b.evaluated_user_id == models.User.id,
+                                     aggregate_b.category == "B", aggregate_b.rating_count > 0))
+        .order_by(func.coalesce(models.User.name, literal_column("''")), models.User.id)
+    )
+    if user_category is not None:
+        stmt = stmt.filter(models.User.category == user_category)
+    if subcategory == "A":
+        stmt = stmt.filter(aggregate_a.evaluated_user_id.is_not(None))
+    elif subcategory == "B":
+        stmt = stmt.filter(aggregate_b.evaluated_user_id.is_not(None))
+    else:
+        stmt = stmt.filter(or_(aggregate_a.evaluated_user_id.is_not(None), aggregate_b.evaluated_user_id.is_not(None)))
+    return stmt
+
+async def stream_user_media(db: AsyncSession, user_category: Optional[str] = None, subcategory: Optional[str] = None):
+    # Mesmas colunas de get_user_media, lidas do cursor do servidor em lotes de EXPORT_BATCH_SIZE
+    result = await db.stream(
+        user_media_export_statement(user_category, subcategory).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    async for row in result:
+        yield row
@@ -0,0 +1,148 @@
+"""
+Exportação das médias por participante em CSV e XLSX, gerada em streaming.
+
+As linhas vêm do cursor do servidor (crud.stream_user_media) e são convertidas e
+enviadas em blocos de EXPORT_CHUNK_BYTES, então a memória usada não depende do
+número de participantes. O XLSX é montado à mão (planilha única com células
+inlineStr) dentro de um ZipStream, sem carregar a planilha inteira como faria uma
+biblioteca de planilhas.
+"""
+import csv
+import io
+import os
+import re
+from typing import AsyncIterator, Optional
+from xml.sax.saxutils import escape
+
+from app import crud
+from app.database import stream_session
+from app.zipstream import ZipStream
+
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(64 * 1024)))
+
+EXPORT_COLUMNS = (
+    ("user_id", "ID"),
+    ("name", "Nome"),
+    ("user_category", "Categoria"),
+    ("complete_address", "Endereço"),
+    ("categoria_a_media", "Média categoria A"),
+    ("categoria_b_media", "Média categoria B"),
+)
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# Caracteres de controle não são permitidos em XML 1.0
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+
+def _values(row) -> list:
+    return [getattr(row, column) for column, _ in EXPORT_COLUMNS]
+
+
+async def csv_chunks(rows: AsyncIterator) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM para o Excel reconhecer o UTF-8 (acentos nos nomes e endereços)
+    buffer.write("\ufeff")
+    writer.writerow(title for _, title in EXPORT_COLUMNS)
+    async for row in rows:
+        writer.writerow("" if value is None else value for value in _values(row))
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) or hasattr(value, "as_tuple"):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_INVALID_XML.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(number: int, values) -> str:
+    return f'<row r="{number}">' + "".join(_xlsx_cell(value) for value in values) + "</row>"
+
+
+async def xlsx_chunks(rows: AsyncIterator, sheet_name: str = "Médias") -> AsyncIterator[bytes]:
+    archive = ZipStream()
+    for name, content in (
+        ("[Content_Types].xml", _CONTENT_TYPES),
+        ("_rels/.rels", _ROOT_RELS),
+        ("xl/workbook.xml", _WORKBOOK.format(name=escape(sheet_name, {'"': "&quot;"}))),
+        ("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS),
+    ):
+        with archive.open(name) as entry:
+            entry.write(content.encode("utf-8"))
+
+    # Sem force_zip64: o Excel rejeita alguns cabeçalhos ZIP64, e a planilha fica muito abaixo de 4 GB
+    with archive.open("xl/worksheets/sheet1.xml") as sheet:
+        sheet.write(_SHEET_START.encode("utf-8"))
+        sheet.write(_xlsx_row(1, [title for _, title in EXPORT_COLUMNS]).encode("utf-8"))
+        number = 1
+        async for row in rows:
+            number += 1
+            sheet.write(_xlsx_row(number, _values(row)).encode("utf-8"))
+            if archive.pending >= EXPORT_CHUNK_BYTES:
+                yield archive.drain()
+        sheet.write(_SHEET_END.encode("utf-8"))
+    yield archive.close()
+
+
+async def export_user_media(format: str, user_category: Optional[str] = None,
+                            subcategory: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+    Gera o arquivo da exportação. Abre a própria sessão: o gerador roda depois
+    que a resposta começou, quando a sessão da dependência get_db já foi fechada.
+    A sessão ocupa uma das vagas de database.stream_session.
+    """
+    chunks = csv_chunks if format == "csv" else xlsx_chunks
+    async with stream_session() as db:
+        async for chunk in chunks(crud.stream_user_media(db, user_category, subcategory)):
+            yield chunk
@@ -0,0 +1,81 @@
+import os
+from typing import BinaryIO, Dict, Iterator, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+from app.storage import CHUNK_SIZE, get_storage
+
+# Tamanho do prefixo do hash usado como versão nas URLs (?v=)
+VERSION_LENGTH = 16
+IMMUTABLE_MAX_AGE = 31536000
+
+
+def content_version(content_hash: Optional[str]) -> Optional[str]:
+    return content_hash[:VERSION_LENGTH] if content_hash else None
+
+
+def etag_for(content_hash: str, variant: Optional[str] = None) -> str:
+    # ETag forte: o conteúdo é endereçado pelo SHA-256, então o hash identifica os bytes exatos
+    return f'"{content_hash}-{variant}"' if variant else f'"{content_hash}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match usa comparação fraca (RFC 9110 13.1.2): ignora o prefixo W/
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def cache_control(request: Request, content_hash: str, private: bool = False) -> str:
+    """
+    URLs com ?v=<versão> atual nunca mudam de conteúdo e podem ficar em cache por um ano;
+    sem a versão o cliente guarda a resposta mas revalida com If-None-Match a cada uso.
+    """
+    scope = "private" if private else "public"
+    if request.query_params.get("v") == content_version(content_hash):
+        return f"{scope}, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return f"{scope}, no-cache"
+
+
+def _iter_file(f: BinaryIO) -> Iterator[bytes]:
+    try:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
+def cached_blob_response(request: Request, content_hash: str, media_type: str,
+                         variant: Optional[str] = None,
+                         private: bool = False, headers: Optional[Dict[str, str]] = None,
+                         file: Optional[BinaryIO] = None) -> Response:
+    """
+    Resposta para um blob do storage (ou um derivado já aberto em `file`)
+    com ETag, Cache-Control e 304 para GET condicional. Arquivos locais vão por
+    FileResponse, que atende Range/If-Range. Um `file` aberto é enviado como está e
+    fechado ao final: o arquivo pode ser apagado por outro processo enquanto isso.
+    """
+    etag = etag_for(content_hash, variant)
+    response_headers = {"ETag": etag, "Cache-Control": cache_control(request, content_hash, private)}
+    if etag_matches(request, etag):
+        if file is not None:
+            file.close()
+        return Response(status_code=304, headers=response_headers)
+
+    response_headers.update(headers or {})
+    if file is not None:
+        response_headers["Content-Length"] = str(os.fstat(file.fileno()).st_size)
+        return StreamingResponse(_iter_file(file), media_type=media_type, headers=response_headers)
+    storage = get_storage()
+    path = storage.local_path(content_hash)
+    if path:
+        return FileResponse(path, media_type=media_type, headers=response_headers)
+    return StreamingResponse(storage.iter_chunks(content_hash), media_type=media_type, headers=response_headers)
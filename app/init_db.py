@@ -1,6 +1,14 @@
+import asyncio
+
 from app.models import Base
 from app.database import engine
 
+
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+
 print("Criando as tabelas no banco de dados...")
-Base.metadata.create_all(bind=engine)
-print("Tabelas criadas com sucesso!")
\ No newline at end of file
+asyncio.run(create_tables())
+print("Tabelas criadas com sucesso!")
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import os
+
+from app import crud
+from app.database import SessionLocal, log_pool_status
+from app.mailer import OutboxSender
+from app.token_denylist import denylist
+
+logger = logging.getLogger(__name__)
+
+# Intervalos em segundos; 0 desativa a tarefa
+DB_POOL_LOG_INTERVAL = float(os.getenv("DB_POOL_LOG_INTERVAL", "0"))
+TOKEN_PURGE_INTERVAL = float(os.getenv("TOKEN_PURGE_INTERVAL", "3600"))
+TOKEN_PURGE_BATCH_SIZE = int(os.getenv("TOKEN_PURGE_BATCH_SIZE", "1000"))
+# Grava as revogações pendentes e recarrega as dos outros workers; é também o atraso máximo
+# para um logout valer nos outros processos. 0 = lista só em memória, exige um único worker
+TOKEN_DENYLIST_SYNC_INTERVAL = float(os.getenv("TOKEN_DENYLIST_SYNC_INTERVAL", "5"))
+TOKEN_DENYLIST_EVICT_INTERVAL = float(os.getenv("TOKEN_DENYLIST_EVICT_INTERVAL", "60"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+async def run_periodically(interval: float, job):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception:
+            logger.exception("Falha na tarefa periódica %s", job.__name__)
+
+
+async def log_pool():
+    log_pool_status()
+
+
+async def purge_expired_tokens():
+    async with SessionLocal() as db:
+        removed = await crud.purge_expired_tokens(db, batch_size=TOKEN_PURGE_BATCH_SIZE)
+    if removed:
+        logger.info("%s tokens expirados removidos", removed)
+
+
+async def evict_token_denylist():
+    evicted = denylist.evict_expired()
+    if evicted:
+        logger.debug("%s revogações expiradas descartadas da memória", evicted)
+
+
+async def sync_token_denylist():
+    pending = denylist.take_pending()
+    async with SessionLocal() as db:
+        if pending:
+            try:
+                await crud.save_revoked_tokens(db, pending)
+            except Exception:
+                denylist.restore_pending(pending)
+                raise
+        for jti, expires_at in await crud.get_revoked_tokens(db):
+            denylist.revoke(jti, expires_at, persist=False)
+
+
+async def start_background_jobs() -> list:
+    tasks = []
+    if DB_POOL_LOG_INTERVAL > 0:
+        tasks.append(asyncio.create_task(run_periodically(DB_POOL_LOG_INTERVAL, log_pool)))
+    if TOKEN_PURGE_INTERVAL > 0:
+        tasks.append(asyncio.create_task(run_periodically(TOKEN_PURGE_INTERVAL, purge_expired_tokens)))
+    if TOKEN_DENYLIST_SYNC_INTERVAL > 0:
+        try:
+            await sync_token_denylist()
+        except Exception:
+            logger.exception("Não foi possível carregar a lista de tokens revogados")
+        tasks.append(asyncio.create_task(run_periodically(TOKEN_DENYLIST_SYNC_INTERVAL, sync_token_denylist)))
+    else:
+        if WEB_CONCURRENCY > 1:
+            raise RuntimeError("TOKEN_DENYLIST_SYNC_INTERVAL=0 exige um único worker (WEB_CONCURRENCY=1): "
+                               "um logout não chegaria aos outros processos.")
+        denylist.persistent = False
+    if TOKEN_DENYLIST_EVICT_INTERVAL > 0:
+        tasks.append(asyncio.create_task(run_periodically(TOKEN_DENYLIST_EVICT_INTERVAL, evict_token_denylist)))
+    if OUTBOX_ENABLED:
+        tasks.append(asyncio.create_task(OutboxSender().run_forever()))
+    return tasks
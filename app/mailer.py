@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.database import SessionLocal
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+# Conexão ociosa por mais tempo que isso é fechada; a próxima remessa reconecta
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "30"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+# Tempo que um lote fica reservado para este worker antes de outro poder pegá-lo
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+
+
+def enqueue_email(db: AsyncSession, to_email: str, subject: str, content: str) -> models.EmailOutbox:
+    """
+    Adiciona o e-mail à outbox na sessão atual. O envio acontece em segundo plano
+    depois do commit de quem chamou, então o e-mail só sai se a transação for confirmada.
+    """
+    message = models.EmailOutbox(to_email=to_email, subject=subject, content=content)
+    db.add(message)
+    return message
+
+
+def build_message(from_email: str, to_email: str, subject: str, content: str) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg["From"] = from_email
+    msg["To"] = to_email
+    msg["Subject"] = subject
+    msg.attach(MIMEText(content, "plain"))
+    return msg
+
+
+class SMTPSession:
+    """
+    Mantém uma única conexão SMTP autenticada e a reaproveita entre os envios.
+    Não é thread-safe: é usada apenas pelo OutboxSender.
+    """
+
+    def __init__(self):
+        self.from_email = os.getenv("EMAIL_GMAIL")
+        self.password = os.getenv("SENHA_GMAIL")
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if self.password:
+            server.login(self.from_email, self.password)
+        return server
+
+    def _get_server(self) -> smtplib.SMTP:
+        if self._server is not None:
+            try:
+                self._server.noop()
+            except smtplib.SMTPException:
+                self.close()
+        if self._server is None:
+            self._server = self._connect()
+        return self._server
+
+    def send(self, to_email: str, subject: str, content: str) -> None:
+        msg = build_message(self.from_email, to_email, subject, content)
+        try:
+            self._get_server().sendmail(self.from_email, to_email, msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # Servidor derrubou a conexão reaproveitada: tenta uma vez com uma nova
+            self.close()
+            self._get_server().sendmail(self.from_email, to_email, msg.as_string())
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self) -> None:
+        if self._server is not None and time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+
+def backoff_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX))
+
+
+class OutboxSender:
+    def __init__(self, smtp: Optional[SMTPSession] = None):
+        self.smtp = smtp or SMTPSession()
+
+    async def _claim_batch(self, db: AsyncSession) -> List[models.EmailOutbox]:
+        # SKIP LOCKED + lease permitem vários workers sem enviar o mesmo e-mail duas vezes
+        claimable = (
+            select(models.EmailOutbox.id)
+            .filter(models.EmailOutbox.status == "pending",
+                    models.EmailOutbox.next_attempt_at <= datetime.utcnow())
+            .order_by(models.EmailOutbox.next_attempt_at)
+            .limit(OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        result = await db.execute(
+            update(models.EmailOutbox)
+            .where(models.EmailOutbox.id.in_(claimable))
+            .values(next_attempt_at=datetime.utcnow() + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+            .returning(models.EmailOutbox)
+            .execution_options(synchronize_session=False)
+        )
+        batch = result.scalars().all()
+        await db.commit()
+        return batch
+
+    def _send_batch(self, batch: List[models.EmailOutbox]) -> dict:
+        errors = {}
+        for message in batch:
+            try:
+                self.smtp.send(message.to_email, message.subject, message.content)
+            except Exception as e:
+                logger.warning("Falha ao enviar e-mail %s: %s", message.id, e)
+                errors[message.id] = str(e)
+                # A conexão pode ter ficado em estado inválido
+                self.smtp.close()
+        return errors
+
+    async def run_once(self) -> int:
+        async with SessionLocal() as db:
+            batch = await self._claim_batch(db)
+            if not batch:
+                await asyncio.to_thread(self.smtp.close_if_idle)
+                return 0
+
+            errors = await asyncio.to_thread(self._send_batch, batch)
+
+            now = datetime.utcnow()
+            for message in batch:
+                if message.id in errors:
+                    message.attempts += 1
+                    message.last_error = errors[message.id]
+                    if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+                        message.status = "failed"
+                    else:
+                        message.next_attempt_at = now + backoff_delay(message.attempts)
+                else:
+                    message.status = "sent"
+                    message.sent_at = now
+            await db.commit()
+            return len(batch)
+
+    async def run_forever(self):
+        try:
+            while True:
+                try:
+                    sent = await self.run_once()
+                except Exception:
+                    logger.exception("Falha no envio da outbox de e-mails")
+                    sent = 0
+                # Lote cheio: provavelmente há mais mensagens na fila
+                if sent < OUTBOX_BATCH_SIZE:
+                    await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+        finally:
+            self.smtp.close()
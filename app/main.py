@@ -1,7 +1,28 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Depends
-from app.routers import users, items
+from app.routers import users, items, internal, rankings, analytics
+from app.database import engine
+from app.jobs import start_background_jobs
+from app.metrics import MetricsMiddleware
 from fastapi.middleware.cors import CORSMiddleware
-app = FastAPI(debug=True)
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tasks = await start_background_jobs()
+    yield
+    for task in tasks:
+        task.cancel()
+    await engine.dispose()
+
+
+# APP_DEBUG=true só em desenvolvimento: devolve tracebacks nas respostas de erro
+app = FastAPI(debug=os.getenv("APP_DEBUG", "false").lower() in ("1", "true", "yes"), lifespan=lifespan)
 
 @app.get("/")
 async def root():
@@ -9,6 +30,9 @@ async def root():
 
 app.include_router(users.router)
 app.include_router(items.router)
+app.include_router(internal.router)
+app.include_router(rankings.router)
+app.include_router(analytics.router)
 
 origins = [
     "http://localhost:8080",
@@ -22,8 +46,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Permitir todos os métodos (GET, POST, etc.)
     allow_headers=["*"],  # Permitir todos os headers
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],  # Paginação de /api/users/
 )
+# Adicionado por último para ficar por fora de tudo e medir a requisição inteira
+app.add_middleware(MetricsMiddleware)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app,host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app,host="0.0.0.0", port=8000)
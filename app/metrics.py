@@ -0,0 +1,242 @@
+"""
+Métricas de requisições e consultas no formato de exposição do Prometheus.
+
+O MetricsMiddleware (ASGI puro) mede cada requisição por rota: latência, status,
+bytes recebidos/enviados e quantas consultas SQL ela fez (e quanto tempo passou
+nelas), contadas pelos eventos do engine através de um contextvar. Requisições
+acima de SLOW_REQUEST_MS ou com mais de QUERY_COUNT_WARN consultas vão para o log.
+"""
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from app.database import engine, pool_status
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+# Muitas consultas numa única requisição costumam indicar N+1
+QUERY_COUNT_WARN = int(os.getenv("QUERY_COUNT_WARN", "50"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "bytes_in", "bytes_out", "status")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.status = 500
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class Metrics:
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str, str], int] = {}
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.queries: Dict[Tuple[str, str], Histogram] = {}
+        self.db_time: Dict[Tuple[str, str], float] = {}
+        self.bytes_in: Dict[Tuple[str, str], int] = {}
+        self.bytes_out: Dict[Tuple[str, str], int] = {}
+        # Todas as consultas, inclusive as de tarefas em segundo plano
+        self.db_queries_total = 0
+        self.db_query_seconds_total = 0.0
+        self.slow_requests = 0
+
+    def record_request(self, method: str, route: str, stats: RequestStats, duration: float):
+        key = (method, route)
+        status_key = (method, route, str(stats.status))
+        self.requests[status_key] = self.requests.get(status_key, 0) + 1
+        self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(duration)
+        self.queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(stats.queries)
+        self.db_time[key] = self.db_time.get(key, 0.0) + stats.db_time
+        self.bytes_in[key] = self.bytes_in.get(key, 0) + stats.bytes_in
+        self.bytes_out[key] = self.bytes_out.get(key, 0) + stats.bytes_out
+
+    def record_query(self, seconds: float):
+        self.db_queries_total += 1
+        self.db_query_seconds_total += seconds
+        stats = _current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += seconds
+
+
+metrics = Metrics()
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics.record_query(time.perf_counter() - conn.info["query_start"].pop())
+
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def _on_query_error(exception_context):
+    # Consulta que falhou não chega ao after_cursor_execute: descarta o início registrado
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        metrics.record_query(time.perf_counter() - conn.info["query_start"].pop())
+
+
+def _route_label(scope) -> str:
+    # Usa o template da rota (/api/images/{image_id}/) para não criar uma série por ID
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        start = time.perf_counter()
+        content_length = 0
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                stats.bytes_in += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal content_length
+            if message["type"] == "http.response.start":
+                stats.status = message["status"]
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-length":
+                        content_length = int(value)
+            elif message["type"] == "http.response.body":
+                stats.bytes_out += len(message.get("body", b""))
+            elif message["type"] == "http.response.pathsend":
+                # Arquivo enviado pelo servidor (sendfile): o corpo não passa por aqui
+                stats.bytes_out += content_length
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            _current_request.reset(token)
+            route = _route_label(scope)
+            metrics.record_request(scope["method"], route, stats, duration)
+            if duration * 1000 >= SLOW_REQUEST_MS or stats.queries > QUERY_COUNT_WARN:
+                metrics.slow_requests += 1
+                logger.warning(
+                    "Requisição lenta: %s %s status=%s duracao=%.1fms consultas=%d banco=%.1fms entrada=%dB saida=%dB",
+                    scope["method"], route, stats.status, duration * 1000, stats.queries,
+                    stats.db_time * 1000, stats.bytes_in, stats.bytes_out,
+                )
+
+
+def _labels(**labels) -> str:
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _histogram_lines(name: str, series: Dict[Tuple[str, str], Histogram]) -> list:
+    lines = []
+    for (method, route), histogram in sorted(series.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(method=method, route=route, le=bound)} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(method=method, route=route, le='+Inf')} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(method=method, route=route)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(method=method, route=route)} {histogram.count}")
+    return lines
+
+
+def _counter_lines(name: str, series: dict) -> list:
+    return [f"{name}{_labels(method=method, route=route)} {value}" for (method, route), value in sorted(series.items())]
+
+
+def render_prometheus() -> str:
+    lines = [
+        "# HELP http_requests_total Requisições HTTP por rota e status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, route, status), value in sorted(metrics.requests.items()):
+        lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {value}")
+
+    lines += ["# HELP http_request_duration_seconds Latência das requisições por rota.",
+              "# TYPE http_request_duration_seconds histogram"]
+    lines += _histogram_lines("http_request_duration_seconds", metrics.latency)
+
+    lines += ["# HELP http_request_db_queries Consultas SQL por requisição.",
+              "# TYPE http_request_db_queries histogram"]
+    lines += _histogram_lines("http_request_db_queries", metrics.queries)
+
+    lines += ["# HELP http_request_db_seconds_total Tempo gasto em consultas SQL pelas requisições.",
+              "# TYPE http_request_db_seconds_total counter"]
+    lines += _counter_lines("http_request_db_seconds_total", metrics.db_time)
+
+    lines += ["# HELP http_request_bytes_total Bytes recebidos no corpo das requisições.",
+              "# TYPE http_request_bytes_total counter"]
+    lines += _counter_lines("http_request_bytes_total", metrics.bytes_in)
+
+    lines += ["# HELP http_response_bytes_total Bytes enviados no corpo das respostas.",
+              "# TYPE http_response_bytes_total counter"]
+    lines += _counter_lines("http_response_bytes_total", metrics.bytes_out)
+
+    lines += [
+        "# HELP http_slow_requests_total Requisições acima de SLOW_REQUEST_MS ou QUERY_COUNT_WARN.",
+        "# TYPE http_slow_requests_total counter",
+        f"http_slow_requests_total {metrics.slow_requests}",
+        "# HELP db_queries_total Consultas SQL executadas (requisições e tarefas em segundo plano).",
+        "# TYPE db_queries_total counter",
+        f"db_queries_total {metrics.db_queries_total}",
+        "# HELP db_query_seconds_total Tempo total das consultas SQL.",
+        "# TYPE db_query_seconds_total counter",
+        f"db_query_seconds_total {metrics.db_query_seconds_total}",
+    ]
+
+    pool = pool_status()
+    for name, key, kind in (
+        ("db_pool_size", "pool_size", "gauge"),
+        ("db_pool_checked_out", "checked_out", "gauge"),
+        ("db_pool_idle", "idle", "gauge"),
+        ("db_pool_overflow", "overflow", "gauge"),
+        ("db_pool_checkouts_total", "checkouts", "counter"),
+        ("db_pool_connects_total", "connects", "counter"),
+        ("db_pool_invalidations_total", "invalidations", "counter"),
+    ):
+        lines += [f"# TYPE {name} {kind}", f"{name} {pool[key]}"]
+    return "\n".join(lines) + "\n"
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, String, ForeignKey, Boolean, DateTime, Text, LargeBinary, Integer
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, ForeignKey, Boolean, DateTime, Text, Integer
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 from .database import Base
+from .http_cache import content_version
 import uuid
 import datetime
 from sqlalchemy.dialects.postgresql import UUID
@@ -11,43 +12,138 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    name = Column(String, index=True)
+    name = Column(String)
+
+    # Listagem paginada por cursor em (coalesce(name, ''), id), com ou sem filtro (ver crud.get_users).
+    # name aceita NULL: sem o coalesce a comparação de tupla pularia esses usuários
+    __table_args__ = (
+        sa.Index('ix_users_name_id', sa.func.coalesce(name, ''), id),
+        sa.Index('ix_users_category_name_id', 'category', sa.func.coalesce(name, ''), id),
+        sa.Index('ix_users_user_type_name_id', 'user_type', sa.func.coalesce(name, ''), id),
+        sa.Index('ix_users_institution_name_id', 'institution', sa.func.coalesce(name, ''), id),
+    )
+
     document = Column(String, unique=True, index=True)
     email = Column(String, unique=True, index=True)
     user_type = Column(String)
-    file = Column(LargeBinary)
-    password = Column(String)
-    category = Column(String, index=True)
+    # Conteúdo do PDF fica no blob storage; a linha guarda apenas a referência
+    file_hash = Column(String(64), index=True)
+    file_size = Column(Integer)
+    file_content_type = Column(String)
+    # Só é necessário no login e na troca de senha (ver crud.authenticate_user)
+    password = deferred(Column(String), group="credentials")
+    category = Column(String)
     images = relationship("Image", back_populates="user")
     cep = Column(String)
     complete_address = Column(String)
     institution = Column(String)
 
+    @property
+    def file_version(self):
+        # Prefixo do hash do documento, usado como ?v= no download (ver app.http_cache)
+        return content_version(self.file_hash)
+
 # Images Table
 class Image(Base):
     __tablename__ = "images"
+    __table_args__ = (
+        # Imagens de um participante (galeria, contagem por categoria no upload, detalhes em lote)
+        sa.Index('ix_images_user_id_subcategory', 'user_id', 'subcategory'),
+        # Imagens de uma categoria em ordem de participante (fila do avaliador)
+        sa.Index('ix_images_subcategory_user_id_id', 'subcategory', 'user_id', 'id'),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
-    image_data = Column(LargeBinary)
-    subcategory = Column(String, index=True)
-    description = Column(String(1500))
-    title = Column(String(50))
-    place = Column(String(500))
-    equipment = Column(String(100))
+    # Conteúdo da imagem fica no blob storage (SHA-256); a linha guarda apenas a referência
+    image_hash = Column(String(64), index=True)
+    image_size = Column(Integer)
+    content_type = Column(String)
+    subcategory = Column(String)
+    # Campos descritivos só são carregados quando pedidos (crud.get_image_metadata)
+    description = deferred(Column(String(1500)), group="details")
+    title = deferred(Column(String(50)), group="details")
+    place = deferred(Column(String(500)), group="details")
+    equipment = deferred(Column(String(100)), group="details")
 
     user = relationship("User", back_populates="images")
 
 # Image Ratings Table
 class ImageRating(Base):
     __tablename__ = 'image_ratings'
+    __table_args__ = (
+        # Uma nota por avaliador, participante, categoria e critério (alvo do upsert em crud.set_user_ratings)
+        # Também atende as buscas por avaliador (prefixo evaluator_id[, evaluated_user_id, category])
+        sa.UniqueConstraint('evaluator_id', 'evaluated_user_id', 'category', 'criteria',
+                            name='uq_image_ratings_evaluator_user_category_criteria'),
+        # Buscas por participante: notas recebidas por categoria e por avaliador
+        sa.Index('ix_image_ratings_evaluated_user_category_evaluator',
+                 'evaluated_user_id', 'category', 'evaluator_id'),
+    )
     id = sa.Column(sa.String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    evaluator_id = sa.Column(sa.String, nullable=False)
-    evaluated_user_id = sa.Column(sa.String, nullable=False)
+    evaluator_id = sa.Column(UUID(as_uuid=True), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    evaluated_user_id = sa.Column(UUID(as_uuid=True), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     category = sa.Column(sa.String(1), nullable=False)
     rating = sa.Column(sa.Integer, nullable=False)
     criteria = Column(String, nullable=False)
 
+# Soma e quantidade de notas por participante e categoria, mantidas junto com cada gravação de nota
+# (crud.set_user_ratings). Reconstruível a partir de image_ratings com app/rebuild_aggregates.py
+class RatingAggregate(Base):
+    __tablename__ = "rating_aggregates"
+
+    evaluated_user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    category = Column(String(1), primary_key=True)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    average = Column(sa.Numeric, sa.Computed("rating_sum::numeric / NULLIF(rating_count, 0)", persisted=True))
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# Mesma ideia de RatingAggregate, por critério: base do ranking com pesos por critério (app/ranking.py)
+class CriterionAggregate(Base):
+    __tablename__ = "criterion_aggregates"
+    # O ranking de cada worker busca só as linhas alteradas desde a última sincronização
+    __table_args__ = (
+        sa.Index('ix_criterion_aggregates_updated_at', 'updated_at'),
+    )
+
+    evaluated_user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    category = Column(String(1), primary_key=True)
+    criteria = Column(String, primary_key=True)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# Soma, soma dos quadrados e quantidade das notas dadas por cada avaliador:
+# média e desvio padrão para normalizar as notas (z-score) no ranking
+class EvaluatorStats(Base):
+    __tablename__ = "evaluator_stats"
+
+    evaluator_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    rating_sum = Column(sa.BigInteger, nullable=False, default=0)
+    rating_sq_sum = Column(sa.BigInteger, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# Fila de e-mails enviada em segundo plano por app/mailer.OutboxSender
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        sa.Index('ix_email_outbox_pending', 'next_attempt_at', postgresql_where=sa.text("status = 'pending'")),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    content = Column(Text, nullable=False)
+    # pending, sent ou failed (após esgotar as tentativas)
+    status = Column(String(10), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, server_default=func.now())
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    sent_at = Column(DateTime)
+
 class Token(Base):
     __tablename__ = "tokens"
 
@@ -0,0 +1,451 @@
+"""
+Ranking dos participantes por categoria de participante (users.category) e categoria de nota (A/B).
+
+A pontuação é a média ponderada das médias por critério (RANKING_CRITERIA_WEIGHTS;
+critérios não listados pesam 1). Empates são desfeitos pela quantidade de notas,
+depois pelo nome e pelo id. Com normalization=zscore cada nota vira
+(nota - média do avaliador) / desvio padrão do avaliador antes da média, o que
+compensa avaliadores mais rigorosos ou mais generosos.
+
+O índice fica em memória e é mantido por deltas: set_user_ratings e delete_user
+chamam apply_deltas()/remove_user() depois do commit e só as entradas afetadas
+mudam de lugar (busca binária e inserção). Top-K é uma fatia da lista e a posição
+de um usuário é uma busca binária (O(log n)).
+
+Cada entrada guarda, por critério, a soma das notas, a quantidade e a soma das
+notas normalizadas. Média e desvio de cada avaliador vêm de evaluator_stats e
+ficam fixos entre cargas completas: mudar a média de um avaliador mexe em todas
+as notas dele, então as notas novas entram com os valores da última carga (um
+avaliador novo entra com os valores do momento em que aparece). A carga completa,
+a cada RANKING_TTL segundos, recalcula as somas normalizadas com as estatísticas
+atuais; é a única leitura agregada de image_ratings. Até lá o z-score pode ficar
+defasado, tanto mais quanto mais notas os avaliadores deram desde a carga.
+
+Gravações de outros workers chegam por polling: a cada RANKING_SYNC_INTERVAL
+segundos as linhas de criterion_aggregates com updated_at recente são relidas e
+aplicadas com valores absolutos (idempotente); as somas normalizadas desses
+participantes são refeitas a partir das notas deles. A carga completa também
+cobre o que o polling não vê, como participantes apagados em outro worker.
+"""
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+RANKING_TTL = float(os.getenv("RANKING_TTL", "300"))
+RANKING_SYNC_INTERVAL = float(os.getenv("RANKING_SYNC_INTERVAL", "2"))
+# updated_at é o início da transação: uma gravação longa pode aparecer com horário anterior ao último polling
+RANKING_SYNC_OVERLAP = float(os.getenv("RANKING_SYNC_OVERLAP", "30"))
+NORMALIZATIONS = ("raw", "zscore")
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    # "criterio_1:2,criterio_3:0.5" -> {"criterio_1": 2.0, "criterio_3": 0.5}
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        criteria, _, weight = item.partition(":")
+        weights[criteria.strip()] = float(weight)
+    return weights
+
+
+RANKING_CRITERIA_WEIGHTS = parse_weights(os.getenv("RANKING_CRITERIA_WEIGHTS", ""))
+
+AGGREGATES_SQL = text("""
+    SELECT a.evaluated_user_id AS user_id, u.name, u.category AS user_category, a.category, a.criteria,
+           a.rating_sum, a.rating_count
+    FROM criterion_aggregates a
+    JOIN users u ON u.id = a.evaluated_user_id
+    WHERE a.rating_count > 0
+""")
+
+CHANGED_AGGREGATES_SQL = text("""
+    SELECT a.evaluated_user_id AS user_id, u.name, u.category AS user_category, a.category, a.criteria,
+           a.rating_sum, a.rating_count
+    FROM criterion_aggregates a
+    JOIN users u ON u.id = a.evaluated_user_id
+    WHERE a.updated_at > :since
+""")
+
+# updated_at é timestamp sem fuso, gravado com now(): o marco do polling precisa ser do mesmo tipo
+SYNC_MARK_SQL = text("SELECT LOCALTIMESTAMP")
+
+EVALUATOR_STATS_SQL = text("""
+    SELECT evaluator_id, rating_sum, rating_sq_sum, rating_count
+    FROM evaluator_stats
+    WHERE rating_count > 0
+""")
+
+# Mesma conta de evaluator_normalization(), feita no banco na carga completa
+ZSCORE_SQL = text("""
+    WITH stats AS (
+        SELECT evaluator_id,
+               rating_sum::float8 / rating_count AS mean,
+               sqrt(greatest(rating_sq_sum::float8 / rating_count
+                             - power(rating_sum::float8 / rating_count, 2), 0)) AS stddev
+        FROM evaluator_stats
+        WHERE rating_count > 0
+    )
+    SELECT r.evaluated_user_id AS user_id, r.category, r.criteria,
+           SUM(COALESCE((r.rating - s.mean) / NULLIF(s.stddev, 0), 0)) AS zscore_sum
+    FROM image_ratings r
+    JOIN stats s ON s.evaluator_id = r.evaluator_id
+    GROUP BY r.evaluated_user_id, r.category, r.criteria
+""")
+
+USER_RATINGS_SQL = text("""
+    SELECT evaluated_user_id AS user_id, category, criteria, evaluator_id, rating
+    FROM image_ratings
+    WHERE evaluated_user_id = ANY(:user_ids)
+""").bindparams(bindparam("user_ids", type_=ARRAY(UUID(as_uuid=True))))
+
+
+def evaluator_normalization(rating_sum: int, rating_sq_sum: int, rating_count: int) -> Tuple[float, float]:
+    # (média, desvio padrão populacional) a partir de soma e soma dos quadrados
+    if rating_count <= 0:
+        return 0.0, 0.0
+    mean = rating_sum / rating_count
+    return mean, max(rating_sq_sum / rating_count - mean ** 2, 0.0) ** 0.5
+
+
+def zscore_delta(normalization: Tuple[float, float], rating_sum: float, rating_count: int) -> float:
+    # Soma de (nota - média) / desvio para rating_count notas que somam rating_sum; avaliador sem variação conta 0
+    mean, stddev = normalization
+    if stddev <= 0:
+        return 0.0
+    return (rating_sum - mean * rating_count) / stddev
+
+
+class RankingEntry:
+    __slots__ = ("user_id", "name", "user_category", "category", "criteria")
+
+    def __init__(self, user_id: str, name: str, user_category: str, category: str):
+        self.user_id = user_id
+        self.name = name
+        self.user_category = user_category
+        self.category = category
+        # criterio -> [soma das notas, quantidade, soma das notas normalizadas por avaliador]
+        self.criteria: Dict[str, list] = {}
+
+    @property
+    def rating_count(self) -> int:
+        return sum(values[1] for values in self.criteria.values())
+
+
+class RankingIndex:
+    """
+    Listas ordenadas por (user_category, category) para uma normalização, com a
+    chave de ordenação guardada de cada usuário: mover uma entrada é tirar a chave
+    antiga e inserir a nova, as duas com bisect.
+    """
+
+    def __init__(self, normalization: str, weights: Dict[str, float]):
+        self.normalization = normalization
+        self.weights = weights
+        self.groups: Dict[Tuple[str, str], List[RankingEntry]] = {}
+        self.keys: Dict[Tuple[str, str], List[tuple]] = {}
+        # (user_id, category) -> (grupo, chave) com que a entrada foi inserida
+        self.sort_keys: Dict[Tuple[str, str], Tuple[Tuple[str, str], tuple]] = {}
+        self.by_user: Dict[Tuple[str, str], RankingEntry] = {}
+
+    def criteria_values(self, entry: RankingEntry) -> Dict[str, float]:
+        position = 2 if self.normalization == "zscore" else 0
+        return {criteria: values[position] / values[1] for criteria, values in entry.criteria.items()}
+
+    def score(self, entry: RankingEntry, values: Optional[Dict[str, float]] = None) -> float:
+        values = self.criteria_values(entry) if values is None else values
+        total_weight = sum(self.weights.get(criteria, 1.0) for criteria in values)
+        if not total_weight:
+            return 0.0
+        return sum(self.weights.get(criteria, 1.0) * value for criteria, value in values.items()) / total_weight
+
+    def _sort_key(self, entry: RankingEntry) -> tuple:
+        return (-self.score(entry), -entry.rating_count, entry.name or "", entry.user_id)
+
+    def remove(self, entry: RankingEntry):
+        user_key = (entry.user_id, entry.category)
+        placed = self.sort_keys.pop(user_key, None)
+        if placed is None:
+            return
+        self.by_user.pop(user_key, None)
+        group, sort_key = placed
+        keys, items = self.keys[group], self.groups[group]
+        position = bisect_left(keys, sort_key)
+        del keys[position]
+        del items[position]
+        if not keys:
+            del self.keys[group], self.groups[group]
+
+    def place(self, entry: RankingEntry):
+        # Também serve para mudança de nome ou de categoria: a chave antiga sai do grupo antigo
+        self.remove(entry)
+        if not entry.criteria:
+            return
+        group = (entry.user_category, entry.category)
+        keys = self.keys.setdefault(group, [])
+        items = self.groups.setdefault(group, [])
+        sort_key = self._sort_key(entry)
+        position = bisect_left(keys, sort_key)
+        keys.insert(position, sort_key)
+        items.insert(position, entry)
+        self.sort_keys[(entry.user_id, entry.category)] = (group, sort_key)
+        self.by_user[(entry.user_id, entry.category)] = entry
+
+    def rebuild(self, entries: Iterable[RankingEntry]):
+        pairs: Dict[Tuple[str, str], List[Tuple[tuple, RankingEntry]]] = {}
+        self.sort_keys, self.by_user = {}, {}
+        for entry in entries:
+            if not entry.criteria:
+                continue
+            group, sort_key = (entry.user_category, entry.category), self._sort_key(entry)
+            pairs.setdefault(group, []).append((sort_key, entry))
+            self.sort_keys[(entry.user_id, entry.category)] = (group, sort_key)
+            self.by_user[(entry.user_id, entry.category)] = entry
+        self.groups, self.keys = {}, {}
+        for group, items in pairs.items():
+            items.sort(key=lambda pair: pair[0])
+            self.keys[group] = [sort_key for sort_key, _ in items]
+            self.groups[group] = [entry for _, entry in items]
+
+    def as_dict(self, entry: RankingEntry, rank: int) -> dict:
+        values = self.criteria_values(entry)
+        return {
+            "rank": rank,
+            "user_id": entry.user_id,
+            "name": entry.name,
+            "user_category": entry.user_category,
+            "category": entry.category,
+            "score": round(self.score(entry, values), 4),
+            "rating_count": entry.rating_count,
+            "criteria": {criteria: round(value, 4) for criteria, value in sorted(values.items())},
+        }
+
+    def top(self, category: str, user_category: Optional[str], k: int) -> List[dict]:
+        if user_category is not None:
+            items = self.groups.get((user_category, category), [])
+            return [self.as_dict(entry, rank) for rank, entry in enumerate(items[:k], start=1)]
+        # Sem filtro: junta o topo de cada grupo (cada participante mantém a posição no próprio grupo)
+        result = []
+        for (group_user_category, group_category), items in sorted(self.groups.items()):
+            if group_category == category:
+                result += [self.as_dict(entry, rank) for rank, entry in enumerate(items[:k], start=1)]
+        return result
+
+    def rank_of(self, user_id: str, category: str) -> Optional[dict]:
+        entry = self.by_user.get((user_id, category))
+        if entry is None:
+            return None
+        group, sort_key = self.sort_keys[(user_id, category)]
+        rank = bisect_left(self.keys[group], sort_key) + 1
+        result = self.as_dict(entry, rank)
+        result["total"] = len(self.keys[group])
+        return result
+
+
+class RankingEngine:
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = RANKING_CRITERIA_WEIGHTS if weights is None else weights
+        # (user_id, category) -> entrada, compartilhada pelos índices de todas as normalizações
+        self._entries: Dict[Tuple[str, str], RankingEntry] = {}
+        # evaluator_id -> [soma, soma dos quadrados, quantidade], como em evaluator_stats
+        self._evaluator_stats: Dict[str, list] = {}
+        # evaluator_id -> (média, desvio) usados no z-score desde a última carga completa
+        self._normalization: Dict[str, Tuple[float, float]] = {}
+        self._indexes: Dict[str, RankingIndex] = {}
+        self._loaded_at: Optional[float] = None
+        self._synced_at: Optional[float] = None
+        # now() do banco na última leitura, base do próximo polling
+        self._since = None
+        self._lock = asyncio.Lock()
+
+    def _place(self, entry: RankingEntry):
+        for index in self._indexes.values():
+            index.place(entry)
+        if not entry.criteria:
+            self._entries.pop((entry.user_id, entry.category), None)
+
+    def _entry(self, user_id: str, category: str, name: Optional[str], user_category: Optional[str]) -> RankingEntry:
+        entry = self._entries.get((user_id, category))
+        if entry is None:
+            entry = self._entries[(user_id, category)] = RankingEntry(user_id, name, user_category, category)
+        return entry
+
+    def _evaluator_normalization(self, evaluator_id: str) -> Tuple[float, float]:
+        normalization = self._normalization.get(evaluator_id)
+        if normalization is None:
+            # Avaliador que não existia na última carga: fixa os valores de agora
+            normalization = self._normalization[evaluator_id] = evaluator_normalization(
+                *self._evaluator_stats.get(evaluator_id, (0, 0, 0))
+            )
+        return normalization
+
+    def apply_deltas(self, evaluator_id, criterion_deltas: dict, stats_deltas: dict, users: Optional[dict] = None):
+        """
+        Aplica as diferenças de uma gravação já confirmada, feita pelas notas de evaluator_id.
+        criterion_deltas: {(evaluated_user_id, category, criteria): (soma, quantidade)}
+        stats_deltas: {evaluator_id: (soma, soma dos quadrados, quantidade)}
+        users: {user_id: (name, user_category)} dos participantes que ainda podem não estar no índice
+        """
+        if self._loaded_at is None:
+            return
+        for stats_evaluator_id, delta in stats_deltas.items():
+            key = str(stats_evaluator_id)
+            current = self._evaluator_stats.get(key, (0, 0, 0))
+            self._evaluator_stats[key] = [value + change for value, change in zip(current, delta)]
+        normalization = self._evaluator_normalization(str(evaluator_id))
+
+        touched = {}
+        for (user_id, category, criteria), (rating_sum, rating_count) in criterion_deltas.items():
+            user_key = (str(user_id), category)
+            entry = self._entries.get(user_key)
+            if entry is None:
+                if not users or user_id not in users:
+                    # Sem nome e categoria não dá para posicionar; o próximo polling traz a linha completa
+                    continue
+                entry = self._entry(user_key[0], category, *users[user_id])
+            current = entry.criteria.get(criteria, [0, 0, 0.0])
+            current = [current[0] + rating_sum, current[1] + rating_count,
+                       current[2] + zscore_delta(normalization, rating_sum, rating_count)]
+            if current[1] > 0:
+                entry.criteria[criteria] = current
+            else:
+                entry.criteria.pop(criteria, None)
+            touched[user_key] = entry
+        for entry in touched.values():
+            self._place(entry)
+
+    def remove_user(self, user_id):
+        user_id = str(user_id)
+        self._evaluator_stats.pop(user_id, None)
+        self._normalization.pop(user_id, None)
+        for user_key in [key for key in self._entries if key[0] == user_id]:
+            entry = self._entries[user_key]
+            entry.criteria.clear()
+            self._place(entry)
+
+    def _apply_rows(self, rows) -> Dict[Tuple[str, str], RankingEntry]:
+        # Valores absolutos: reaplicar a mesma linha (ou uma gravação já aplicada por delta) não muda nada
+        touched = {}
+        for row in rows:
+            user_key = (str(row.user_id), row.category)
+            entry = self._entry(user_key[0], row.category, row.name, row.user_category)
+            entry.name, entry.user_category = row.name, row.user_category
+            if row.rating_count > 0:
+                zscore_sum = entry.criteria.get(row.criteria, [0, 0, 0.0])[2]
+                entry.criteria[row.criteria] = [row.rating_sum, row.rating_count, zscore_sum]
+            else:
+                entry.criteria.pop(row.criteria, None)
+            touched[user_key] = entry
+        return touched
+
+    async def _read_evaluator_stats(self, db: AsyncSession) -> Dict[str, list]:
+        result = await db.execute(EVALUATOR_STATS_SQL)
+        return {
+            str(row.evaluator_id): [row.rating_sum, row.rating_sq_sum, row.rating_count]
+            for row in result.all()
+        }
+
+    async def _load(self, db: AsyncSession):
+        started = time.perf_counter()
+        since = (await db.execute(SYNC_MARK_SQL)).scalar()
+        # Estatísticas antes das somas normalizadas: as duas leituras são separadas, e uma nota
+        # gravada entre elas só desloca o z-score daquele avaliador até a próxima carga
+        evaluator_stats = await self._read_evaluator_stats(db)
+        rows = (await db.execute(AGGREGATES_SQL)).all()
+        zscore_rows = (await db.execute(ZSCORE_SQL)).all()
+
+        self._entries = {}
+        self._evaluator_stats = evaluator_stats
+        self._normalization = {
+            evaluator_id: evaluator_normalization(*stats) for evaluator_id, stats in evaluator_stats.items()
+        }
+        self._apply_rows(rows)
+        for row in zscore_rows:
+            entry = self._entries.get((str(row.user_id), row.category))
+            if entry is not None and row.criteria in entry.criteria:
+                entry.criteria[row.criteria][2] = float(row.zscore_sum)
+        self._indexes = {normalization: RankingIndex(normalization, self.weights) for normalization in NORMALIZATIONS}
+        for index in self._indexes.values():
+            index.rebuild(self._entries.values())
+        self._since = since
+        self._loaded_at = self._synced_at = time.monotonic()
+        logger.info("Ranking carregado em %.1fms (%d entradas)", (time.perf_counter() - started) * 1000,
+                    len(self._entries))
+
+    async def _sync(self, db: AsyncSession):
+        since = (await db.execute(SYNC_MARK_SQL)).scalar()
+        result = await db.execute(CHANGED_AGGREGATES_SQL,
+                                  {"since": self._since - timedelta(seconds=RANKING_SYNC_OVERLAP)})
+        rows = result.all()
+        self._evaluator_stats = await self._read_evaluator_stats(db)
+        touched = self._apply_rows(rows)
+
+        if touched:
+            # Somas normalizadas refeitas a partir das notas dos participantes alterados, com a média
+            # e o desvio fixados para cada avaliador (o mesmo que os deltas locais usam)
+            user_ids = list({row.user_id for row in rows})
+            result = await db.execute(USER_RATINGS_SQL, {"user_ids": user_ids})
+            zscore_sums: Dict[Tuple[str, str, str], float] = {}
+            for rating in result.all():
+                key = (str(rating.user_id), rating.category, rating.criteria)
+                normalization = self._evaluator_normalization(str(rating.evaluator_id))
+                zscore_sums[key] = zscore_sums.get(key, 0.0) + zscore_delta(normalization, rating.rating, 1)
+            for (user_id, category), entry in touched.items():
+                for criteria, values in entry.criteria.items():
+                    values[2] = zscore_sums.get((user_id, category, criteria), 0.0)
+
+        for entry in touched.values():
+            self._place(entry)
+        self._since = since
+        self._synced_at = time.monotonic()
+
+    async def get_index(self, db: AsyncSession, normalization: str = "raw") -> RankingIndex:
+        if normalization not in NORMALIZATIONS:
+            raise ValueError(f"Normalização desconhecida: {normalization}")
+        now = time.monotonic()
+        if self._loaded_at is None or now - self._loaded_at >= RANKING_TTL or now - self._synced_at >= RANKING_SYNC_INTERVAL:
+            async with self._lock:
+                # Outra requisição pode ter carregado enquanto esta esperava o lock
+                now = time.monotonic()
+                if self._loaded_at is None or now - self._loaded_at >= RANKING_TTL:
+                    await self._load(db)
+                elif now - self._synced_at >= RANKING_SYNC_INTERVAL:
+                    await self._sync(db)
+        return self._indexes[normalization]
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "weights": self.weights,
+            "ttl": RANKING_TTL,
+            "sync_interval": RANKING_SYNC_INTERVAL,
+            "loaded_age": None if self._loaded_at is None else round(now - self._loaded_at, 1),
+            "synced_age": None if self._synced_at is None else round(now - self._synced_at, 1),
+            "entries": len(self._entries),
+            "evaluators": len(self._evaluator_stats),
+            "indexes": {
+                normalization: {"entries": len(index.by_user)}
+                for normalization, index in self._indexes.items()
+            },
+        }
+
+
+engine = RankingEngine()
+
+
+def apply_deltas(evaluator_id, criterion_deltas: dict, stats_deltas: dict, users: Optional[dict] = None):
+    engine.apply_deltas(evaluator_id, criterion_deltas, stats_deltas, users)
+
+
+def remove_user(user_id):
+    engine.remove_user(user_id)
@@ -0,0 +1,14 @@
+import asyncio
+
+from app import crud
+from app.database import SessionLocal, engine
+
+
+async def rebuild():
+    async with SessionLocal() as db:
+        await crud.rebuild_rating_aggregates(db)
+    await engine.dispose()
+
+print("Recalculando as médias a partir de image_ratings...")
+asyncio.run(rebuild())
+print("Médias recalculadas com sucesso!")
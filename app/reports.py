@@ -0,0 +1,208 @@
+"""
+Relatório em PDF das médias por participante, gerado em segundo plano.
+
+O job é identificado pela versão das notas (ratings_version_key) e o estado fica em
+REPORTS_DIR, que os workers do uvicorn compartilham, e não na memória de um worker:
+
+    media_usuarios_<versão>.pdf      pronto
+    media_usuarios_<versão>.pending  em geração (criado com O_EXCL: um worker só gera)
+    media_usuarios_<versão>.failed   falhou, com a mensagem de erro
+
+Qualquer worker responde o status e o download, e um .pending mais velho que
+REPORTS_PENDING_TIMEOUT (worker que caiu no meio da geração) é retomado pelo
+próximo pedido.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+
+from app import crud, models
+from app.database import SessionLocal
+from app.utils import criar_pdf_medias
+
+logger = logging.getLogger(__name__)
+
+REPORTS_DIR = os.getenv("REPORTS_DIR", "storage/reports")
+# Quantos PDFs antigos manter em disco além do atual
+REPORTS_KEEP = int(os.getenv("REPORTS_KEEP", "5"))
+REPORTS_WORKERS = int(os.getenv("REPORTS_WORKERS", "1"))
+# Geração em andamento há mais tempo que isso é considerada abandonada (worker que caiu)
+REPORTS_PENDING_TIMEOUT = int(os.getenv("REPORTS_PENDING_TIMEOUT", "900"))
+
+# Renderização do reportlab é CPU-bound: roda fora do processo do servidor
+_render_executor: Optional[ProcessPoolExecutor] = None
+# Referências às tarefas em andamento neste worker (o loop só guarda referências fracas)
+_tasks: Set[asyncio.Task] = set()
+
+
+class ReportJob:
+    def __init__(self, job_id: str, status: str = "pending", error: Optional[str] = None):
+        self.job_id = job_id
+        self.status = status
+        self.error = error
+
+
+def get_render_executor() -> ProcessPoolExecutor:
+    global _render_executor
+    if _render_executor is None:
+        _render_executor = ProcessPoolExecutor(max_workers=REPORTS_WORKERS)
+    return _render_executor
+
+
+def report_path(job_id: str) -> str:
+    return os.path.join(REPORTS_DIR, f"media_usuarios_{job_id}.pdf")
+
+
+def _pending_path(job_id: str) -> str:
+    return os.path.join(REPORTS_DIR, f"media_usuarios_{job_id}.pending")
+
+
+def _failed_path(job_id: str) -> str:
+    return os.path.join(REPORTS_DIR, f"media_usuarios_{job_id}.failed")
+
+
+async def ratings_version_key(db: AsyncSession) -> Optional[str]:
+    """
+    Chave de versão das notas, calculada sobre rating_aggregates. Muda sempre que
+    uma nota é gravada, então serve de chave de cache do relatório.
+    Retorna None quando ainda não há notas.
+    """
+    result = await db.execute(
+        select(
+            func.count(),
+            func.coalesce(func.sum(models.RatingAggregate.rating_sum), 0),
+            func.coalesce(func.sum(models.RatingAggregate.rating_count), 0),
+            func.max(models.RatingAggregate.updated_at),
+        ).filter(models.RatingAggregate.rating_count > 0)
+    )
+    rows, rating_sum, rating_count, updated_at = result.one()
+    if not rows:
+        return None
+    raw = f"{rows}:{rating_sum}:{rating_count}:{updated_at.isoformat() if updated_at else ''}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def _render(data: list, path: str):
+    # Nome temporário único: dois workers podem gerar a mesma versão ao mesmo tempo
+    fd, tmp_path = tempfile.mkstemp(dir=REPORTS_DIR, prefix="media_usuarios_", suffix=".tmp")
+    os.close(fd)
+    try:
+        criar_pdf_medias(data, output=tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _remove_old_reports(keep_path: str):
+    reports = [
+        os.path.join(REPORTS_DIR, name) for name in os.listdir(REPORTS_DIR)
+        if name.startswith("media_usuarios_") and name.endswith(".pdf")
+    ]
+    reports.sort(key=os.path.getmtime, reverse=True)
+    for path in reports[REPORTS_KEEP + 1:]:
+        if path != keep_path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Já removido por outro worker
+    # Marcadores de falha antigos: a versão das notas já mudou
+    for name in os.listdir(REPORTS_DIR):
+        path = os.path.join(REPORTS_DIR, name)
+        if name.endswith(".failed") and _age(path) > REPORTS_PENDING_TIMEOUT:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _age(path: str) -> float:
+    try:
+        return time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        return float("inf")
+
+
+def _claim(job_id: str) -> bool:
+    """
+    Reserva a geração da versão para este worker. Falha se outro worker já está
+    gerando; um .pending abandonado é apagado e disputado de novo.
+    """
+    pending = _pending_path(job_id)
+    if _age(pending) > REPORTS_PENDING_TIMEOUT:
+        try:
+            os.remove(pending)
+        except FileNotFoundError:
+            pass
+    try:
+        fd = os.open(pending, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    try:
+        os.remove(_failed_path(job_id))
+    except FileNotFoundError:
+        pass
+    return True
+
+
+async def _run_job(job_id: str):
+    path = report_path(job_id)
+    try:
+        async with SessionLocal() as db:
+            data = await crud.get_user_media(db)
+        await asyncio.get_running_loop().run_in_executor(get_render_executor(), _render, data, path)
+        _remove_old_reports(path)
+    except Exception as e:
+        logger.exception("Falha ao gerar o relatório %s", job_id)
+        with open(_failed_path(job_id), "w") as f:
+            f.write(str(e))
+    finally:
+        try:
+            os.remove(_pending_path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+async def request_report(db: AsyncSession) -> Optional[ReportJob]:
+    """
+    Retorna o job do relatório da versão atual das notas, iniciando a geração
+    em segundo plano se nenhum worker tem o PDF pronto ou em geração.
+    """
+    job_id = await ratings_version_key(db)
+    if job_id is None:
+        return None
+
+    job = get_report_job(job_id)
+    if job is not None and job.status != "failed":
+        return job
+
+    # Sem job ou job com falha: gera de novo, se nenhum outro worker chegou antes
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    if _claim(job_id):
+        task = asyncio.create_task(_run_job(job_id))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+    return ReportJob(job_id)
+
+
+def get_report_job(job_id: str) -> Optional[ReportJob]:
+    # O estado vem do disco: o job pode ter sido iniciado por qualquer worker
+    if os.path.exists(report_path(job_id)):
+        return ReportJob(job_id, "done")
+    if _age(_pending_path(job_id)) <= REPORTS_PENDING_TIMEOUT:
+        return ReportJob(job_id)
+    try:
+        with open(_failed_path(job_id)) as f:
+            return ReportJob(job_id, "failed", f.read())
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..database import get_db
+from app import analytics
+from app.routers.users import get_current_user
+
+router = APIRouter()
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+
+
+@router.get("/api/analytics/ratings")
+async def get_rating_statistics(format: str = "json",
+                                table: str = "evaluators",
+                                db: AsyncSession = Depends(get_db),
+                                current_user: models.User = Depends(get_current_user)):
+    """
+    Estatísticas das notas: por critério (média, variância, ICC), por avaliador
+    (viés, correlação com o consenso, fora da curva) e a distribuição das notas.
+    JSON devolve todas as tabelas; CSV e Parquet devolvem a escolhida em ?table=.
+    """
+    if format not in analytics.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido. Use: {', '.join(analytics.FORMATS)}")
+    if table not in analytics.TABLES:
+        raise HTTPException(status_code=400, detail=f"Tabela inválida. Use: {', '.join(analytics.TABLES)}")
+
+    try:
+        statistics = await analytics.get_statistics(db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if statistics is None:
+        raise HTTPException(status_code=404, detail="Nenhuma avaliação encontrada")
+
+    if format == "json":
+        return analytics.to_json(statistics)
+    content = analytics.to_csv(statistics, table) if format == "csv" else analytics.to_parquet(statistics, table)
+    filename = f"estatisticas_{table}_{statistics['summary']['version'][:8]}.{format}"
+    return Response(content=content, media_type=MEDIA_TYPES[format],
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
@@ -0,0 +1,51 @@
+import os
+import secrets
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from app.database import pool_status
+from app import cache, metrics, ranking, thumbnails
+from app.utils import get_current_user, hash_pool_status
+
+router = APIRouter()
+
+
+@router.get("/api/internal/pool")
+async def get_pool_status(current_user: str = Depends(get_current_user)):
+    # Conexões em uso, ociosas, overflow e tempo de espera por conexão
+    return pool_status()
+
+
+@router.get("/api/internal/hash-pool")
+async def get_hash_pool_status(current_user: str = Depends(get_current_user)):
+    return hash_pool_status()
+
+
+@router.get("/api/internal/thumbnails")
+async def get_thumbnail_cache_status(current_user: str = Depends(get_current_user)):
+    return thumbnails.get_cache().stats()
+
+
+@router.get("/api/internal/cache")
+async def get_cache_status(current_user: str = Depends(get_current_user)):
+    # Acertos, faltas e invalidações por namespace (user, image)
+    return cache.cache_status()
+
+
+@router.get("/api/internal/ranking")
+async def get_ranking_status(current_user: str = Depends(get_current_user)):
+    # Idade e tamanho dos índices em memória e os pesos dos critérios
+    return ranking.engine.status()
+
+
+# Se definido, o scraper do Prometheus envia "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics(request: Request):
+    if METRICS_TOKEN:
+        expected = f"Bearer {METRICS_TOKEN}"
+        if not secrets.compare_digest(request.headers.get("authorization", ""), expected):
+            raise HTTPException(status_code=401, detail="Não autorizado")
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -1,108 +1,158 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, FastAPI, Response
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, FastAPI, Response, Request, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from .. import crud, models, schemas
-from ..database import get_db
+from ..database import get_db, stream_slots_available
 from uuid import UUID
-from fastapi.responses import StreamingResponse
-from io import BytesIO
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
+from app.uploads import StreamingUpload, JPEG_MAGIC
+from app import archives, exports, http_cache, reports, thumbnails
 from app.utils import  *
-from app.schemas import RateRequest,getRateRequest,SendEmailRequest
+from app.schemas import ImageDetailsBatchRequest,RateRequest,RateBatchRequest,RatingItem,getRateRequest,SendEmailRequest
+import csv
+import io
 import secrets
 import string
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import logging
 from dotenv import load_dotenv
 import os
 from app.routers.users import get_current_user
 load_dotenv()
+logger = logging.getLogger(__name__)
 router = APIRouter()
 
-@router.post("/api/images/upload/")
+IMAGE_UPLOAD_FIELDS = ("user_id", "subcategory", "description", "title", "place", "equipment")
+
+@router.post("/api/images/upload/", openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["image", *IMAGE_UPLOAD_FIELDS],
+            "properties": {
+                "image": {"type": "string", "format": "binary"},
+                **{name: {"type": "string"} for name in IMAGE_UPLOAD_FIELDS},
+            },
+        }}},
+    }
+})
 async def upload_image(
-    image: UploadFile = File(...),
-    user_id: UUID = Form(...),
-    subcategory: str = Form(...),
-    description: str = Form(...),
-    title: str = Form(...),
-    place: str = Form(...),
-    equipment: str = Form(...),
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    user = crud.get_user_by_id(db=db, user_id=user_id)
-    ADM_TYPE = os.getenv("ADM_TYPE")
-    if user.user_type == ADM_TYPE:
-        raise HTTPException(status_code=400, detail="Usuários avaliadores não podem enviar imagens")
-
-    if image.content_type not in ["image/jpeg", "image/jpg"]:
-        raise HTTPException(status_code=400, detail="O arquivo deve ser uma imagem JPG ou JPEG")
-
-    if len(await image.read()) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail="O arquivo deve ter no máximo 10MB")
-
-    if subcategory not in MAX_UPLOADS:
-        raise HTTPException(status_code=400, detail="Categoria inválida.")
+    # O corpo é lido em streaming (app/uploads.py): os campos devem vir antes do arquivo
+    # para que quota e categoria sejam verificadas sem ler a imagem
+    async def validate_upload(fields: dict):
+        try:
+            user_id = UUID(fields["user_id"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="user_id inválido.")
+        subcategory = fields["subcategory"]
+
+        user = await crud.get_user_metadata(db=db, user_id=user_id)
+        if user is None:
+            raise HTTPException(status_code=404, detail="Usuário não encontrado")
+        ADM_TYPE = os.getenv("ADM_TYPE")
+        if user.user_type == ADM_TYPE:
+            raise HTTPException(status_code=400, detail="Usuários avaliadores não podem enviar imagens")
+
+        if subcategory not in MAX_UPLOADS:
+            raise HTTPException(status_code=400, detail="Categoria inválida.")
+
+        uploads = await crud.count_images_by_user(db=db, user_id=user_id, subcategory=subcategory)
+        if uploads >= MAX_UPLOADS[subcategory]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Você atingiu o limite de {MAX_UPLOADS[subcategory]} imagens para a categoria {subcategory}."
+            )
 
-    uploads = crud.get_images_by_user(db=db, user_id=user_id,subcategory=subcategory)
-    if len(uploads) >= MAX_UPLOADS[subcategory]:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Você atingiu o limite de {MAX_UPLOADS[subcategory]} imagens para a categoria {subcategory}."
-        )
+    upload = StreamingUpload(
+        request,
+        file_field="image",
+        max_file_size=MAX_FILE_SIZE,
+        allowed_content_types=["image/jpeg", "image/jpg"],
+        magic=JPEG_MAGIC,
+        required_fields=IMAGE_UPLOAD_FIELDS,
+        content_type_error="O arquivo deve ser uma imagem JPG ou JPEG",
+    )
+    # O hash fica travado na transação de db até o commit da imagem (ver crud.release_blob)
+    stored = await upload.parse(validate_upload, before_commit=lambda sha256: crud.lock_blob(db, sha256))
+    fields = upload.fields
 
-    image.file.seek(0)
-    image_content = await image.read()
-    print(title)
-    print(place)
     image_data = models.Image(
-        user_id=user_id,
-        image_data=image_content,
-        subcategory=subcategory,
-        description=description,
-        title=title,
-        place=place,
-        equipment=equipment
+        user_id=UUID(fields["user_id"]),
+        image_hash=stored.sha256,
+        image_size=stored.size,
+        content_type="image/jpeg",
+        subcategory=fields["subcategory"],
+        description=fields["description"],
+        title=fields["title"],
+        place=fields["place"],
+        equipment=fields["equipment"]
     )
-    db_image = crud.upload_image(db=db, image=image_data)
+    db_image = await crud.upload_image(db=db, image=image_data)
     if not db_image:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Erro ao salvar a imagem")
 
+    thumbnails.generate_eager_variants(stored.sha256)
+
     return {"message": "Imagem carregada com sucesso"}
 
 
 @router.get("/api/images/{image_id}/", response_class=StreamingResponse)
-async def get_image_by_id(image_id: UUID, db: Session = Depends(get_db)):
+async def get_image_by_id(image_id: UUID,
+                          request: Request,
+                          w: Optional[int] = None,
+                          size: Optional[str] = None,
+                          db: AsyncSession = Depends(get_db)):
     # Recupera a imagem do banco de dados
-    db_image = crud.get_image_by_id(db=db, image_id=image_id)
+    db_image = await crud.get_image_metadata(db=db, image_id=image_id)
 
     if db_image is None:
         raise HTTPException(status_code=404, detail="Imagem não encontrada")
 
-    image_stream = BytesIO(db_image.image_data)
-    return StreamingResponse(image_stream, media_type="image/jpeg")
+    if not db_image.image_hash:
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+
+    # ?size=thumb|preview ou ?w=<largura>: serve um derivado reduzido do cache em disco
+    try:
+        width = thumbnails.resolve_width(size, w)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Tamanho de imagem inválido.")
+
+    # Conteúdo endereçado por hash: ETag forte, 304 e Range; ?v=<versão> torna a URL imutável
+    if width is not None:
+        variant = f"w{width}"
+        if http_cache.etag_matches(request, http_cache.etag_for(db_image.image_hash, variant)):
+            # Cliente já tem o derivado: responde 304 sem gerar nem abrir o arquivo
+            return http_cache.cached_blob_response(request, db_image.image_hash, "image/jpeg", variant=variant)
+        variant_file = await thumbnails.open_variant(db_image.image_hash, width)
+        if variant_file:
+            return http_cache.cached_blob_response(request, db_image.image_hash, "image/jpeg",
+                                                   file=variant_file, variant=variant)
+
+    return http_cache.cached_blob_response(request, db_image.image_hash, db_image.content_type or "image/jpeg")
 
 
 @router.get("/api/user/images/{user_id}")
-async def get_image_by_user(user_id: UUID, subcategory: Optional[str] = None, db: Session = Depends(get_db),
+async def get_image_by_user(user_id: UUID, subcategory: Optional[str] = None, db: AsyncSession = Depends(get_db),
                             current_user: models.User = Depends(get_current_user)):
-    db_images = crud.get_images_by_user(db=db, user_id=user_id, subcategory=subcategory)
+    db_image_ids = await crud.get_image_ids_by_user(db=db, user_id=user_id, subcategory=subcategory)
 
-    if not db_images:
+    if not db_image_ids:
         raise HTTPException(status_code=404, detail="Nenhuma imagem encontrada para este usuário")
 
     # Retorna uma lista de IDs das imagens
-    image_ids = [{"image_id": str(image.id)} for image in db_images]
+    image_ids = [{"image_id": str(image_id)} for image_id in db_image_ids]
 
     return {"sucess": True,
             "images": image_ids}
 
 @router.get("/api/images/{image_id}/details", response_model=dict,)
-async def get_image_details(image_id: UUID, db: Session = Depends(get_db),
+async def get_image_details(image_id: UUID, db: AsyncSession = Depends(get_db),
                             current_user: models.User = Depends(get_current_user)):
-    db_image = crud.get_image_by_id(db=db, image_id=image_id)
-    print(db_image)
+    db_image = await crud.get_image_metadata(db=db, image_id=image_id)
     if db_image is None:
         raise HTTPException(status_code=404, detail="Imagem não encontrada")
 
@@ -112,140 +162,400 @@ async def get_image_details(image_id: UUID, db: Session = Depends(get_db),
         "subcategory": db_image.subcategory,
         "equipment": db_image.equipment,
         "place": db_image.place,
-        "title": db_image.title
+        "title": db_image.title,
+        # Use como ?v= em /api/images/{id}/ para respostas com cache imutável
+        "version": http_cache.content_version(db_image.image_hash)
     }
 
-@router.post("/api/users/rate/")
-async def rate_user(rate_request: RateRequest,
-                    db: Session = Depends(get_db),
-                    current_user: models.User = Depends(get_current_user)):
-    if len(rate_request.ratings) != 5:
+MAX_DETAILS_BATCH_SIZE = 500
+
+@router.post("/api/images/details/batch")
+async def get_images_details_batch(batch: ImageDetailsBatchRequest, db: AsyncSession = Depends(get_db),
+                                   current_user: models.User = Depends(get_current_user)):
+    """
+    Metadados de várias imagens (por image_ids e/ou user_ids) em uma única consulta.
+    Mesmos campos de /api/images/{image_id}/details, mais user_id.
+    """
+    if not batch.image_ids and not batch.user_ids:
+        raise HTTPException(status_code=400, detail="Informe image_ids ou user_ids.")
+    if len(batch.image_ids) + len(batch.user_ids) > MAX_DETAILS_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Envie no máximo {MAX_DETAILS_BATCH_SIZE} IDs por requisição."
+        )
+
+    rows = await crud.get_images_metadata_bulk(db, image_ids=batch.image_ids, user_ids=batch.user_ids,
+                                               subcategory=batch.subcategory)
+    images = [
+        {
+            "image_id": str(row.id),
+            "user_id": str(row.user_id) if row.user_id else None,
+            "description": row.description,
+            "subcategory": row.subcategory,
+            "equipment": row.equipment,
+            "place": row.place,
+            "title": row.title,
+            "version": http_cache.content_version(row.image_hash),
+        }
+        for row in rows
+    ]
+    found = {image["image_id"] for image in images}
+    missing = [str(image_id) for image_id in batch.image_ids if str(image_id) not in found]
+    # Só tipos nativos do JSON: dispensa a validação/conversão do response_model
+    return JSONResponse({"images": images, "missing": missing})
+
+MAX_RATE_BATCH_SIZE = 500
+
+def validate_rate_item(evaluated_user_id: UUID, evaluator_id: UUID, ratings: List[RatingItem]):
+    if len(ratings) != 5:
         raise HTTPException(
             status_code=400,
             detail="Devem ser fornecidas exatamente 5 notas com critérios."
         )
 
-    for item in rate_request.ratings:
+    if len({item.criteria for item in ratings}) != len(ratings):
+        raise HTTPException(
+            status_code=400,
+            detail="Os critérios das notas não podem se repetir."
+        )
+
+    for item in ratings:
         if not (0 <= item.score <= 20):
             raise HTTPException(
                 status_code=400,
                 detail=f"Nota para o critério '{item.criteria}' deve estar entre 0 e 20."
             )
 
-    if rate_request.evaluated_user_id == rate_request.evaluator_id:
+    if evaluated_user_id == evaluator_id:
         raise HTTPException(
             status_code=400,
             detail="O avaliador nao pode se auto avaliar."
         )
 
-    evaluator = crud.get_user_by_id(db=db, user_id=rate_request.evaluator_id)
-    if evaluator.user_type != "A":
-        raise HTTPException(
-            status_code=400,
-            detail="O usuario nao é avaliador."
-        )
+@router.post("/api/users/rate/")
+async def rate_user(rate_request: RateRequest,
+                    db: AsyncSession = Depends(get_db),
+                    current_user: models.User = Depends(get_current_user)):
+    validate_rate_item(rate_request.evaluated_user_id, rate_request.evaluator_id, rate_request.ratings)
 
     try:
-        crud.set_user_rating(
+        await crud.set_user_rating(
             db=db,
             evaluated_user_id=rate_request.evaluated_user_id,
             ratings=rate_request.ratings,
             evaluator_id=rate_request.evaluator_id,
             category=rate_request.category
         )
-    except HTTPException as e:
-        raise e
-    except Exception as e:
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Erro ao atribuir notas")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Erro ao atribuir as notas."
         )
     return {"message": "Notas atribuídas com sucesso."}
 
+@router.post("/api/users/rate/batch/")
+async def rate_users_batch(rate_request: RateBatchRequest,
+                           db: AsyncSession = Depends(get_db),
+                           current_user: models.User = Depends(get_current_user)):
+    if not rate_request.items:
+        raise HTTPException(status_code=400, detail="Nenhuma nota informada.")
+
+    if len(rate_request.items) > MAX_RATE_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Envie no máximo {MAX_RATE_BATCH_SIZE} participantes por requisição."
+        )
+
+    seen = set()
+    for item in rate_request.items:
+        validate_rate_item(item.evaluated_user_id, rate_request.evaluator_id, item.ratings)
+        key = (item.evaluated_user_id, item.category)
+        if key in seen:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Participante {item.evaluated_user_id} repetido na categoria {item.category}."
+            )
+        seen.add(key)
+
+    try:
+        await crud.set_user_ratings(db=db, evaluator_id=rate_request.evaluator_id, items=rate_request.items)
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Erro ao atribuir notas em lote")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Erro ao atribuir as notas."
+        )
+    return {"message": "Notas atribuídas com sucesso.", "participants": len(rate_request.items)}
+
 @router.post("/api/images/rate/")
-def get_image_rate_by_category(rate_request: getRateRequest, db: Session = Depends(get_db),
+async def get_image_rate_by_category(rate_request: getRateRequest, db: AsyncSession = Depends(get_db),
                                current_user: models.User = Depends(get_current_user)):
-    ratings = crud.get_image_rating(db=db, user_id=str(rate_request.user_id), category=rate_request.category, evaluator_id=str(rate_request.evaluator_id))
+    ratings = await crud.get_image_rating(db=db, user_id=rate_request.user_id, category=rate_request.category, evaluator_id=rate_request.evaluator_id)
     if ratings:
         return {"ratings": ratings}
     raise HTTPException(status_code=400, detail="Imagens não encontradas para este usuário nesta categoria")
 
+@router.get("/api/images/archive")
+async def download_images_archive(subcategory: Optional[str] = None,
+                                  user_ids: List[UUID] = Query(default=[]),
+                                  user_category: Optional[schemas.CategoryEnum] = None,
+                                  current_user: models.User = Depends(get_current_user)):
+    """
+    ZIP com as imagens filtradas por categoria (?subcategory=A), participantes
+    (?user_ids=...&user_ids=...) e/ou categoria do participante (?user_category=1),
+    enviado à medida que é montado. Pelo menos um filtro é obrigatório.
+    """
+    if subcategory is None and not user_ids and user_category is None:
+        raise HTTPException(status_code=400, detail="Informe subcategory, user_ids ou user_category.")
+    if subcategory is not None and subcategory not in MAX_UPLOADS:
+        raise HTTPException(status_code=400, detail="Categoria inválida.")
+    if len(user_ids) > MAX_DETAILS_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Envie no máximo {MAX_DETAILS_BATCH_SIZE} IDs por requisição.")
+
+    if not stream_slots_available():
+        raise_streams_busy()
+
+    parts = ["imagens"]
+    if subcategory:
+        parts.append(f"categoria_{subcategory}")
+    if user_category:
+        parts.append(f"participantes_{user_category.value}")
+    return StreamingResponse(
+        archives.images_archive(subcategory, user_ids, user_category.value if user_category else None),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={'_'.join(parts)}.zip"},
+    )
+
+MAX_QUEUE_PAGE_SIZE = 200
+
+@router.get("/api/evaluators/{evaluator_id}/queue")
+async def get_evaluator_queue(evaluator_id: UUID,
+                              category: str,
+                              cursor: Optional[UUID] = None,
+                              limit: int = Query(50, ge=1, le=MAX_QUEUE_PAGE_SIZE),
+                              db: AsyncSession = Depends(get_db),
+                              current_user: models.User = Depends(get_current_user)):
+    """
+    Fila de trabalho do avaliador: participantes da categoria ainda sem todas as notas,
+    com as imagens e as notas já dadas. Envie next_cursor em ?cursor= para a próxima página.
+    """
+    if category not in MAX_UPLOADS:
+        raise HTTPException(status_code=400, detail="Categoria inválida.")
+    evaluator = await crud.get_user_metadata(db=db, user_id=evaluator_id)
+    if evaluator is None:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    if evaluator.user_type != 'A':
+        raise HTTPException(status_code=400, detail="O usuario nao é avaliador.")
+
+    participants = await crud.get_evaluator_queue(db, evaluator_id, category, after=cursor, limit=limit)
+    next_cursor = str(participants[-1]["user_id"]) if len(participants) == limit else None
+    return {"participants": participants, "next_cursor": next_cursor}
+
 @router.post("/api/invite")
-def send_mail_api(EmailRequest: SendEmailRequest,
-              db: Session = Depends(get_db),
+async def send_mail_api(EmailRequest: SendEmailRequest,
+              db: AsyncSession = Depends(get_db),
               current_user: models.User = Depends(get_current_user)):
     user_email = EmailRequest.email
     user_name = EmailRequest.name
     user_document = EmailRequest.document
-    user = crud.get_user_by_email_or_document(db, email=user_email,document=user_document)
+    user = await crud.get_user_by_email_or_document(db, email=user_email,document=user_document)
 
     if user:
         raise HTTPException(status_code=400, detail="Usuário já cadastrado com este e-mail ou documento")
 
     password = generate_random_password()
-    fake_adress = 'endereço dos avaliadores'
-    fake_cep ='00000000'
-    fake_Institution = 'Avaliador'
-
-    user_data = schemas.UserCreate(
-        name=user_name,
-        email=user_email,
-        password=password,
-        user_type='A',
-        document=user_document,
-        category='4',
-        institution='Avaliador',
-        complete_address='Avaliador',
-        cep='00000000'
-    )
+    user_data = schemas.UserCreate(**evaluator_user_fields(user_name, user_email, user_document), password=password)
     try:
-        crud.create_user(db=db, user=user_data)
-    except Exception as e:
-        print(e)
+        await crud.create_user(db=db, user=user_data, email=invite_email(password))
+    except Exception:
+        logger.exception("Erro ao cadastrar avaliador")
         raise HTTPException(status_code=500, detail="Erro ao cadastrar usuario")
 
-    email_content = f"Olá, você foi cadastrado como avaliador, acesse usando seu e-mail e sua nova senha : {password}"
-    sended_email = send_email(user_email, "Novo cadastro como Avaliador no concurso do LAGIM", email_content)
-    if sended_email:
-        return {"message": "Convite enviado com sucesso!"}
-    else:
-        user = crud.get_user_by_email_or_document(db=db, email=user_email,document=user_document)
-        crud.delete_user(db=db, user_id=user.id)
-        raise HTTPException(status_code=500, detail="Erro ao enviar email")
-
-def send_email(to_email: str, subject: str, content: str):
-    from_email = os.getenv("EMAIL_GMAIL")
-    password = os.getenv("SENHA_GMAIL")
-
-    msg = MIMEMultipart()
-    msg["From"] = from_email
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    msg.attach(MIMEText(content, "plain"))
-    print(password)
+    # O envio é feito em segundo plano pela outbox (app/mailer.py)
+    return {"message": "Convite enviado com sucesso!"}
+
+# Com BCRYPT_ROUNDS=12 cada hash leva ~0,25 s num worker de BULK_HASH_POOL_SIZE
+MAX_BULK_INVITES = int(os.getenv("MAX_BULK_INVITES", "200"))
+
+@router.post("/api/invite/bulk")
+async def send_mail_bulk_api(invites: List[SendEmailRequest],
+                             db: AsyncSession = Depends(get_db),
+                             current_user: models.User = Depends(get_current_user)):
+    return await invite_evaluators(db, [invite.model_dump() for invite in invites])
+
+@router.post("/api/invite/bulk/csv")
+async def send_mail_bulk_csv_api(file: UploadFile = File(...),
+                                 db: AsyncSession = Depends(get_db),
+                                 current_user: models.User = Depends(get_current_user)):
+    # CSV com cabeçalho email,name,document (separado por vírgula ou ponto e vírgula)
+    content = (await file.read()).decode("utf-8-sig")
+    try:
+        dialect = csv.Sniffer().sniff(content.split("\n", 1)[0], delimiters=",;")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(content), dialect=dialect)
+    if not reader.fieldnames or not {"email", "name", "document"} <= {f.strip() for f in reader.fieldnames}:
+        raise HTTPException(status_code=400, detail="O CSV deve ter as colunas email, name e document")
+
+    rows = [{key.strip(): (value or "").strip() for key, value in row.items() if key} for row in reader]
+    return await invite_evaluators(db, rows)
+
+async def invite_evaluators(db: AsyncSession, rows: List[dict]) -> dict:
+    """
+    Cadastra avaliadores em lote: deduplica com uma consulta, gera os hashes em paralelo,
+    insere todos em uma transação e enfileira os convites. Retorna o resultado por linha.
+    """
+    if not rows:
+        raise HTTPException(status_code=400, detail="Nenhum convite informado.")
+    if len(rows) > MAX_BULK_INVITES:
+        raise HTTPException(status_code=400, detail=f"Envie no máximo {MAX_BULK_INVITES} convites por requisição.")
+
+    results = []
+    valid = []
+    seen_emails, seen_documents = set(), set()
+    for index, row in enumerate(rows):
+        email, name, document = row.get("email"), row.get("name"), row.get("document")
+        result = {"row": index + 1, "email": email, "status": "invited", "detail": None}
+        results.append(result)
+        if not email or not name or not document:
+            result.update(status="invalid", detail="email, name e document são obrigatórios")
+        elif email in seen_emails or document in seen_documents:
+            result.update(status="duplicate", detail="Repetido neste lote")
+        else:
+            seen_emails.add(email)
+            seen_documents.add(document)
+            valid.append((result, row))
+
+    existing_emails, existing_documents = await crud.get_existing_emails_and_documents(
+        db, [row["email"] for _, row in valid], [row["document"] for _, row in valid]
+    )
+    to_create = []
+    for result, row in valid:
+        if row["email"] in existing_emails or row["document"] in existing_documents:
+            result.update(status="exists", detail="Usuário já cadastrado com este e-mail ou documento")
+        else:
+            to_create.append((result, row))
+
+    passwords = [generate_random_password() for _ in to_create]
+    hashed_passwords = await hash_passwords_async(passwords)
+    users = [
+        {**evaluator_user_fields(row["name"], row["email"], row["document"]), "password": hashed}
+        for (_, row), hashed in zip(to_create, hashed_passwords)
+    ]
+    emails = {row["email"]: invite_email(password) for (_, row), password in zip(to_create, passwords)}
     try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(from_email, password)
-            server.sendmail(from_email, to_email, msg.as_string())
-    except Exception as e:
-        print(e)
-        return False
-    return True
+        inserted = await crud.create_users_bulk(db, users, emails)
+    except Exception:
+        logger.exception("Erro ao cadastrar avaliadores em lote")
+        raise HTTPException(status_code=500, detail="Erro ao cadastrar usuarios")
+
+    for result, row in to_create:
+        if row["email"] not in inserted:
+            result.update(status="exists", detail="Usuário já cadastrado com este e-mail ou documento")
+
+    return {
+        "invited": sum(1 for result in results if result["status"] == "invited"),
+        "results": results,
+    }
+
+def evaluator_user_fields(name: str, email: str, document: str) -> dict:
+    # Avaliadores não informam endereço nem instituição no convite
+    return {
+        "name": name,
+        "email": email,
+        "document": document,
+        "user_type": "A",
+        "category": "4",
+        "institution": "Avaliador",
+        "complete_address": "Avaliador",
+        "cep": "00000000",
+    }
+
+def invite_email(password: str) -> schemas.EmailContent:
+    return schemas.EmailContent(
+        subject="Novo cadastro como Avaliador no concurso do LAGIM",
+        content=f"Olá, você foi cadastrado como avaliador, acesse usando seu e-mail e sua nova senha : {password}"
+    )
 
 def generate_random_password(length=12):
     characters = string.ascii_letters + string.digits + string.punctuation
     password = ''.join(secrets.choice(characters) for _ in range(length))
     return password
 
-@router.get("/api/avaliacoes/media-por-usuario")
-def listar_medias_por_usuario(db: Session = Depends(get_db)):
-    dados_medias = crud.get_user_media(db)
-    if not dados_medias:
+@router.get("/api/avaliacoes/media-por-usuario", status_code=status.HTTP_202_ACCEPTED)
+async def listar_medias_por_usuario(db: AsyncSession = Depends(get_db)):
+    # O PDF é gerado em segundo plano; a resposta traz o job e a URL de download
+    job = await reports.request_report(db)
+    if job is None:
         raise HTTPException(status_code=404, detail="Nenhum dado de avaliação encontrado.")
 
-    pdf_buffer = criar_pdf_medias(dados_medias)
+    return report_job_response(job)
+
+@router.get("/api/avaliacoes/media-por-usuario/export")
+async def exportar_medias_por_usuario(format: str = "csv",
+                                      user_category: Optional[schemas.CategoryEnum] = None,
+                                      subcategory: Optional[str] = None,
+                                      current_user: models.User = Depends(get_current_user)):
+    """
+    Médias por participante em CSV ou XLSX, enviadas à medida que o banco devolve as linhas.
+    Filtros opcionais: categoria do participante (?user_category=) e categoria da nota (?subcategory=A|B).
+    """
+    if format not in exports.MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Formato inválido. Use: csv, xlsx")
+    if subcategory is not None and subcategory not in MAX_UPLOADS:
+        raise HTTPException(status_code=400, detail="Categoria inválida.")
 
-    headers = {'Content-Disposition': 'attachment; filename="media_usuarios_endereco.pdf"'}
+    if not stream_slots_available():
+        raise_streams_busy()
+
+    filename = "media_usuarios"
+    if user_category:
+        filename += f"_categoria_{user_category.value}"
+    if subcategory:
+        filename += f"_{subcategory}"
+    return StreamingResponse(
+        exports.export_user_media(format, user_category.value if user_category else None, subcategory),
+        media_type=exports.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{format}"},
+    )
 
-    return StreamingResponse(pdf_buffer, media_type='application/pdf', headers=headers)
+@router.get("/api/avaliacoes/relatorios/{job_id}")
+async def get_report_status(job_id: str):
+    job = reports.get_report_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Relatório não encontrado.")
+
+    return report_job_response(job)
+
+@router.get("/api/avaliacoes/relatorios/{job_id}/download", response_class=FileResponse)
+async def download_report(job_id: str):
+    job = reports.get_report_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Relatório não encontrado.")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail="Relatório ainda não está pronto.")
+
+    return FileResponse(
+        reports.report_path(job_id),
+        media_type='application/pdf',
+        filename="media_usuarios_endereco.pdf"
+    )
+
+def raise_streams_busy():
+    # Todas as vagas de streaming deste worker ocupadas: o cliente tenta de novo em instantes
+    raise HTTPException(status_code=503, detail="Muitas exportações em andamento, tente novamente em instantes.",
+                        headers={"Retry-After": "10"})
+
+def report_job_response(job: reports.ReportJob) -> dict:
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "error": job.error,
+        "status_url": f"/api/avaliacoes/relatorios/{job.job_id}",
+        "download_url": f"/api/avaliacoes/relatorios/{job.job_id}/download",
+    }
@@ -0,0 +1,58 @@
+from typing import Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..database import get_db
+from app import ranking
+from app.schemas import CategoryEnum
+from app.utils import MAX_UPLOADS
+from app.routers.users import get_current_user
+
+router = APIRouter()
+
+MAX_RANKING_SIZE = 500
+
+
+def check_ranking_params(category: str, normalization: str):
+    if category not in MAX_UPLOADS:
+        raise HTTPException(status_code=400, detail="Categoria inválida.")
+    if normalization not in ranking.NORMALIZATIONS:
+        raise HTTPException(status_code=400, detail=f"Normalização inválida. Use: {', '.join(ranking.NORMALIZATIONS)}")
+
+
+@router.get("/api/rankings/{category}")
+async def get_ranking(category: str,
+                      user_category: Optional[CategoryEnum] = None,
+                      k: int = Query(10, ge=1, le=MAX_RANKING_SIZE),
+                      normalization: str = "raw",
+                      db: AsyncSession = Depends(get_db),
+                      current_user: models.User = Depends(get_current_user)):
+    """
+    Top-K da categoria de nota (A/B) dentro de cada categoria de participante,
+    com a média de cada critério. Filtre com ?user_category= para um único grupo.
+    """
+    check_ranking_params(category, normalization)
+    index = await ranking.engine.get_index(db, normalization)
+    return {
+        "category": category,
+        "normalization": normalization,
+        "ranking": index.top(category, user_category.value if user_category else None, k),
+    }
+
+
+@router.get("/api/rankings/{category}/users/{user_id}")
+async def get_user_rank(category: str,
+                        user_id: UUID,
+                        normalization: str = "raw",
+                        db: AsyncSession = Depends(get_db),
+                        current_user: models.User = Depends(get_current_user)):
+    # Posição do participante no grupo da sua categoria; total = participantes com notas no grupo
+    check_ranking_params(category, normalization)
+    index = await ranking.engine.get_index(db, normalization)
+    entry = index.rank_of(str(user_id), category)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Participante sem notas nesta categoria")
+    return entry
@@ -1,24 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, FastAPI, Response
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, FastAPI, Response, Request, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from .. import crud, models, schemas
 from ..database import get_db
+import base64
+import json
 import logging
 from uuid import UUID
-from app.utils import get_current_user,oauth2_scheme
+from app.utils import get_current_user,oauth2_scheme,decode_access_token
+from app.token_denylist import denylist
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.encoders import jsonable_encoder
-from app.routers.items import send_email
+from app import http_cache
+from fastapi.responses import FileResponse
 router = APIRouter()
 
 @router.post(path="/api/users/login")
-def authenticate_user(user_login: schemas.UserLogin, db: Session = Depends(get_db)):
-    db_user = crud.authenticate_user(db, user_login.email, user_login.password)
+async def authenticate_user(user_login: schemas.UserLogin, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.authenticate_user(db, user_login.email, user_login.password)
     if db_user is None:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    token_data = crud.generate_token_for_user(db, db_user.id)
-    user_data = crud.get_user_by_id(db, db_user.id)
+    token_data = await crud.generate_token_for_user(db, db_user.id)
+    # authenticate_user já carregou os campos necessários; evita uma segunda consulta
+    user_data = db_user
     return {
         "token": token_data["token"],
         "token_type": "bearer",
@@ -31,6 +36,14 @@ def authenticate_user(user_login: schemas.UserLogin, db: Session = Depends(get_d
         }
     }
 
+@router.post("/api/users/logout")
+async def logout(token: str = Depends(oauth2_scheme)):
+    # Revoga o token atual pelo jti; a entrada expira junto com o próprio token
+    payload = decode_access_token(token)
+    if payload.get("jti"):
+        denylist.revoke(payload["jti"], payload["exp"])
+    return {"message": "Logout realizado com sucesso"}
+
 @router.post("/api/users/")
 async def create_user(name: str = Form(...),
     document: str =Form(...),
@@ -42,13 +55,11 @@ async def create_user(name: str = Form(...),
     complete_address: str = Form(...),
     institution: str = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_db)):
 
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="O arquivo deve ser um PDF")
 
-    file_content = await file.read()
-
     user_data = schemas.UserCreate(
         name=name,
         email=email,
@@ -60,7 +71,11 @@ async def create_user(name: str = Form(...),
         complete_address=complete_address,
         institution=institution
     )
-    db_user = crud.create_user(db=db, user=user_data, file_content=file_content)
+    confirmation_email = schemas.EmailContent(
+        subject="Confirmação da criação do seu usuario no concurso do LAGIM",
+        content="E-mail automático para confirmar que seu usuário foi criado com sucesso"
+    )
+    db_user = await crud.create_user(db=db, user=user_data, file_content=file.file, email=confirmation_email)
 
     if not db_user:
         raise HTTPException(
@@ -68,69 +83,92 @@ async def create_user(name: str = Form(...),
             detail="Usuário já existe com o mesmo e-mail ou documento"
         )
 
-    email_content = ("E-mail automático para confirmar que seu usuário foi criado com sucesso")
+    return {"message": "Usuário cadastrado com sucesso "}
 
-    subject = "Confirmação da criação do seu usuario no concurso do LAGIM"
-    email_sended = send_email(to_email=email, subject=subject, content=email_content)
-    if email_sended:
-        return {"message": "Usuário cadastrado com sucesso "}
-    else:
-        return {"message": "Usuário cadastrado com sucesso porem ocorreu erro ao enviar e-mail de confirmação"}
 
 
+MAX_USERS_PAGE_SIZE = 100
+
+def encode_users_cursor(user: models.User) -> str:
+    raw = json.dumps([user.name or "", str(user.id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_users_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        name, user_id = json.loads(raw)
+        return name or "", UUID(user_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
 
 @router.get("/api/users/", response_model=Optional[List[schemas.UserOut]])
-def get_users(skip: int = 0,
-              limit: int = 10,
-              db: Session = Depends(get_db)):
-    db_users = crud.get_users(db=db, skip=skip, limit=limit)
+async def get_users(response: Response,
+              limit: int = Query(10, ge=1, le=MAX_USERS_PAGE_SIZE),
+              cursor: Optional[str] = None,
+              category: Optional[schemas.CategoryEnum] = None,
+              user_type: Optional[str] = None,
+              institution: Optional[str] = None,
+              include_total: bool = False,
+              skip: int = Query(0, ge=0, deprecated=True),
+              db: AsyncSession = Depends(get_db)):
+    # Paginação por cursor: envie o X-Next-Cursor da resposta em ?cursor= para a próxima página
+    after = decode_users_cursor(cursor) if cursor else None
+    filters = {
+        "category": category.value if category else None,
+        "user_type": user_type,
+        "institution": institution,
+    }
+    db_users = await crud.get_users(db=db, limit=limit, after=after, skip=skip, **filters)
+    if include_total:
+        response.headers["X-Total-Count"] = str(await crud.count_users(db, **filters))
     if not db_users:
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail="No users found.")
+    if len(db_users) == limit:
+        response.headers["X-Next-Cursor"] = encode_users_cursor(db_users[-1])
     return db_users
 
 # Obter um usuário por ID
 @router.get("/api/users/{user_id}", response_model=Optional[schemas.UserOut])
-def get_user(user_id: UUID,
-             db: Session = Depends(get_db),
+async def get_user(user_id: UUID,
+             db: AsyncSession = Depends(get_db),
              current_user: models.User = Depends(get_current_user)):
-    db_user = crud.get_user_by_id(db=db, user_id=user_id)
+    db_user = await crud.get_user_metadata(db=db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 # Deletar um usuário
 @router.delete("/api/users/{user_id}", response_model=Optional[schemas.UserOut])
-def delete_user(user_id: UUID,
-                db: Session = Depends(get_db),
+async def delete_user(user_id: UUID,
+                db: AsyncSession = Depends(get_db),
                 current_user: models.User = Depends(get_current_user)):
-    db_user = crud.delete_user(db=db, user_id=user_id)
+    db_user = await crud.delete_user(db=db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 @router.put("/api/users/{user_id}",response_model=Optional[schemas.UserOut])
-def update_password(user_id: UUID,
+async def update_password(user_id: UUID,
     password_data: schemas.UserPasswordUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)):
 
-    db_user = crud.update_password(db=db, user_id=user_id, password=password_data.password)
+    db_user = await crud.update_password(db=db, user_id=user_id, password=password_data.password)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
-@router.get("/api/users/{user_id}/file", response_class=Response)
-def get_user_file(user_id: UUID, db: Session = Depends(get_db),
+@router.get("/api/users/{user_id}/file", response_class=FileResponse)
+async def get_user_file(user_id: UUID, request: Request, db: AsyncSession = Depends(get_db),
                   current_user: models.User = Depends(get_current_user)):
-    db_user = crud.get_user_by_id(db, user_id=user_id)
+    db_user = await crud.get_user_metadata(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
 
-    if not db_user.file:
+    if not db_user.file_hash:
         raise HTTPException(status_code=404, detail="Arquivo não encontrado")
 
-    return Response(
-        content=db_user.file,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={db_user.name}_document.pdf"}
-    )
\ No newline at end of file
+    headers = {"Content-Disposition": f"attachment; filename={db_user.name}_document.pdf"}
+    # Documento exige autenticação: cache apenas no navegador (private), nunca no proxy
+    return http_cache.cached_blob_response(request, db_user.file_hash, db_user.file_content_type or "application/pdf",
+                                           private=True, headers=headers)
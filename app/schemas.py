@@ -35,6 +35,15 @@ class RateRequest(BaseModel):
     category: str
     evaluator_id: UUID
 
+class RateBatchItem(BaseModel):
+    evaluated_user_id: UUID
+    ratings: List[RatingItem]
+    category: str
+
+class RateBatchRequest(BaseModel):
+    evaluator_id: UUID
+    items: List[RateBatchItem]
+
 class UserCreate(BaseModel):
     name: str
     document: str
@@ -66,6 +75,7 @@ class UserOut(BaseModel):
     category: CategoryEnum
     id: UUID
     institution: str
+    file_version: Optional[str] = None
 
     class Config:
         orm_mode = True
@@ -93,6 +103,11 @@ class ImageUpdate(BaseModel):
     subcategory: Optional[str] = None
     description: Optional[str] = None
 
+class ImageDetailsBatchRequest(BaseModel):
+    image_ids: List[UUID] = []
+    user_ids: List[UUID] = []
+    subcategory: Optional[str] = None
+
 class ImageRatingCreate(BaseModel):
     rating: int
 
@@ -110,5 +125,9 @@ class SendEmailRequest(BaseModel):
     name: str
     document: str
 
+class EmailContent(BaseModel):
+    subject: str
+    content: str
+
 class UserPasswordUpdate(BaseModel):
     password: str
\ No newline at end of file
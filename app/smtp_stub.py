@@ -0,0 +1,131 @@
+"""
+Servidor SMTP local para desenvolvimento e testes. Aceita qualquer login,
+não envia nada para fora e guarda as mensagens recebidas em memória
+(e opcionalmente em arquivos .eml).
+
+    python -m app.smtp_stub --port 1025 --outdir storage/mails
+
+Configure a aplicação com SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=false.
+"""
+import argparse
+import asyncio
+import os
+import uuid
+from typing import List, Optional
+
+
+class ReceivedMessage:
+    def __init__(self, mail_from: str, rcpt_to: List[str], data: bytes):
+        self.mail_from = mail_from
+        self.rcpt_to = rcpt_to
+        self.data = data
+
+
+class SMTPStub:
+    def __init__(self, host: str = "127.0.0.1", port: int = 1025, outdir: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.outdir = outdir
+        self.messages: List[ReceivedMessage] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if self.outdir:
+            os.makedirs(self.outdir, exist_ok=True)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        # Porta 0 escolhe uma porta livre
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async def reply(line: str):
+            writer.write((line + "\r\n").encode())
+            await writer.drain()
+
+        mail_from, rcpt_to = "", []
+        await reply("220 smtp-stub pronto")
+        while True:
+            raw = await reader.readline()
+            if not raw:
+                break
+            line = raw.decode(errors="replace").rstrip("\r\n")
+            command = line.split(" ", 1)[0].upper()
+
+            if command == "EHLO":
+                writer.write(b"250-smtp-stub\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                await writer.drain()
+            elif command == "HELO":
+                await reply("250 smtp-stub")
+            elif command == "AUTH":
+                parts = line.split()
+                if len(parts) > 1 and parts[1].upper() == "LOGIN" and len(parts) == 2:
+                    # Usuário e senha vêm em linhas separadas; qualquer valor é aceito
+                    for prompt in ("334 VXNlcm5hbWU6", "334 UGFzc3dvcmQ6"):
+                        await reply(prompt)
+                        await reader.readline()
+                elif len(parts) > 1 and parts[1].upper() == "LOGIN":
+                    await reply("334 UGFzc3dvcmQ6")
+                    await reader.readline()
+                elif len(parts) == 2:
+                    # AUTH PLAIN sem credencial inline
+                    await reply("334 ")
+                    await reader.readline()
+                await reply("235 Autenticado")
+            elif command == "MAIL":
+                mail_from, rcpt_to = line[10:].strip(" <>"), []
+                await reply("250 OK")
+            elif command == "RCPT":
+                rcpt_to.append(line[8:].strip(" <>"))
+                await reply("250 OK")
+            elif command == "DATA":
+                await reply("354 Termine com <CRLF>.<CRLF>")
+                lines = []
+                while True:
+                    data_line = await reader.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    if data_line.startswith(b".."):
+                        data_line = data_line[1:]
+                    lines.append(data_line)
+                self._store(ReceivedMessage(mail_from, rcpt_to, b"".join(lines)))
+                mail_from, rcpt_to = "", []
+                await reply("250 Mensagem aceita")
+            elif command == "RSET":
+                mail_from, rcpt_to = "", []
+                await reply("250 OK")
+            elif command == "NOOP":
+                await reply("250 OK")
+            elif command == "QUIT":
+                await reply("221 Até logo")
+                break
+            else:
+                await reply("502 Comando não implementado")
+        writer.close()
+
+    def _store(self, message: ReceivedMessage):
+        self.messages.append(message)
+        if self.outdir:
+            path = os.path.join(self.outdir, f"{uuid.uuid4().hex}.eml")
+            with open(path, "wb") as f:
+                f.write(message.data)
+        print(f"E-mail recebido: {message.mail_from} -> {', '.join(message.rcpt_to)}")
+
+
+async def main(host: str, port: int, outdir: Optional[str]):
+    stub = SMTPStub(host, port, outdir)
+    await stub.start()
+    print(f"SMTP stub ouvindo em {stub.host}:{stub.port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor SMTP local para testes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--outdir", default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port, args.outdir))
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Iterator, Optional, Union
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StoredBlob:
+    def __init__(self, sha256: str, size: int):
+        self.sha256 = sha256
+        self.size = size
+
+
+class BlobWriter:
+    """
+    Recebe o conteúdo em pedaços, calculando o SHA-256 enquanto grava.
+    O blob só fica visível no storage depois do commit().
+    """
+
+    @property
+    def sha256(self) -> str:
+        # Hash do que foi escrito até agora; antes do commit() serve para travar o hash no banco
+        raise NotImplementedError
+
+    def write(self, chunk: bytes) -> None:
+        raise NotImplementedError
+
+    def write_all(self, data: Union[bytes, BinaryIO]) -> None:
+        if isinstance(data, (bytes, bytearray)):
+            self.write(bytes(data))
+            return
+        while True:
+            chunk = data.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.write(chunk)
+
+    def commit(self) -> StoredBlob:
+        raise NotImplementedError
+
+    def abort(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+
+class BlobStorage:
+    """
+    Interface do armazenamento de arquivos endereçado por conteúdo (SHA-256).
+    """
+
+    def writer(self) -> BlobWriter:
+        raise NotImplementedError
+
+    def exists(self, sha256: str) -> bool:
+        raise NotImplementedError
+
+    def open(self, sha256: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def delete(self, sha256: str) -> None:
+        raise NotImplementedError
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        # Backends que não estão em disco local retornam None e são servidos via iter_chunks
+        return None
+
+    def save(self, data: Union[bytes, BinaryIO]) -> StoredBlob:
+        with self.writer() as writer:
+            writer.write_all(data)
+            return writer.commit()
+
+    def iter_chunks(self, sha256: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with self.open(sha256) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+class LocalBlobWriter(BlobWriter):
+    def __init__(self, storage: "LocalBlobStorage"):
+        self._storage = storage
+        self._hash = hashlib.sha256()
+        self._size = 0
+        fd, self._tmp_path = tempfile.mkstemp(dir=storage.tmp_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def write(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+        self._size += len(chunk)
+        self._file.write(chunk)
+
+    def commit(self) -> StoredBlob:
+        self._file.close()
+        sha256 = self._hash.hexdigest()
+        final_path = self._storage.path_for(sha256)
+        if os.path.exists(final_path):
+            # Mesmo conteúdo já armazenado: descarta a cópia temporária
+            os.remove(self._tmp_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(self._tmp_path, final_path)
+        return StoredBlob(sha256=sha256, size=self._size)
+
+    def abort(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class LocalBlobStorage(BlobStorage):
+    """
+    Guarda cada arquivo em <root>/<hash[:2]>/<hash[2:4]>/<hash>.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def writer(self) -> LocalBlobWriter:
+        return LocalBlobWriter(self)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path_for(sha256))
+
+    def open(self, sha256: str) -> BinaryIO:
+        return open(self.path_for(sha256), "rb")
+
+    def delete(self, sha256: str) -> None:
+        try:
+            os.remove(self.path_for(sha256))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        return self.path_for(sha256)
+
+
+STORAGE_BACKENDS = {
+    "local": lambda: LocalBlobStorage(os.getenv("BLOB_STORAGE_PATH", "storage/blobs")),
+}
+
+_storage: Optional[BlobStorage] = None
+
+
+def get_storage() -> BlobStorage:
+    global _storage
+    if _storage is None:
+        backend = os.getenv("BLOB_STORAGE_BACKEND", "local")
+        if backend not in STORAGE_BACKENDS:
+            raise RuntimeError(f"Backend de armazenamento desconhecido: {backend}")
+        _storage = STORAGE_BACKENDS[backend]()
+    return _storage
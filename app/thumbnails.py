@@ -0,0 +1,355 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Dict, Optional
+
+from PIL import Image as PILImage, ImageOps
+
+from app.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Tamanhos nomeados aceitos em ?size=; ?w= é arredondado para a largura permitida mais próxima acima
+THUMBNAIL_SIZES = {"thumb": 320, "preview": 1024}
+THUMBNAIL_WIDTHS = sorted(
+    {int(w) for w in os.getenv("THUMBNAIL_WIDTHS", "160,320,640,1024,1600").split(",") if w.strip()}
+    | set(THUMBNAIL_SIZES.values())
+)
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "82"))
+THUMBNAIL_CACHE_PATH = os.getenv("THUMBNAIL_CACHE_PATH", "storage/thumbs")
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Tamanhos gerados logo após o upload (ex.: "thumb,preview"); vazio gera só no primeiro acesso
+THUMBNAIL_EAGER_SIZES = [s.strip() for s in os.getenv("THUMBNAIL_EAGER_SIZES", "thumb").split(",") if s.strip()]
+
+# Larguras de originais lembradas em memória (as demais são lidas dos arquivos <hash>.width)
+ORIGINAL_WIDTHS_MAX_ENTRIES = int(os.getenv("THUMBNAIL_ORIGINAL_WIDTHS_MAX_ENTRIES", "100000"))
+
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# Temporários mais antigos que isso são sobras de um worker que caiu no meio da geração
+TEMP_MAX_AGE = int(os.getenv("THUMBNAIL_TEMP_MAX_AGE", "3600"))
+
+
+def resolve_width(size: Optional[str], w: Optional[int]) -> Optional[int]:
+    """
+    Converte ?size= ou ?w= na largura do derivado. Retorna None para a imagem original.
+    Levanta ValueError para tamanhos inválidos.
+    """
+    if size:
+        if size not in THUMBNAIL_SIZES:
+            raise ValueError(size)
+        return THUMBNAIL_SIZES[size]
+    if w is None:
+        return None
+    if w <= 0:
+        raise ValueError(w)
+    for width in THUMBNAIL_WIDTHS:
+        if width >= w:
+            return width
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def _render_variant(source_path: str, target_path: str, width: int, quality: int) -> int:
+    """
+    Roda no pool de processos e retorna a largura da original. Se ela já couber na
+    largura pedida nada é gerado (quem chama compara as duas).
+    """
+    with PILImage.open(source_path) as img:
+        original_width = img.width
+        if original_width <= width:
+            return original_width
+        # draft deixa o decodificador JPEG reduzir a escala durante a leitura;
+        # (width, width) garante largura suficiente mesmo se a orientação EXIF girar a imagem
+        img.draft("RGB", (width, width))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        # Limita só a largura, mantendo a proporção e sem ampliar
+        img.thumbnail((width, 65535), PILImage.LANCZOS)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                img.save(f, "JPEG", quality=quality, optimize=True, progressive=True)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, target_path)
+    return original_width
+
+
+class DerivativeCache:
+    """
+    Derivados em disco, chaveados por hash da imagem e largura, com remoção LRU
+    quando o total passa de max_bytes.
+
+    O diretório é compartilhado entre os workers e cada um tem o próprio índice LRU,
+    então o disco é a fonte da verdade: o arquivo é aberto antes de ser servido
+    (um descritor aberto continua válido mesmo se outro processo apagar o arquivo)
+    e um FileNotFoundError vira uma nova geração.
+
+    A largura das originais que não precisam de derivado (já cabem na largura
+    pedida) fica num arquivo <hash>.width, para não voltar ao pool de processos a
+    cada pedido dessas imagens. Esses arquivos e as cópias temporárias das
+    originais (.src.tmp) também contam no limite e saem pela mesma limpeza LRU.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._original_widths: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        files = []
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.endswith((".jpg", ".width", ".tmp")):
+                continue
+            try:
+                stat = os.stat(path)
+                # Temporários recentes podem ser de outro worker gerando agora: só contam no LRU
+                if name.endswith(".tmp") and now - stat.st_mtime > TEMP_MAX_AGE:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_atime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self._total += size
+
+    def path_for(self, image_hash: str, width: int) -> str:
+        return os.path.join(self.root, f"{image_hash}_{width}.jpg")
+
+    def open(self, image_hash: str, width: int) -> Optional[BinaryIO]:
+        """
+        Abre o derivado para leitura, ou None se ele não existe no disco
+        (ainda não gerado ou removido pela limpeza de qualquer worker).
+        """
+        path = self.path_for(image_hash, width)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._entries.pop(path, 0)
+            return None
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+            else:
+                # Gerado por outro worker: passa a contar no LRU deste também
+                size = os.fstat(f.fileno()).st_size
+                self._entries[path] = size
+                self._total += size
+        return f
+
+    def add(self, path: str):
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._touch(path, size)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_path, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+
+    def discard(self, path: str):
+        # Remove um arquivo do cache (ex.: a cópia temporária da original ao fim da geração)
+        with self._lock:
+            self._total -= self._entries.pop(path, 0)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _touch(self, path: str, size: int):
+        # Chamado com o lock: atualiza o tamanho e marca como usado mais recentemente
+        self._total += size - self._entries.pop(path, 0)
+        self._entries[path] = size
+
+    def _width_path(self, image_hash: str) -> str:
+        return os.path.join(self.root, f"{image_hash}.width")
+
+    def original_width(self, image_hash: str) -> Optional[int]:
+        with self._lock:
+            width = self._original_widths.get(image_hash)
+            if width is not None:
+                self._original_widths.move_to_end(image_hash)
+                return width
+        path = self._width_path(image_hash)
+        try:
+            with open(path) as f:
+                size = os.fstat(f.fileno()).st_size
+                width = int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+        with self._lock:
+            self._touch(path, size)
+        self._remember_width(image_hash, width)
+        return width
+
+    def set_original_width(self, image_hash: str, width: int):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(str(width))
+        path = self._width_path(image_hash)
+        os.replace(tmp_path, path)
+        self.add(path)
+        self._remember_width(image_hash, width)
+
+    def _remember_width(self, image_hash: str, width: int):
+        with self._lock:
+            self._original_widths[image_hash] = width
+            while len(self._original_widths) > ORIGINAL_WIDTHS_MAX_ENTRIES:
+                self._original_widths.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"files": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes,
+                "original_widths": len(self._original_widths)}
+
+
+_cache: Optional[DerivativeCache] = None
+_executor: Optional[ProcessPoolExecutor] = None
+_in_flight: Dict[tuple, asyncio.Future] = {}
+_background_tasks = set()
+
+
+def get_cache() -> DerivativeCache:
+    global _cache
+    if _cache is None:
+        _cache = DerivativeCache(THUMBNAIL_CACHE_PATH, THUMBNAIL_CACHE_MAX_BYTES)
+    return _cache
+
+
+def get_executor() -> ProcessPoolExecutor:
+    # Criado no primeiro derivado: importar o módulo não sobe processos
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _executor
+
+
+def _reset_executor():
+    global _executor
+    _executor = None
+
+
+def _copy_to_temp(image_hash: str) -> str:
+    # Backends sem caminho local: o Pillow precisa de um arquivo para abrir
+    cache = get_cache()
+    fd, tmp_path = tempfile.mkstemp(dir=cache.root, suffix=".src.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, get_storage().open(image_hash) as source:
+            shutil.copyfileobj(source, f)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    # A cópia ocupa o mesmo disco: conta no limite enquanto existir
+    cache.add(tmp_path)
+    return tmp_path
+
+
+async def _generate(image_hash: str, width: int) -> bool:
+    # Retorna False quando a original já cabe na largura pedida
+    cache = get_cache()
+    target_path = cache.path_for(image_hash, width)
+    source_path = get_storage().local_path(image_hash)
+    tmp_source = None
+    loop = asyncio.get_running_loop()
+    try:
+        if source_path is None:
+            tmp_source = source_path = await loop.run_in_executor(None, _copy_to_temp, image_hash)
+        original_width = await loop.run_in_executor(
+            get_executor(), _render_variant, source_path, target_path, width, THUMBNAIL_QUALITY
+        )
+    except BrokenProcessPool:
+        # Um processo do pool morreu (ex.: falta de memória): o próximo derivado cria outro pool
+        _reset_executor()
+        raise
+    finally:
+        if tmp_source:
+            cache.discard(tmp_source)
+    if original_width <= width:
+        cache.set_original_width(image_hash, original_width)
+        return False
+    cache.add(target_path)
+    return True
+
+
+async def _ensure_variant(image_hash: str, width: int) -> bool:
+    # Pedidos simultâneos do mesmo derivado compartilham a mesma geração
+    key = (image_hash, width)
+    future = _in_flight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_generate(image_hash, width))
+        _in_flight[key] = future
+        future.add_done_callback(lambda _: _in_flight.pop(key, None))
+    return await asyncio.shield(future)
+
+
+async def open_variant(image_hash: str, width: int) -> Optional[BinaryIO]:
+    """
+    Derivado aberto para leitura, gerando-o se necessário. Retorna None quando a
+    original já cabe na largura pedida ou quando o derivado não pôde ser gerado
+    (nos dois casos serve-se a original). Quem chama fecha o arquivo.
+    """
+    cache = get_cache()
+    original_width = cache.original_width(image_hash)
+    if original_width is not None and original_width <= width:
+        return None
+
+    # Duas tentativas: o derivado recém-gerado pode ser removido pela limpeza de outro worker
+    for _ in range(2):
+        f = cache.open(image_hash, width)
+        if f is not None:
+            return f
+        try:
+            if not await _ensure_variant(image_hash, width):
+                return None
+        except Exception:
+            # Imagem que o Pillow não lê, pool de processos quebrado, disco cheio...
+            logger.exception("Falha ao gerar o derivado %s_%s; servindo a original", image_hash, width)
+            return None
+    f = cache.open(image_hash, width)
+    if f is not None:
+        return f
+    logger.warning("Derivado %s_%s removido logo após a geração; servindo a original", image_hash, width)
+    return None
+
+
+async def _prepare_variant(image_hash: str, width: int):
+    f = await open_variant(image_hash, width)
+    if f is not None:
+        f.close()
+
+
+def generate_eager_variants(image_hash: str):
+    # Dispara a geração dos tamanhos configurados sem bloquear a resposta do upload
+    for size in THUMBNAIL_EAGER_SIZES:
+        if size not in THUMBNAIL_SIZES:
+            continue
+        task = asyncio.ensure_future(_prepare_variant(image_hash, THUMBNAIL_SIZES[size]))
+        _background_tasks.add(task)
+        task.add_done_callback(_log_eager_failure)
+
+
+def _log_eager_failure(task: asyncio.Future):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.warning("Falha ao gerar derivado da imagem: %s", task.exception())
@@ -0,0 +1,58 @@
+import time
+from typing import Dict, List, Tuple
+
+
+class TokenDenylist:
+    """
+    Lista em memória de tokens revogados, indexada pelo jti.
+    Cada entrada vale só até a expiração do próprio token; depois disso o JWT
+    já é recusado pela assinatura/exp e a entrada pode ser descartada.
+
+    Com persistent=True (padrão) as revogações ficam na fila até o job
+    sync_token_denylist gravá-las na tabela tokens, de onde os outros workers
+    as recarregam. Com persistent=False nada é enfileirado e a lista vale só
+    para este processo (uvicorn com um único worker).
+    """
+
+    def __init__(self, persistent: bool = True):
+        self.persistent = persistent
+        self._entries: Dict[str, float] = {}
+        # Revogações ainda não gravadas no banco (ver jobs.sync_token_denylist)
+        self._pending: List[Tuple[str, float]] = []
+
+    def revoke(self, jti: str, expires_at: float, persist: bool = True) -> None:
+        if expires_at <= time.time():
+            return
+        self._entries[jti] = expires_at
+        if persist and self.persistent:
+            self._pending.append((jti, expires_at))
+
+    def is_revoked(self, jti: str) -> bool:
+        expires_at = self._entries.get(jti)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            del self._entries[jti]
+            return False
+        return True
+
+    def evict_expired(self) -> int:
+        now = time.time()
+        expired = [jti for jti, expires_at in self._entries.items() if expires_at <= now]
+        for jti in expired:
+            del self._entries[jti]
+        return len(expired)
+
+    def take_pending(self) -> List[Tuple[str, float]]:
+        pending, self._pending = self._pending, []
+        return pending
+
+    def restore_pending(self, pending: List[Tuple[str, float]]) -> None:
+        # Gravação falhou: devolve à fila para a próxima tentativa
+        self._pending[:0] = pending
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+denylist = TokenDenylist()
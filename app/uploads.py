@@ -0,0 +1,179 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+from app.storage import BlobWriter, StoredBlob, get_storage
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # pragma: no cover
+    import multipart
+    from multipart.multipart import parse_options_header
+
+JPEG_MAGIC = b"\xff\xd8\xff"
+# Folga para cabeçalhos e campos de texto além do arquivo no corpo multipart
+FORM_OVERHEAD = 64 * 1024
+MAX_FIELD_SIZE = 16 * 1024
+
+
+class StreamingUpload:
+    """
+    Lê um corpo multipart direto do request, sem o spool do UploadFile:
+    campos de texto ficam em memória (limitados a MAX_FIELD_SIZE) e o arquivo
+    vai em pedaços para o blob storage enquanto o hash é calculado.
+
+    validate(fields) roda assim que o arquivo começa, se os campos já chegaram
+    (o caso comum, campos antes do arquivo); senão roda ao fim do corpo, antes
+    do commit do blob. Se levantar HTTPException, o upload é interrompido e nada
+    fica no storage.
+    """
+
+    def __init__(self, request: Request, file_field: str, max_file_size: int,
+                 allowed_content_types: List[str], magic: Optional[bytes] = None,
+                 required_fields: Tuple[str, ...] = (), content_type_error: str = "Tipo de arquivo não permitido."):
+        self.request = request
+        self.content_type_error = content_type_error
+        self.required_fields = required_fields
+        self.file_field = file_field
+        self.max_file_size = max_file_size
+        self.allowed_content_types = allowed_content_types
+        self.magic = magic
+        self.fields: Dict[str, str] = {}
+        self.file_content_type: Optional[str] = None
+        self._events: List[Tuple[str, object]] = []
+        self._part_name = ""
+        self._part_is_file = False
+        self._part_data = bytearray()
+        self._part_headers: Dict[bytes, bytes] = {}
+        self._header_name = b""
+        self._header_value = b""
+        self._writer: Optional[BlobWriter] = None
+        self._file_size = 0
+        self._head = b""
+        self._file_done = False
+
+    # --- callbacks do parser (síncronos; só registram eventos) ---
+
+    def _on_part_begin(self):
+        self._part_name, self._part_is_file = "", False
+        self._part_data = bytearray()
+        self._part_headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._part_headers[self._header_name.lower()] = self._header_value
+        self._header_name, self._header_value = b"", b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._part_headers.get(b"content-disposition", b""))
+        self._part_name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        self._part_is_file = b"filename" in options
+        if self._part_is_file:
+            content_type = self._part_headers.get(b"content-type", b"").decode("latin-1")
+            self._events.append(("file_start", (self._part_name, content_type)))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._part_is_file:
+            self._events.append(("file_data", data[start:end]))
+        else:
+            self._part_data.extend(data[start:end])
+            if len(self._part_data) > MAX_FIELD_SIZE:
+                raise HTTPException(status_code=400, detail=f"Campo '{self._part_name}' muito grande.")
+
+    def _on_part_end(self):
+        if self._part_is_file:
+            self._events.append(("file_end", None))
+        else:
+            self.fields[self._part_name] = self._part_data.decode("utf-8", errors="replace")
+
+    # --- processamento assíncrono dos eventos ---
+
+    def _reject_size(self):
+        raise HTTPException(status_code=413, detail=f"O arquivo deve ter no máximo {self.max_file_size // (1024 * 1024)}MB")
+
+    async def _handle_events(self, validate: Callable[[Dict[str, str]], Awaitable[None]], validated: bool) -> bool:
+        for event, payload in self._events:
+            if event == "file_start":
+                field_name, content_type = payload
+                if field_name != self.file_field or self._writer is not None:
+                    raise HTTPException(status_code=400, detail="Envie um único arquivo no campo esperado.")
+                self.file_content_type = content_type
+                if content_type not in self.allowed_content_types:
+                    raise HTTPException(status_code=400, detail=self.content_type_error)
+                if not validated and self._has_required_fields():
+                    # Quota, categoria e permissões antes de ler o conteúdo do arquivo
+                    await validate(self.fields)
+                    validated = True
+                self._writer = get_storage().writer()
+            elif event == "file_data":
+                self._file_size += len(payload)
+                if self._file_size > self.max_file_size:
+                    self._reject_size()
+                if self.magic and len(self._head) < len(self.magic):
+                    self._head += payload[:len(self.magic)]
+                    if len(self._head) >= len(self.magic) and not self._head.startswith(self.magic):
+                        raise HTTPException(status_code=400, detail="O conteúdo do arquivo não corresponde ao tipo informado.")
+                await run_in_threadpool(self._writer.write, payload)
+            elif event == "file_end":
+                self._file_done = True
+        self._events.clear()
+        return validated
+
+    def _has_required_fields(self) -> bool:
+        return all(name in self.fields for name in self.required_fields)
+
+    async def parse(self, validate: Callable[[Dict[str, str]], Awaitable[None]],
+                    before_commit: Optional[Callable[[str], Awaitable[None]]] = None) -> StoredBlob:
+        content_length = self.request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_file_size + FORM_OVERHEAD:
+            self._reject_size()
+
+        _, params = parse_options_header(self.request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise HTTPException(status_code=400, detail="Requisição multipart inválida.")
+
+        parser = multipart.MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+        validated = False
+        try:
+            received = 0
+            async for chunk in self.request.stream():
+                received += len(chunk)
+                if received > self.max_file_size + FORM_OVERHEAD:
+                    self._reject_size()
+                parser.write(chunk)
+                validated = await self._handle_events(validate, validated)
+            parser.finalize()
+            validated = await self._handle_events(validate, validated)
+
+            if self._writer is None or not self._file_done or self._file_size == 0:
+                raise HTTPException(status_code=400, detail="Arquivo não enviado.")
+            if self.magic and not self._head.startswith(self.magic):
+                raise HTTPException(status_code=400, detail="O conteúdo do arquivo não corresponde ao tipo informado.")
+            missing = [name for name in self.required_fields if not self.fields.get(name)]
+            if missing:
+                raise HTTPException(status_code=400, detail=f"Campos obrigatórios ausentes: {', '.join(missing)}")
+            if not validated:
+                await validate(self.fields)
+            if before_commit is not None:
+                await before_commit(self._writer.sha256)
+            return await run_in_threadpool(self._writer.commit)
+        except BaseException:
+            if self._writer is not None:
+                await run_in_threadpool(self._writer.abort)
+            raise
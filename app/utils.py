@@ -1,17 +1,34 @@
+import asyncio
 import io
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from passlib.context import CryptContext
 import jwt
+import uuid
 from datetime import datetime, timedelta
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
+from app.token_denylist import denylist
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 
 # Configurando o contexto do hash
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Custo do bcrypt; senhas com custo diferente são refeitas no próximo login (verify_and_update_password)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Pool dedicado ao bcrypt, para que uma onda de logins não ocupe o threadpool das demais rotas
+HASH_POOL_KIND = os.getenv("HASH_POOL_KIND", "thread")
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", "2"))
+# Quantas operações podem aguardar na fila além das que estão executando antes de responder 503
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+# Cadastros em lote usam um pool próprio, para que um lote grande não ocupe os workers do login
+BULK_HASH_POOL_SIZE = int(os.getenv("BULK_HASH_POOL_SIZE", "1"))
+# Lotes simultâneos (executando ou na fila) antes de responder 503
+BULK_HASH_MAX_BATCHES = int(os.getenv("BULK_HASH_MAX_BATCHES", "2"))
 SECRET_KEY = "CHAVESECRETEAGERADORDECHAVES"
 ALGORITHM = "HS256"
 
@@ -26,20 +43,105 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def _verify_and_update(plain_password: str, hashed_password: str):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _make_hash_executor(size: int, name: str):
+    if HASH_POOL_KIND == "process":
+        return ProcessPoolExecutor(max_workers=size)
+    return ThreadPoolExecutor(max_workers=size, thread_name_prefix=name)
+
+
+_hash_executor = _make_hash_executor(HASH_POOL_SIZE, "bcrypt")
+_hash_pending = 0
+_bulk_hash_executor = None
+_bulk_batches = 0
+
+
+def _overloaded(retry_after: int = 1) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Servidor sobrecarregado, tente novamente em instantes.",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+async def _run_in_hash_pool(func, *args):
+    global _hash_pending
+    if _hash_pending >= HASH_POOL_SIZE + HASH_QUEUE_LIMIT:
+        raise _overloaded()
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_pending -= 1
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_hash_pool(hash_password, password)
+
+
+def _hash_many(passwords: list) -> list:
+    return [hash_password(password) for password in passwords]
+
+
+async def hash_passwords_async(passwords: list) -> list:
+    """
+    Gera vários hashes (cadastros em lote) no pool de lote, um bloco por worker.
+    O pool do login fica livre; com BULK_HASH_MAX_BATCHES lotes em andamento
+    o próximo recebe 503.
+    """
+    global _bulk_hash_executor, _bulk_batches
+    if not passwords:
+        return []
+    if _bulk_batches >= BULK_HASH_MAX_BATCHES:
+        raise _overloaded(retry_after=30)
+    if _bulk_hash_executor is None:
+        _bulk_hash_executor = _make_hash_executor(BULK_HASH_POOL_SIZE, "bcrypt-bulk")
+    size = -(-len(passwords) // BULK_HASH_POOL_SIZE)
+    chunks = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+    loop = asyncio.get_running_loop()
+    _bulk_batches += 1
+    try:
+        results = await asyncio.gather(*(loop.run_in_executor(_bulk_hash_executor, _hash_many, chunk)
+                                         for chunk in chunks))
+    finally:
+        _bulk_batches -= 1
+    return [hashed for chunk in results for hashed in chunk]
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """
+    Retorna (senha_valida, novo_hash). novo_hash só vem preenchido quando o hash
+    armazenado usa um custo diferente de BCRYPT_ROUNDS e precisa ser regravado.
+    """
+    return await _run_in_hash_pool(_verify_and_update, plain_password, hashed_password)
+
+
+def hash_pool_status() -> dict:
+    return {
+        "kind": HASH_POOL_KIND,
+        "workers": HASH_POOL_SIZE,
+        "queue_limit": HASH_QUEUE_LIMIT,
+        "pending": _hash_pending,
+        "bulk_workers": BULK_HASH_POOL_SIZE,
+        "bulk_max_batches": BULK_HASH_MAX_BATCHES,
+        "bulk_batches": _bulk_batches,
+    }
+
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=5)):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
     current_time = datetime.utcnow()
-    to_encode.update({"exp": expire, "iat": current_time})
+    # jti identifica o token para revogação sem precisar guardá-lo no banco
+    to_encode.update({"exp": expire, "iat": current_time, "jti": uuid.uuid4().hex})
 
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
-    """
-      Esta função é o seu "portão". Ela bloqueia a execução se o token for inválido.
-      """
+def decode_access_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -53,13 +155,29 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Could not validate credentials")
 
-    return username
+    jti = payload.get("jti")
+    if jti and denylist.is_revoked(jti):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+
+    return payload
 
-def criar_pdf_medias(data: list):
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
     """
-    Cria um arquivo PDF em memória com os dados das médias e endereços dos usuários.
+      Esta função é o seu "portão". Ela bloqueia a execução se o token for inválido.
+      A validação é feita só em memória (assinatura, exp e lista de revogação).
+      """
+    return decode_access_token(token)["sub"]
+
+# Linhas por tabela no PDF; tabelas menores são quebradas entre páginas sem recalcular o relatório inteiro
+PDF_ROWS_PER_TABLE = int(os.getenv("PDF_ROWS_PER_TABLE", "200"))
+
+def criar_pdf_medias(data: list, output=None):
+    """
+    Cria o PDF com os dados das médias e endereços dos usuários.
+    output pode ser um caminho de arquivo; sem ele o PDF é gerado em memória e o buffer é retornado.
     """
-    buffer = io.BytesIO()
+    buffer = output if output is not None else io.BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=18)
 
     elements = []
@@ -71,27 +189,7 @@ def criar_pdf_medias(data: list):
     elements.append(Spacer(1, 24))
 
     # --- CABEÇALHO DA TABELA ATUALIZADO ---
-    table_data = [
-        ['Nome', 'Categoria', 'Média Cat. A', 'Média Cat. B', 'Endereço Completo']
-    ]
-
-    # --- PREENCHIMENTO DAS LINHAS ATUALIZADO ---
-    for item in data:
-        nome = item.get('name', 'N/A')
-        user_cat = item.get('user_category', 'N/A')
-        media_a = str(item.get('categoria_a_media', '-'))
-        media_b = str(item.get('categoria_b_media', '-'))
-        # Pega o endereço do campo "complete_address"
-        endereco = item.get('complete_address', 'Não informado')
-
-        # Usar Paragraph permite que o texto quebre a linha automaticamente
-        endereco_paragraph = Paragraph(endereco, styles['Normal'])
-
-        table_data.append([nome, user_cat, media_a, media_b, endereco_paragraph])
-
-    # --- LARGURA DAS COLUNAS AJUSTADA ---
-    # A soma deve ser menor que a largura da página (aprox. 550 para letter)
-    t = Table(table_data, colWidths=[120, 60, 70, 70, 230])
+    header = ['Nome', 'Categoria', 'Média Cat. A', 'Média Cat. B', 'Endereço Completo']
 
     style = TableStyle([
         ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
@@ -105,10 +203,32 @@ def criar_pdf_medias(data: list):
         # Alinha o texto do endereço à esquerda para melhor leitura
         ('ALIGN', (4, 1), (4, -1), 'LEFT'),
     ])
-    t.setStyle(style)
 
-    elements.append(t)
+    # --- PREENCHIMENTO DAS LINHAS EM BLOCOS ---
+    for start in range(0, len(data), PDF_ROWS_PER_TABLE):
+        table_data = [header]
+        for item in data[start:start + PDF_ROWS_PER_TABLE]:
+            nome = item.get('name', 'N/A')
+            user_cat = item.get('user_category', 'N/A')
+            media_a = str(item.get('categoria_a_media', '-'))
+            media_b = str(item.get('categoria_b_media', '-'))
+            # Pega o endereço do campo "complete_address"
+            endereco = item.get('complete_address', 'Não informado')
+
+            # Usar Paragraph permite que o texto quebre a linha automaticamente
+            endereco_paragraph = Paragraph(endereco, styles['Normal'])
+
+            table_data.append([nome, user_cat, media_a, media_b, endereco_paragraph])
+
+        # --- LARGURA DAS COLUNAS AJUSTADA ---
+        # A soma deve ser menor que a largura da página (aprox. 550 para letter)
+        # repeatRows repete o cabeçalho quando o bloco continua na página seguinte
+        t = Table(table_data, colWidths=[120, 60, 70, 70, 230], repeatRows=1)
+        t.setStyle(style)
+        elements.append(t)
+
     doc.build(elements)
 
-    buffer.seek(0)
+    if output is None:
+        buffer.seek(0)
     return buffer
@@ -0,0 +1,67 @@
+"""
+ZIP gerado em streaming: as entradas são gravadas num buffer sem seek e os bytes
+são retirados com drain() à medida que ficam prontos, então o arquivo nunca
+existe inteiro em memória nem em disco.
+
+O zipfile detecta que a saída não tem seek e grava os tamanhos e o CRC de cada
+entrada num data descriptor depois dos dados.
+"""
+import time
+import zipfile
+from typing import Optional, Tuple
+
+
+class _Sink:
+    # Saída sem tell/seek para o zipfile: acumula os bytes até o próximo drain()
+    def __init__(self):
+        self._chunks = []
+        self.pending = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.pending += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+class ZipStream:
+    def __init__(self, compression: int = zipfile.ZIP_DEFLATED):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, mode="w", compression=compression, allowZip64=True)
+
+    @property
+    def pending(self) -> int:
+        # Bytes prontos esperando o próximo drain()
+        return self._sink.pending
+
+    def open(self, name: str, date_time: Optional[Tuple[int, ...]] = None, size: Optional[int] = None,
+             force_zip64: bool = False):
+        """
+        Abre uma entrada para escrita. Sem o tamanho final (size), o zipfile limita a entrada
+        a 4 GB; force_zip64=True grava o cabeçalho ZIP64 e tira esse limite. Offsets acima
+        de 4 GB no diretório central são tratados pelo zipfile em qualquer caso.
+        """
+        info = zipfile.ZipInfo(name, date_time=date_time or time.localtime(time.time())[:6])
+        if size is not None:
+            # Com o tamanho conhecido o zipfile decide sozinho se a entrada precisa de ZIP64
+            info.file_size = size
+        info.compress_type = self._zip.compression
+        # Permissão 0644 para quem extrair no Linux/macOS
+        info.external_attr = 0o644 << 16
+        return self._zip.open(info, mode="w", force_zip64=force_zip64)
+
+    def drain(self) -> bytes:
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        # Grava o diretório central e devolve os últimos bytes
+        self._zip.close()
+        return self._sink.drain()
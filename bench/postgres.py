@@ -0,0 +1,85 @@
+"""
+Postgres descartável para o benchmark: initdb em um diretório temporário,
+pg_ctl start em uma porta livre (só localhost, sem fsync) e remoção no stop().
+
+Os binários são procurados em PG_BIN (ex.: /usr/lib/postgresql/16/bin) ou no PATH.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+from typing import Optional
+
+PG_USER = "bench"
+PG_DATABASE = "evaluation_bench"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def find_binary(name: str) -> str:
+    pg_bin = os.getenv("PG_BIN")
+    path = os.path.join(pg_bin, name) if pg_bin else shutil.which(name)
+    if not path or not os.path.exists(path):
+        raise RuntimeError(f"'{name}' não encontrado. Instale o Postgres ou defina PG_BIN com o diretório dos binários.")
+    return path
+
+
+class LocalPostgres:
+    def __init__(self, base_dir: Optional[str] = None):
+        self.base_dir = base_dir or tempfile.mkdtemp(prefix="bench-pg-")
+        self.data_dir = os.path.join(self.base_dir, "data")
+        self.socket_dir = os.path.join(self.base_dir, "sock")
+        self.port = free_port()
+        self.host = "127.0.0.1"
+        self._started = False
+
+    def start(self) -> "LocalPostgres":
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            raise RuntimeError("O Postgres não roda como root: execute como outro usuário ou use --database-url.")
+        os.makedirs(self.socket_dir, exist_ok=True)
+        subprocess.run(
+            [find_binary("initdb"), "-D", self.data_dir, "-U", PG_USER, "--auth=trust", "-E", "UTF8", "--no-sync"],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        # fsync/full_page_writes desligados: o banco é descartável e o disco não deve dominar a medição
+        options = (f"-p {self.port} -k {self.socket_dir} -c listen_addresses={self.host} "
+                   "-c fsync=off -c synchronous_commit=off -c full_page_writes=off -c max_connections=200")
+        subprocess.run(
+            [find_binary("pg_ctl"), "-D", self.data_dir, "-o", options,
+             "-l", os.path.join(self.base_dir, "postgres.log"), "-w", "start"],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        self._started = True
+        subprocess.run(
+            [find_binary("createdb"), "-h", self.host, "-p", str(self.port), "-U", PG_USER, PG_DATABASE],
+            check=True,
+        )
+        return self
+
+    def env(self) -> dict:
+        # Mesmas variáveis lidas por app/database.py
+        return {
+            "USUARIO_BANCO": PG_USER,
+            "SENHA_BANCO": "",
+            "HOST_BANCO": self.host,
+            "PORTA_BANCO": str(self.port),
+            "NOME_BANCO": PG_DATABASE,
+        }
+
+    def stop(self):
+        if self._started:
+            subprocess.run([find_binary("pg_ctl"), "-D", self.data_dir, "-m", "fast", "-w", "stop"],
+                           check=False, stdout=subprocess.DEVNULL)
+            self._started = False
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
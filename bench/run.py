@@ -0,0 +1,388 @@
+"""
+Benchmark dos endpoints reais contra um Postgres descartável.
+
+    pip install -r bench/requirements.txt
+    python -m bench.run                         # compara com bench/baseline.json, se existir
+    python -m bench.run --save-baseline         # grava o resultado atual como baseline
+
+Sobe um Postgres temporário (bench/postgres.py) ou usa --database-url (o banco é
+APAGADO pelo seed), popula os dados (bench/seed.py), inicia o uvicorn com app.main
+e dispara os cenários com clientes concorrentes. Para cada cenário mede p50/p95/p99,
+vazão e consultas SQL por requisição (lidas do /metrics antes e depois).
+
+Com baseline, o comando termina com código 1 se algum cenário tiver erros, p95 acima
+de baseline * (1 + --tolerance), vazão abaixo de baseline * (1 - --tolerance) ou mais
+consultas por requisição que o baseline (+ --query-tolerance). O baseline só vale
+para os mesmos parâmetros de carga e deve ser gerado na mesma máquina.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from PIL import Image as PILImage
+
+from bench.postgres import LocalPostgres, free_port
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# Parâmetros que definem a carga; um baseline só é comparável com os mesmos valores
+LOAD_PARAMS = ("users", "evaluators", "upload_users", "requests", "concurrency", "workers", "seed", "scenarios")
+
+
+class Scenario:
+    def __init__(self, name: str, method: str, route: str, build: Callable[[int], Tuple[str, dict]],
+                 expected: Tuple[int, ...] = (200,), max_requests: Optional[int] = None, warmup: bool = True):
+        self.name = name
+        self.method = method
+        # Template da rota como aparece no label do /metrics
+        self.route = route
+        self.build = build
+        self.expected = expected
+        self.max_requests = max_requests
+        self.warmup = warmup
+
+
+def build_scenarios(manifest: dict, tokens: List[str], rng: random.Random) -> Dict[str, Scenario]:
+    participants = manifest["participants"]
+    evaluators = manifest["evaluators"]
+    images = manifest["images"]
+    categories = manifest["categories"]
+    password = manifest["password"]
+
+    def auth(i: int) -> dict:
+        return {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+
+    def login(i: int):
+        user = participants[i % len(participants)]
+        return "/api/users/login", {"json": {"email": user["email"], "password": password}}
+
+    def image_fetch(i: int):
+        return f"/api/images/{images[i % len(images)]}/", {}
+
+    # Cada participante sem imagens pode enviar MAX_UPLOADS[categoria] arquivos
+    upload_slots = [
+        (user["id"], category)
+        for user in manifest["upload_users"]
+        for category, count in manifest["max_uploads"].items()
+        for _ in range(count)
+    ]
+    upload_body = make_upload_jpeg(rng)
+
+    def upload(i: int):
+        user_id, category = upload_slots[i]
+        fields = {"user_id": user_id, "subcategory": category, "description": "Upload do benchmark",
+                  "title": f"Bench {i}", "place": "Benchmark", "equipment": "Câmera de teste"}
+        return "/api/images/upload/", {"data": fields, "files": {"image": ("bench.jpg", upload_body, "image/jpeg")},
+                                       "headers": auth(i)}
+
+    def rate(i: int):
+        evaluator = evaluators[i % len(evaluators)]
+        participant = participants[(i // len(evaluators)) % len(participants)]
+        body = {
+            "evaluated_user_id": participant["id"],
+            "evaluator_id": evaluator["id"],
+            "category": categories[i % len(categories)],
+            "ratings": [{"criteria": criteria, "score": rng.randint(0, 20)} for criteria in manifest["criteria"]],
+        }
+        return "/api/users/rate/", {"json": body, "headers": auth(i)}
+
+    def report(i: int):
+        return "/api/avaliacoes/media-por-usuario", {}
+
+    return {
+        "login": Scenario("login", "POST", "/api/users/login", login),
+        "image_fetch": Scenario("image_fetch", "GET", "/api/images/{image_id}/", image_fetch),
+        "upload": Scenario("upload", "POST", "/api/images/upload/", upload,
+                           max_requests=len(upload_slots), warmup=False),
+        "rate": Scenario("rate", "POST", "/api/users/rate/", rate),
+        "report": Scenario("report", "GET", "/api/avaliacoes/media-por-usuario", report, expected=(202,)),
+    }
+
+
+def make_upload_jpeg(rng: random.Random) -> bytes:
+    channels = [PILImage.effect_noise((1200, 900), rng.randint(20, 80)) for _ in range(3)]
+    buffer = io.BytesIO()
+    PILImage.merge("RGB", channels).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+_METRIC_LINE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_metrics(text: str) -> Dict[tuple, float]:
+    values = {}
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        values[(name, frozenset(_LABEL.findall(labels or "")))] = float(value)
+    return values
+
+
+def route_queries(metrics: Dict[tuple, float], method: str, route: str) -> Tuple[float, float]:
+    labels = frozenset({("method", method), ("route", route)})
+    return (metrics.get(("http_request_db_queries_sum", labels), 0.0),
+            metrics.get(("http_request_db_queries_count", labels), 0.0))
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    # Nearest-rank
+    if not sorted_values:
+        return 0.0
+    index = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+async def scrape_metrics(client: httpx.AsyncClient) -> Dict[tuple, float]:
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    return parse_metrics(response.text)
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, total: int, concurrency: int,
+                       warmup: int) -> dict:
+    if scenario.warmup:
+        for i in range(warmup):
+            path, kwargs = scenario.build(i)
+            await client.request(scenario.method, path, **kwargs)
+
+    before = await scrape_metrics(client)
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < total:
+            i = next_index
+            next_index += 1
+            path, kwargs = scenario.build(i)
+            start = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, path, **kwargs)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    after = await scrape_metrics(client)
+
+    queries_before, count_before = route_queries(before, scenario.method, scenario.route)
+    queries_after, count_after = route_queries(after, scenario.method, scenario.route)
+    measured = count_after - count_before
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if status not in scenario.expected)
+    return {
+        "requests": total,
+        "errors": errors,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "throughput_rps": round(total / wall, 2) if wall else 0.0,
+        "queries_per_request": round((queries_after - queries_before) / measured, 2) if measured else None,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, query_tolerance: float) -> List[str]:
+    failures = []
+    for name, current in results.items():
+        if current["errors"]:
+            failures.append(f"{name}: {current['errors']} respostas inesperadas {current['statuses']}")
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            failures.append(f"{name}: p95 {current['p95_ms']}ms > baseline {base['p95_ms']}ms (+{tolerance:.0%})")
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            failures.append(f"{name}: vazão {current['throughput_rps']}/s < baseline {base['throughput_rps']}/s "
+                            f"(-{tolerance:.0%})")
+        if current["queries_per_request"] is not None and base.get("queries_per_request") is not None:
+            if current["queries_per_request"] > base["queries_per_request"] + query_tolerance:
+                failures.append(f"{name}: {current['queries_per_request']} consultas/requisição > baseline "
+                                f"{base['queries_per_request']}")
+    return failures
+
+
+def print_table(results: dict):
+    header = f"{'cenário':14} {'req':>6} {'erros':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'SQL/req':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        queries = "-" if r["queries_per_request"] is None else f"{r['queries_per_request']:.2f}"
+        print(f"{name:14} {r['requests']:>6} {r['errors']:>6} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+              f"{r['p99_ms']:>9.2f} {r['throughput_rps']:>9.2f} {queries:>8}")
+
+
+def database_env(url: str) -> dict:
+    parsed = urlparse(url)
+    return {
+        "USUARIO_BANCO": parsed.username or "",
+        "SENHA_BANCO": parsed.password or "",
+        "HOST_BANCO": parsed.hostname or "localhost",
+        "PORTA_BANCO": str(parsed.port or 5432),
+        "NOME_BANCO": parsed.path.lstrip("/"),
+    }
+
+
+def start_server(env: dict, port: int, workers: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT_DIR, env=env,
+    )
+
+
+async def wait_for_server(base_url: str, server: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError("O uvicorn terminou antes de ficar pronto.")
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("O uvicorn não respondeu a tempo.")
+
+
+async def run_load(base_url: str, manifest: dict, args) -> dict:
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        # Tokens dos avaliadores para os cenários autenticados (fora da medição)
+        tokens = []
+        for evaluator in manifest["evaluators"]:
+            response = await client.post("/api/users/login", json={"email": evaluator["email"],
+                                                                   "password": manifest["password"]})
+            response.raise_for_status()
+            tokens.append(response.json()["token"])
+
+        scenarios = build_scenarios(manifest, tokens, rng)
+        results = {}
+        for name in args.scenarios:
+            scenario = scenarios[name]
+            total = args.requests
+            if scenario.max_requests is not None and total > scenario.max_requests:
+                print(f"{name}: limitado a {scenario.max_requests} requisições (aumente --upload-users)")
+                total = scenario.max_requests
+            results[name] = await run_scenario(client, scenario, total, args.concurrency, args.warmup)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos endpoints da API.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--evaluators", type=int, default=10)
+    parser.add_argument("--upload-users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200, help="requisições por cenário")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="workers do uvicorn (com mais de um, o /metrics é de um só processo)")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scenarios", default="login,image_fetch,upload,rate,report")
+    parser.add_argument("--database-url", help="postgresql://... de um banco descartável (será apagado)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="variação aceita em p95 e vazão")
+    parser.add_argument("--query-tolerance", type=float, default=0.0, help="consultas/requisição a mais aceitas")
+    parser.add_argument("--output", help="grava o resultado em JSON")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    postgres = None
+    server = None
+    try:
+        env = dict(os.environ)
+        if args.database_url:
+            env.update(database_env(args.database_url))
+        else:
+            postgres = LocalPostgres(os.path.join(workdir, "pg")).start()
+            env.update(postgres.env())
+        env.update({
+            "BLOB_STORAGE_PATH": os.path.join(workdir, "blobs"),
+            "THUMBNAIL_CACHE_PATH": os.path.join(workdir, "thumbs"),
+            "REPORTS_DIR": os.path.join(workdir, "reports"),
+            "OUTBOX_ENABLED": "false",
+            "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+            "DB_POOL_SIZE": env.get("DB_POOL_SIZE", str(max(args.concurrency, 5))),
+        })
+
+        manifest_path = os.path.join(workdir, "manifest.json")
+        subprocess.run(
+            [sys.executable, "-m", "bench.seed", "--users", str(args.users), "--evaluators", str(args.evaluators),
+             "--upload-users", str(args.upload_users), "--seed", str(args.seed), "--manifest", manifest_path],
+            cwd=ROOT_DIR, env=env, check=True,
+        )
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = start_server(env, port, args.workers)
+        asyncio.run(wait_for_server(base_url, server))
+        results = asyncio.run(run_load(base_url, manifest, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if postgres is not None:
+            postgres.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results)
+    params = {name: getattr(args, name) for name in LOAD_PARAMS}
+    report = {"params": params, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline gravado em {args.baseline}")
+        return
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["params"] != params:
+            print(f"Baseline gerado com outros parâmetros: {baseline['params']}", file=sys.stderr)
+            sys.exit(2)
+    else:
+        print("Sem baseline para comparar (use --save-baseline).")
+
+    failures = compare(results, baseline["results"] if baseline else {}, args.tolerance, args.query_tolerance)
+    for failure in failures:
+        print(f"REGRESSÃO {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
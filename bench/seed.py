@@ -0,0 +1,155 @@
+"""
+Popula um banco descartável com um conjunto de dados reprodutível para o benchmark.
+
+    python -m bench.seed --users 200 --evaluators 10 --upload-users 50 --manifest /tmp/manifest.json
+
+ATENÇÃO: apaga e recria todas as tabelas do banco configurado (USUARIO_BANCO, NOME_BANCO...).
+Cria N participantes com imagens conforme MAX_UPLOADS, M avaliadores que já deram
+todas as notas, e participantes sem imagens para o cenário de upload. O manifest
+guarda os IDs e e-mails usados pelo bench.run.
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import uuid
+
+from PIL import Image as PILImage
+from sqlalchemy import insert
+
+from app import crud, models
+from app.database import Base, SessionLocal, engine
+from app.storage import get_storage
+from app.utils import MAX_UPLOADS, hash_password
+
+BENCH_PASSWORD = "bench-password"
+CRITERIA = [f"criterio_{i}" for i in range(1, crud.CRITERIA_PER_RATING + 1)]
+INSERT_CHUNK = 1000
+
+
+def make_uuid(rng: random.Random) -> uuid.UUID:
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def make_jpeg(rng: random.Random, width: int = 1600, height: int = 1200) -> bytes:
+    # Ruído comprime mal, então o arquivo tem um tamanho parecido com o de uma foto real
+    channels = [PILImage.effect_noise((width, height), rng.randint(20, 80)) for _ in range(3)]
+    buffer = io.BytesIO()
+    PILImage.merge("RGB", channels).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def user_row(rng: random.Random, password_hash: str, kind: str, index: int, user_type: str, category: str) -> dict:
+    return {
+        "id": make_uuid(rng),
+        "name": f"{kind.capitalize()} {index:05d}",
+        "document": f"{kind[:1].upper()}{index:010d}",
+        "email": f"{kind}{index}@bench.local",
+        "user_type": user_type,
+        "password": password_hash,
+        "category": category,
+        "institution": f"Instituição {index % 20:02d}",
+        "complete_address": "Rua do Benchmark, 1",
+        "cep": "00000000",
+    }
+
+
+async def insert_chunked(db, model, rows: list):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        await db.execute(insert(model), rows[start:start + INSERT_CHUNK])
+
+
+async def seed(users: int, evaluators: int, upload_users: int, distinct_images: int, seed_value: int) -> dict:
+    rng = random.Random(seed_value)
+    # Um único hash: o bcrypt de milhares de usuários tornaria a carga mais lenta que o benchmark
+    password_hash = hash_password(BENCH_PASSWORD)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    storage = get_storage()
+    blobs = [storage.save(make_jpeg(rng)) for _ in range(distinct_images)]
+
+    participants = [user_row(rng, password_hash, "participante", i, "P", str(rng.randint(1, 5)))
+                    for i in range(users)]
+    judges = [user_row(rng, password_hash, "avaliador", i, "A", "4") for i in range(evaluators)]
+    uploaders = [user_row(rng, password_hash, "upload", i, "P", str(rng.randint(1, 5)))
+                 for i in range(upload_users)]
+
+    images = []
+    for participant in participants:
+        for subcategory, count in MAX_UPLOADS.items():
+            for n in range(count):
+                blob = blobs[len(images) % len(blobs)]
+                images.append({
+                    "id": make_uuid(rng),
+                    "user_id": participant["id"],
+                    "image_hash": blob.sha256,
+                    "image_size": blob.size,
+                    "content_type": "image/jpeg",
+                    "subcategory": subcategory,
+                    "description": f"Imagem {n + 1} da categoria {subcategory}",
+                    "title": f"Foto {subcategory}{n + 1}",
+                    "place": "Florianópolis",
+                    "equipment": "Câmera de teste",
+                })
+
+    ratings = [
+        {
+            "id": str(make_uuid(rng)),
+            "evaluator_id": judge["id"],
+            "evaluated_user_id": participant["id"],
+            "category": subcategory,
+            "criteria": criteria,
+            "rating": rng.randint(0, 20),
+        }
+        for judge in judges
+        for participant in participants
+        for subcategory in MAX_UPLOADS
+        for criteria in CRITERIA
+    ]
+
+    async with SessionLocal() as db:
+        await insert_chunked(db, models.User, participants + judges + uploaders)
+        await insert_chunked(db, models.Image, images)
+        await insert_chunked(db, models.ImageRating, ratings)
+        await db.commit()
+        await crud.rebuild_rating_aggregates(db)
+    async with engine.connect() as conn:
+        await conn.exec_driver_sql("ANALYZE")
+    await engine.dispose()
+
+    return {
+        "password": BENCH_PASSWORD,
+        "criteria": CRITERIA,
+        "categories": list(MAX_UPLOADS),
+        "max_uploads": MAX_UPLOADS,
+        "participants": [{"id": str(u["id"]), "email": u["email"]} for u in participants],
+        "evaluators": [{"id": str(u["id"]), "email": u["email"]} for u in judges],
+        "upload_users": [{"id": str(u["id"]), "email": u["email"]} for u in uploaders],
+        "images": [str(image["id"]) for image in images],
+        "counts": {"users": len(participants), "evaluators": len(judges), "upload_users": len(uploaders),
+                   "images": len(images), "ratings": len(ratings)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Popula o banco do benchmark.")
+    parser.add_argument("--users", type=int, default=200, help="participantes com imagens")
+    parser.add_argument("--evaluators", type=int, default=10)
+    parser.add_argument("--upload-users", type=int, default=50, help="participantes sem imagens (cenário de upload)")
+    parser.add_argument("--distinct-images", type=int, default=8, help="arquivos JPEG distintos no storage")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--manifest", required=True)
+    args = parser.parse_args()
+
+    manifest = asyncio.run(seed(args.users, args.evaluators, args.upload_users, args.distinct_images, args.seed))
+    with open(args.manifest, "w") as f:
+        json.dump(manifest, f)
+    print(f"Dados do benchmark criados: {manifest['counts']}")
+
+
+if __name__ == "__main__":
+    main()
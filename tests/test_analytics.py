@@ -0,0 +1,106 @@
+"""
+compute_statistics de app/analytics.py: casos de borda (uma nota, células sem
+nenhuma nota, nenhuma nota) e comparação com um cálculo direto em laços.
+
+    python -m pytest tests/test_analytics.py
+"""
+import json
+import warnings
+
+import numpy as np
+import pytest
+
+from app import analytics
+
+
+def make_data(rows, evaluators, participants, items) -> analytics.RatingsData:
+    return analytics.RatingsData(
+        np.array(rows, dtype=np.int64).reshape(-1, 4),
+        [(f"e{i}", f"Avaliador {i}") for i in range(evaluators)],
+        [f"p{i}" for i in range(participants)],
+        [("A", f"criterio{i}") for i in range(items)],
+    )
+
+
+def compute(data: analytics.RatingsData) -> dict:
+    # Divisões por zero e médias de fatias vazias não podem vazar como RuntimeWarning
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        return analytics.compute_statistics(data)
+
+
+def assert_exportable(statistics: dict):
+    # JSON sem NaN, CSV e Parquet de todas as tabelas
+    json.dumps(analytics.to_json(statistics), allow_nan=False)
+    for table in analytics.TABLES:
+        analytics.to_csv(statistics, table)
+        analytics.to_parquet(statistics, table)
+
+
+def test_single_rating():
+    statistics = compute(make_data([(0, 0, 0, 7)], 1, 1, 1))
+    summary = statistics["summary"]
+    assert summary["ratings"] == 1 and summary["mean"] == 7.0 and summary["variance"] == 0.0
+    assert summary["mean_pairwise_correlation"] is None and summary["outlier_evaluators"] == 0
+    rows = analytics.to_json(statistics)
+    assert rows["criteria"][0]["icc"] is None and rows["criteria"][0]["within_cell_std"] is None
+    assert rows["evaluators"][0]["bias"] is None and rows["evaluators"][0]["outlier"] is False
+    assert rows["distribution"] == [{"category": "A", "criteria": "criterio0", "rating": 7, "count": 1}]
+    assert_exportable(statistics)
+
+
+def test_cells_without_ratings():
+    # Dois avaliadores que nunca avaliaram a mesma célula: nada a comparar
+    statistics = compute(make_data([(0, 0, 0, 7), (1, 1, 1, 5), (1, 2, 1, 3)], 2, 3, 2))
+    rows = analytics.to_json(statistics)
+    assert [row["count"] for row in rows["criteria"]] == [1, 2]
+    assert [row["mean"] for row in rows["criteria"]] == [7.0, 4.0]
+    assert all(row["bias"] is None and row["consensus_correlation"] is None for row in rows["evaluators"])
+    assert all(row["mean_pairwise_correlation"] is None for row in rows["evaluators"])
+    assert_exportable(statistics)
+
+
+def test_no_ratings():
+    statistics = compute(make_data([], 0, 0, 0))
+    assert statistics["summary"]["ratings"] == 0 and statistics["summary"]["mean"] is None
+    assert analytics.to_json(statistics)["evaluators"] == []
+    assert_exportable(statistics)
+
+
+def test_matrix_too_large(monkeypatch):
+    monkeypatch.setattr(analytics, "ANALYTICS_MAX_CELLS", 7)
+    with pytest.raises(ValueError):
+        analytics.compute_statistics(make_data([(0, 0, 0, 7)], 2, 2, 2))
+
+
+def test_matches_direct_computation():
+    rng = np.random.default_rng(42)
+    evaluators, participants, items = 5, 8, 3
+    rows = [(e, p, c, int(rng.integers(1, 11)))
+            for e in range(evaluators) for p in range(participants) for c in range(items)
+            if rng.random() < 0.7]
+    statistics = compute(make_data(rows, evaluators, participants, items))
+
+    cells = {}
+    for e, p, c, rating in rows:
+        cells.setdefault((p, c), {})[e] = rating
+    for c in range(items):
+        ratings = [rating for e, p, item, rating in rows if item == c]
+        assert statistics["criteria"]["mean"][c] == pytest.approx(np.mean(ratings))
+        assert statistics["criteria"]["variance"][c] == pytest.approx(np.var(ratings))
+
+    for e in range(evaluators):
+        deviations = []
+        for by_evaluator in cells.values():
+            if e in by_evaluator and len(by_evaluator) > 1:
+                others = [rating for other, rating in by_evaluator.items() if other != e]
+                deviations.append(by_evaluator[e] - np.mean(others))
+        assert statistics["evaluators"]["bias"][e] == pytest.approx(np.mean(deviations))
+        assert statistics["evaluators"]["mean_abs_deviation"][e] == pytest.approx(np.mean(np.abs(deviations)))
+
+    pair_corr = analytics.pairwise_correlation(analytics.build_matrix(make_data(rows, evaluators, participants, items)))
+    common = [key for key, by_evaluator in cells.items() if 0 in by_evaluator and 1 in by_evaluator]
+    x = [cells[key][0] for key in common]
+    y = [cells[key][1] for key in common]
+    assert pair_corr[0, 1] == pytest.approx(np.corrcoef(x, y)[0, 1])
+    assert sum(statistics["distribution"]["count"]) == len(rows)
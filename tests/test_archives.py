@@ -0,0 +1,156 @@
+"""
+Nomes dos arquivos no ZIP de imagens (app/archives.py) e validade dos ZIPs gerados
+em streaming por app/zipstream.py. No ZIP de imagens as linhas do banco vêm de uma
+lista e os blobs de um storage local temporário.
+
+    python -m pytest tests/test_archives.py
+"""
+import asyncio
+import io
+import os
+import uuid
+import zipfile
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from app import archives
+from app.archives import MAX_NAME_LENGTH, UniqueNames, extension_for, safe_name
+from app.storage import LocalBlobStorage
+from app.zipstream import ZipStream
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("Maria Silva", "Maria Silva"),
+    ('a/b\\c:d*e?f"g<h>i|j', "a_b_c_d_e_f_g_h_i_j"),
+    ("..", "fallback"),
+    ("../../etc/passwd", "_.._etc_passwd"),
+    ("  Foto\tde\n\x00capa. ", "Foto de capa"),
+    ("", "fallback"),
+    (None, "fallback"),
+    ("José", "José"),
+])
+def test_safe_name(value, expected):
+    assert safe_name(value, "fallback") == expected
+
+
+def test_safe_name_truncates():
+    name = safe_name("x" * 200, "fallback")
+    assert len(name) == MAX_NAME_LENGTH
+
+
+def test_unique_names_per_directory():
+    names = UniqueNames()
+    assert names.take("A/Maria", "Foto", ".jpg") == "Foto.jpg"
+    assert names.take("A/Maria", "foto", ".jpg") == "foto (2).jpg"
+    assert names.take("A/Maria", "Foto", ".jpg") == "Foto (3).jpg"
+    assert names.take("A/Maria", "Foto", ".png") == "Foto.png"
+    assert names.take("A/João", "Foto", ".jpg") == "Foto.jpg"
+    assert names.take("A", "Maria") == "Maria"
+    assert names.take("A", "Maria") == "Maria (2)"
+
+
+def test_extension_for():
+    assert extension_for("image/jpeg") == ".jpg"
+    assert extension_for(None) == ".jpg"
+    assert extension_for("image/png") == ".png"
+
+
+def build_zip(entries: dict, compression: int, known_size: bool, chunk_size: int = 1000) -> bytes:
+    archive = ZipStream(compression=compression)
+    output = io.BytesIO()
+    for name, data in entries.items():
+        with archive.open(name, size=len(data) if known_size else None) as entry:
+            for start in range(0, len(data), chunk_size):
+                entry.write(data[start:start + chunk_size])
+                output.write(archive.drain())
+        output.write(archive.drain())
+    output.write(archive.close())
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+@pytest.mark.parametrize("known_size", [True, False])
+def test_zipstream_output_is_valid(compression, known_size):
+    entries = {
+        "A/Maria/Foto.jpg": os.urandom(5000),
+        "A/Maria/Foto (2).jpg": b"",
+        "B/João/capa.png": b"texto " * 2000,
+    }
+    data = build_zip(entries, compression, known_size)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(entries)
+        for name, content in entries.items():
+            assert archive.read(name) == content
+            assert archive.getinfo(name).external_attr >> 16 == 0o644
+
+
+def test_zipstream_drain_keeps_memory_bounded():
+    archive = ZipStream(compression=zipfile.ZIP_STORED)
+    with archive.open("grande.bin", size=10 * 64 * 1024) as entry:
+        for _ in range(10):
+            entry.write(os.urandom(64 * 1024))
+            # Cada drain devolve o bloco recém-escrito e esvazia o buffer
+            assert len(archive.drain()) >= 64 * 1024
+            assert archive.pending == 0
+    archive.drain()
+    assert archive.close()
+
+
+class FailingFile(io.BytesIO):
+    # Blob que falha no meio da leitura (ex.: disco ou backend remoto)
+    def read(self, size=-1):
+        if self.tell() > 0:
+            raise OSError("falha de leitura")
+        return super().read(size)
+
+
+class FlakyStorage(LocalBlobStorage):
+    def __init__(self, root, failing: set):
+        super().__init__(root)
+        self.failing = failing
+
+    def open(self, sha256):
+        if sha256 in self.failing:
+            return FailingFile(b"x" * (3 * archives.CHUNK_SIZE))
+        return super().open(sha256)
+
+
+def test_images_archive_skips_missing_and_failed_blobs(tmp_path, monkeypatch):
+    storage = FlakyStorage(str(tmp_path / "blobs"), failing={"f" * 64})
+    present = storage.save(os.urandom(3000))
+    released = storage.save(os.urandom(100))
+    storage.delete(released.sha256)
+    user_id = uuid.uuid4()
+
+    def row(title, blob_hash, size):
+        return SimpleNamespace(id=uuid.uuid4(), user_id=user_id, user_name="Maria", subcategory="A",
+                               title=title, image_hash=blob_hash, image_size=size, content_type="image/jpeg")
+
+    rows = [row("Foto", present.sha256, present.size), row("Liberada", released.sha256, released.size),
+            row("Falha", "f" * 64, 3 * archives.CHUNK_SIZE), row("Foto", present.sha256, present.size)]
+
+    async def stream_images_archive(db, subcategory, user_ids, user_category):
+        for item in rows:
+            yield item
+
+    @asynccontextmanager
+    async def stream_session():
+        yield None
+
+    monkeypatch.setattr(archives, "get_storage", lambda: storage)
+    monkeypatch.setattr(archives, "stream_session", stream_session)
+    monkeypatch.setattr(archives.crud, "stream_images_archive", stream_images_archive)
+
+    async def collect():
+        return b"".join([chunk async for chunk in archives.images_archive("A")])
+
+    with zipfile.ZipFile(io.BytesIO(asyncio.run(collect()))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ["A/Maria/Foto.jpg", "A/Maria/Falha.jpg", "A/Maria/Foto (2).jpg"]
+        with storage.open(present.sha256) as f:
+            assert archive.read("A/Maria/Foto (2).jpg") == f.read()
+        # Entrada interrompida fica só com o que foi lido antes da falha
+        assert len(archive.read("A/Maria/Falha.jpg")) == archives.CHUNK_SIZE
@@ -0,0 +1,144 @@
+"""
+Cache de leitura de app/cache.py: TTL, LRU, invalidação e queda para o loader
+quando o backend falha.
+
+    python -m pytest tests/test_cache.py
+"""
+import asyncio
+import time
+
+import pytest
+
+from app import cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = cache.MemoryCache(max_entries=3)
+    monkeypatch.setattr(cache, "_cache", backend)
+    monkeypatch.setattr(cache, "cache_stats", cache.CacheStats())
+    return backend
+
+
+class Loader:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_memory_cache_expires_after_ttl(clock):
+    backend = cache.MemoryCache()
+    asyncio.run(backend.set("k", "v", ttl=10))
+    clock[0] += 9.9
+    assert asyncio.run(backend.get("k")) == "v"
+    clock[0] += 0.1
+    assert asyncio.run(backend.get("k")) is None
+    assert len(backend) == 0
+
+
+def test_memory_cache_evicts_least_recently_used(clock):
+    backend = cache.MemoryCache(max_entries=2)
+    asyncio.run(backend.set("a", "1", ttl=10))
+    asyncio.run(backend.set("b", "2", ttl=10))
+    asyncio.run(backend.get("a"))
+    asyncio.run(backend.set("c", "3", ttl=10))
+    assert asyncio.run(backend.get("b")) is None
+    assert asyncio.run(backend.get("a")) == "1"
+
+
+def test_get_or_load_caches_until_ttl(clock, backend):
+    loader = Loader({"id": "u1", "name": "Maria"})
+    assert asyncio.run(cache.get_or_load("user", "u1", loader, ttl=5)) == {"id": "u1", "name": "Maria"}
+    assert asyncio.run(cache.get_or_load("user", "u1", loader, ttl=5)) == {"id": "u1", "name": "Maria"}
+    assert loader.calls == 1
+    clock[0] += 5
+    asyncio.run(cache.get_or_load("user", "u1", loader, ttl=5))
+    assert loader.calls == 2
+    assert cache.cache_stats.as_dict()["user"]["hits"] == 1
+
+
+def test_result_is_a_copy_with_json_types(clock, backend):
+    loader = Loader({"tags": ["a"], "id": object()})
+    first = asyncio.run(cache.get_or_load("image", 1, loader))
+    first["tags"].append("b")
+    second = asyncio.run(cache.get_or_load("image", 1, loader))
+    assert second["tags"] == ["a"]
+    # Miss e hit no mesmo formato (valores não-JSON viram texto)
+    assert isinstance(first["id"], str) and first["id"] == second["id"]
+
+
+def test_missing_record_is_not_cached(clock, backend):
+    loader = Loader(None)
+    assert asyncio.run(cache.get_or_load("user", "nada", loader)) is None
+    assert asyncio.run(cache.get_or_load("user", "nada", loader)) is None
+    assert loader.calls == 2
+
+
+def test_invalidate_forces_reload(clock, backend):
+    loader = Loader({"name": "Maria"})
+    asyncio.run(cache.get_or_load("user", "u1", loader))
+    asyncio.run(cache.get_or_load("user", "u2", loader))
+    loader.value = {"name": "Maria Silva"}
+    asyncio.run(cache.invalidate("user", "u1"))
+    assert asyncio.run(cache.get_or_load("user", "u1", loader)) == {"name": "Maria Silva"}
+    # Outras chaves e namespaces continuam em cache
+    assert asyncio.run(cache.get_or_load("user", "u2", loader)) == {"name": "Maria"}
+    assert cache.cache_stats.as_dict()["user"]["invalidations"] == 1
+
+
+class BrokenBackend(cache.CacheBackend):
+    async def get(self, key):
+        raise ConnectionError("fora do ar")
+
+    async def set(self, key, value, ttl):
+        raise ConnectionError("fora do ar")
+
+    async def delete(self, *keys):
+        raise ConnectionError("fora do ar")
+
+
+def test_backend_failure_falls_back_to_loader(monkeypatch):
+    monkeypatch.setattr(cache, "_cache", BrokenBackend())
+    monkeypatch.setattr(cache, "cache_stats", cache.CacheStats())
+    loader = Loader({"name": "Maria"})
+    assert asyncio.run(cache.get_or_load("user", "u1", loader)) == {"name": "Maria"}
+    asyncio.run(cache.invalidate("user", "u1"))
+    assert loader.calls == 1
+    assert cache.cache_stats.errors == 2
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = (value.encode(), ex)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def test_redis_backend_prefixes_keys_and_passes_ttl():
+    client = FakeRedis()
+    backend = cache.RedisCache(client, prefix="teste:")
+    asyncio.run(backend.set("user:u1", "{}", ttl=30))
+    assert client.data == {"teste:user:u1": (b"{}", 30)}
+    client.data["teste:user:u1"] = b"{}"
+    assert asyncio.run(backend.get("user:u1")) == "{}"
+    asyncio.run(backend.delete("user:u1"))
+    assert client.data == {}
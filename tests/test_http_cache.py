@@ -0,0 +1,107 @@
+"""
+ETag, GET condicional (304), Range e ?v= de app/http_cache.py, servindo blobs de
+um storage local num diretório temporário.
+
+    python -m pytest tests/test_http_cache.py
+"""
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app import http_cache
+from app.storage import LocalBlobStorage
+
+CONTENT = os.urandom(10000)
+
+
+class RemoteStorage(LocalBlobStorage):
+    # Backend sem caminho local: servido por iter_chunks
+    def local_path(self, sha256):
+        return None
+
+
+@pytest.fixture(params=[LocalBlobStorage, RemoteStorage])
+def client(request, tmp_path, monkeypatch):
+    storage = request.param(str(tmp_path / "blobs"))
+    stored = storage.save(CONTENT)
+    variant_path = tmp_path / "variant.jpg"
+    variant_path.write_bytes(b"derivado")
+    monkeypatch.setattr(http_cache, "get_storage", lambda: storage)
+
+    app = FastAPI()
+    opened = []
+
+    @app.get("/blob")
+    def blob(request: Request):
+        return http_cache.cached_blob_response(request, stored.sha256, "image/jpeg")
+
+    @app.get("/variant")
+    def variant(request: Request):
+        f = open(variant_path, "rb")
+        opened.append(f)
+        return http_cache.cached_blob_response(request, stored.sha256, "image/jpeg", variant="w320", file=f)
+
+    client = TestClient(app)
+    client.sha256 = stored.sha256
+    client.opened = opened
+    client.local = storage.local_path(stored.sha256) is not None
+    return client
+
+
+def test_full_response_has_strong_etag_and_revalidates(client):
+    response = client.get("/blob")
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["etag"] == f'"{client.sha256}"'
+    assert response.headers["cache-control"] == "public, no-cache"
+
+
+@pytest.mark.parametrize("header", ['"{}"', 'W/"{}"', '"outro", "{}"', "*"])
+def test_if_none_match_returns_304(client, header):
+    response = client.get("/blob", headers={"If-None-Match": header.format(client.sha256)})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == f'"{client.sha256}"'
+
+
+def test_stale_etag_returns_content(client):
+    response = client.get("/blob", headers={"If-None-Match": '"outro"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_versioned_url_is_immutable(client):
+    version = http_cache.content_version(client.sha256)
+    response = client.get(f"/blob?v={version}")
+    assert response.headers["cache-control"] == f"public, max-age={http_cache.IMMUTABLE_MAX_AGE}, immutable"
+    # Versão antiga na URL: o conteúdo mudou, não pode ficar em cache como imutável
+    response = client.get("/blob?v=0000000000000000")
+    assert response.headers["cache-control"] == "public, no-cache"
+
+
+def test_range(client):
+    response = client.get("/blob", headers={"Range": "bytes=100-199"})
+    if client.local:
+        assert response.status_code == 206
+        assert response.content == CONTENT[100:200]
+        assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+    else:
+        # Sem arquivo local o Range é ignorado e o corpo vem inteiro
+        assert response.status_code == 200
+        assert response.content == CONTENT
+
+
+def test_variant_file_is_served_and_closed(client):
+    response = client.get("/variant")
+    assert response.content == b"derivado"
+    assert response.headers["etag"] == f'"{client.sha256}-w320"'
+    assert response.headers["content-length"] == str(len(b"derivado"))
+
+    response = client.get("/variant", headers={"If-None-Match": f'"{client.sha256}-w320"'})
+    assert response.status_code == 304
+    # A ETag da original não vale para o derivado
+    response = client.get("/variant", headers={"If-None-Match": f'"{client.sha256}"'})
+    assert response.status_code == 200
+    assert all(f.closed for f in client.opened)
@@ -0,0 +1,184 @@
+"""
+Envio da outbox de e-mails contra o servidor local de app/smtp_stub.py.
+
+Os testes de SMTPSession e do backoff não precisam de banco. Os de OutboxSender
+gravam na tabela email_outbox e precisam de um banco migrado com as variáveis
+USUARIO_BANCO/SENHA_BANCO/...; sem elas são pulados.
+
+    python -m pytest tests/test_mailer.py
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app import mailer, models
+from app.database import DATABASE_URL
+from app.smtp_stub import SMTPStub
+
+requires_db = pytest.mark.skipif(not os.getenv("USUARIO_BANCO"), reason="banco não configurado (USUARIO_BANCO)")
+
+DOMAIN = "teste-outbox.invalid"
+
+
+@pytest.fixture(autouse=True)
+def smtp_settings(monkeypatch):
+    monkeypatch.setattr(mailer, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(mailer, "SMTP_STARTTLS", False)
+    monkeypatch.setenv("EMAIL_GMAIL", f"sistema@{DOMAIN}")
+    monkeypatch.setenv("SENHA_GMAIL", "senha")
+
+
+async def start_stub(monkeypatch) -> SMTPStub:
+    stub = SMTPStub(port=0)
+    await stub.start()
+    monkeypatch.setattr(mailer, "SMTP_PORT", stub.port)
+    return stub
+
+
+class CountingSession(mailer.SMTPSession):
+    def __init__(self):
+        super().__init__()
+        self.connections = 0
+
+    def _connect(self):
+        self.connections += 1
+        return super()._connect()
+
+
+def test_session_reuses_connection(monkeypatch):
+    async def scenario():
+        stub = await start_stub(monkeypatch)
+        session = CountingSession()
+        try:
+            for i in range(3):
+                # smtplib é bloqueante: o stub precisa do event loop livre para responder
+                await asyncio.to_thread(session.send, f"p{i}@{DOMAIN}", f"Assunto {i}", "corpo")
+            await asyncio.to_thread(session.close)
+        finally:
+            await stub.stop()
+        return stub, session
+
+    stub, session = asyncio.run(scenario())
+    assert [m.rcpt_to for m in stub.messages] == [[f"p{i}@{DOMAIN}"] for i in range(3)]
+    assert b"Subject: Assunto 2" in stub.messages[2].data
+    assert session.connections == 1
+
+
+def test_backoff_delay_doubles_up_to_max(monkeypatch):
+    monkeypatch.setattr(mailer, "OUTBOX_BACKOFF_BASE", 30)
+    monkeypatch.setattr(mailer, "OUTBOX_BACKOFF_MAX", 100)
+    assert mailer.backoff_delay(1) == timedelta(seconds=30)
+    assert mailer.backoff_delay(2) == timedelta(seconds=60)
+    assert mailer.backoff_delay(3) == timedelta(seconds=100)
+
+
+def make_sessionmaker():
+    # Engine próprio, sem pool: cada teste roda no seu event loop
+    engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+    return engine, async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+async def enqueue(sessionmaker, count: int) -> list:
+    async with sessionmaker() as db:
+        await db.execute(delete(models.EmailOutbox).where(models.EmailOutbox.to_email.like(f"%@{DOMAIN}")))
+        # next_attempt_at explícito: o default do banco usa o fuso do servidor, o mailer usa UTC
+        due = datetime.utcnow() - timedelta(seconds=1)
+        messages = [mailer.enqueue_email(db, f"p{i}@{DOMAIN}", f"Assunto {i}", "corpo") for i in range(count)]
+        for message in messages:
+            message.next_attempt_at = due
+        await db.commit()
+        return [message.id for message in messages]
+
+
+async def load(sessionmaker, ids: list) -> dict:
+    async with sessionmaker() as db:
+        result = await db.execute(select(models.EmailOutbox).where(models.EmailOutbox.id.in_(ids)))
+        return {message.id: message for message in result.scalars()}
+
+
+@requires_db
+def test_run_once_delivers_batch(monkeypatch):
+    async def scenario():
+        engine, sessionmaker = make_sessionmaker()
+        monkeypatch.setattr(mailer, "SessionLocal", sessionmaker)
+        stub = await start_stub(monkeypatch)
+        try:
+            ids = await enqueue(sessionmaker, 3)
+            sender = mailer.OutboxSender()
+            await sender.run_once()
+            await asyncio.to_thread(sender.smtp.close)
+            return stub, await load(sessionmaker, ids)
+        finally:
+            await stub.stop()
+            await engine.dispose()
+
+    stub, messages = asyncio.run(scenario())
+    delivered = {rcpt for m in stub.messages for rcpt in m.rcpt_to}
+    assert {f"p{i}@{DOMAIN}" for i in range(3)} <= delivered
+    assert all(m.status == "sent" and m.sent_at is not None and m.attempts == 0 for m in messages.values())
+
+
+@requires_db
+def test_run_once_schedules_retry_with_backoff(monkeypatch):
+    monkeypatch.setattr(mailer, "OUTBOX_MAX_ATTEMPTS", 2)
+
+    async def scenario():
+        engine, sessionmaker = make_sessionmaker()
+        monkeypatch.setattr(mailer, "SessionLocal", sessionmaker)
+        # Porta de um stub já parado: a conexão é recusada
+        stub = await start_stub(monkeypatch)
+        await stub.stop()
+        try:
+            ids = await enqueue(sessionmaker, 1)
+            sender = mailer.OutboxSender()
+            before = datetime.utcnow()
+            await sender.run_once()
+            first = (await load(sessionmaker, ids))[ids[0]]
+
+            # Segunda falha esgota as tentativas
+            async with sessionmaker() as db:
+                message = await db.get(models.EmailOutbox, ids[0])
+                message.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+                await db.commit()
+            await sender.run_once()
+            second = (await load(sessionmaker, ids))[ids[0]]
+            return before, first, second
+        finally:
+            await engine.dispose()
+
+    before, first, second = asyncio.run(scenario())
+    assert first.status == "pending" and first.attempts == 1 and first.last_error
+    assert first.next_attempt_at >= before + mailer.backoff_delay(1) - timedelta(seconds=1)
+    assert second.status == "failed" and second.attempts == 2
+
+
+@requires_db
+def test_claim_skips_locked_and_leased_rows(monkeypatch):
+    async def scenario():
+        engine, sessionmaker = make_sessionmaker()
+        sender = mailer.OutboxSender(smtp=mailer.SMTPSession())
+        try:
+            ids = await enqueue(sessionmaker, 2)
+            async with sessionmaker() as holder, sessionmaker() as other:
+                # Outro worker com a primeira mensagem travada numa transação aberta
+                await holder.execute(
+                    select(models.EmailOutbox.id).where(models.EmailOutbox.id == ids[0]).with_for_update()
+                )
+                claimed = await asyncio.wait_for(sender._claim_batch(other), timeout=5)
+                await holder.rollback()
+            async with sessionmaker() as db:
+                # A segunda já está reservada pelo lease e a primeira continua livre
+                reclaimed = await sender._claim_batch(db)
+            return ids, {m.id for m in claimed}, {m.id for m in reclaimed}
+        finally:
+            await engine.dispose()
+
+    ids, claimed, reclaimed = asyncio.run(scenario())
+    assert ids[0] not in claimed and ids[1] in claimed
+    assert ids[0] in reclaimed and ids[1] not in reclaimed
@@ -0,0 +1,102 @@
+"""
+Planos de execução das consultas de notas, da listagem de usuários e das exportações.
+
+Roda EXPLAIN nas consultas montadas pelo crud com seq scan desabilitado na
+sessão: se ainda assim o Postgres escolher um Seq Scan, nenhum índice atende a
+consulta. Precisa de um banco migrado (alembic upgrade head) com as variáveis
+USUARIO_BANCO/SENHA_BANCO/...; sem elas os testes são pulados.
+
+    python -m pytest tests/test_query_plans.py
+"""
+import asyncio
+import json
+import os
+import uuid
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app import crud
+from app.database import DATABASE_URL
+
+pytestmark = pytest.mark.skipif(not os.getenv("USUARIO_BANCO"), reason="banco não configurado (USUARIO_BANCO)")
+
+USER_ID = uuid.uuid4()
+EVALUATOR_ID = uuid.uuid4()
+
+PLAN_CHECKS = {
+    "get_image_rating": crud.image_rating_statement(USER_ID, "A", EVALUATOR_ID),
+    "set_user_ratings (notas anteriores)": crud.previous_ratings_statement(
+        EVALUATOR_ID, [(USER_ID, "A"), (uuid.uuid4(), "B")]
+    ),
+    "delete_user (contribuições do avaliador)": crud.evaluator_contributions_statement(EVALUATOR_ID),
+    "delete_user (notas recebidas)": crud.received_ratings_statement(USER_ID),
+    "get_evaluator_queue": crud.evaluator_queue_statement(EVALUATOR_ID, "A", after=USER_ID),
+    "get_images_metadata_bulk": crud.images_metadata_bulk_statement([uuid.uuid4()], [USER_ID]),
+    "get_users (página por cursor)": crud.users_page_statement(after=("Maria", USER_ID)),
+    "get_users (filtro por categoria)": crud.users_page_statement(after=("Maria", USER_ID), category="1"),
+    "get_users (filtro por instituição)": crud.users_page_statement(institution="UFSC"),
+    "stream_user_media (exportação)": crud.user_media_export_statement(),
+    "stream_user_media (exportação por categoria)": crud.user_media_export_statement(user_category="1"),
+    "stream_images_archive (participantes)": crud.images_archive_statement("A", [USER_ID, uuid.uuid4()]),
+}
+
+# Lidas do cursor do servidor ou cortadas por LIMIT: a ordem tem que vir do índice. Um Sort
+# completo lê e ordena tudo antes da primeira linha (Incremental Sort sobre um prefixo já ordenado não)
+STREAMED = {
+    "get_evaluator_queue",
+    "get_users (página por cursor)",
+    "get_users (filtro por categoria)",
+    "get_users (filtro por instituição)",
+    "stream_user_media (exportação)",
+    "stream_user_media (exportação por categoria)",
+}
+
+
+def find_nodes(plan: dict, node_type: str) -> list:
+    found = [plan] if plan.get("Node Type") == node_type else []
+    for child in plan.get("Plans", []):
+        found.extend(find_nodes(child, node_type))
+    return found
+
+
+class Explain(Executable, ClauseElement):
+    # EXPLAIN em volta da consulta compilada pelo próprio SQLAlchemy: os parâmetros
+    # seguem ligados e tipados como na aplicação (literal_binds trocaria UUID[] por text[])
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+async def explain(statement) -> dict:
+    # Engine próprio, sem pool: cada teste roda no seu event loop
+    engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("SET enable_seqscan = off"))
+            plan = (await conn.execute(Explain(statement))).scalar()
+    finally:
+        await engine.dispose()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+@pytest.mark.parametrize("name", list(PLAN_CHECKS))
+def test_query_uses_index(name):
+    plan = asyncio.run(explain(PLAN_CHECKS[name]))
+    seq_scans = [node.get("Relation Name") for node in find_nodes(plan, "Seq Scan")]
+    assert not seq_scans, f"Seq Scan em {', '.join(seq_scans)} na consulta {name}"
+    if name in STREAMED:
+        sorts = [", ".join(node.get("Sort Key", [])) for node in find_nodes(plan, "Sort")]
+        assert not sorts, f"Sort ({'; '.join(sorts)}) antes da primeira linha na consulta {name}"
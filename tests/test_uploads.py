@@ -0,0 +1,161 @@
+"""
+Parser multipart em streaming de app/uploads.py, com o corpo entregue em pedaços
+como pelo servidor e o blob storage local num diretório temporário.
+
+    python -m pytest tests/test_uploads.py
+"""
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app import uploads
+from app.storage import LocalBlobStorage
+
+BOUNDARY = "limite-de-teste"
+JPEG = uploads.JPEG_MAGIC + b"\xe0" + os.urandom(5000)
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    storage = LocalBlobStorage(str(tmp_path / "blobs"))
+    monkeypatch.setattr(uploads, "get_storage", lambda: storage)
+    return storage
+
+
+def stored_files(storage: LocalBlobStorage) -> list:
+    # Blobs confirmados e temporários que sobraram
+    return [os.path.join(path, name) for path, _, names in os.walk(storage.root) for name in names]
+
+
+def multipart_body(parts: list) -> bytes:
+    body = b""
+    for name, value, filename, content_type in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename:
+            disposition += f'; filename="{filename}"'
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n".encode()
+        if content_type:
+            body += f"Content-Type: {content_type}\r\n".encode()
+        body += b"\r\n" + value + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def make_request(body: bytes, chunk_size: int = 1024, content_length: bool = True) -> Request:
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": headers}, receive)
+
+
+def make_upload(request: Request, max_file_size: int = 1024 * 1024) -> uploads.StreamingUpload:
+    return uploads.StreamingUpload(request, "file", max_file_size, ["image/jpeg"], magic=uploads.JPEG_MAGIC,
+                                   required_fields=("category",))
+
+
+def test_fields_before_file_are_validated_before_content(storage):
+    calls = []
+    upload = make_upload(make_request(multipart_body([
+        ("category", b"A", None, None),
+        ("file", JPEG, "foto.jpg", "image/jpeg"),
+    ])))
+
+    async def validate(fields):
+        # Nenhum byte do arquivo lido ainda
+        calls.append((dict(fields), upload._file_size))
+
+    stored = asyncio.run(upload.parse(validate))
+    assert calls == [({"category": "A"}, 0)]
+    assert stored.size == len(JPEG)
+    with storage.open(stored.sha256) as f:
+        assert f.read() == JPEG
+
+
+def test_fields_after_file_are_validated_at_the_end(storage):
+    calls = []
+    upload = make_upload(make_request(multipart_body([
+        ("file", JPEG, "foto.jpg", "image/jpeg"),
+        ("category", b"B", None, None),
+    ])))
+
+    async def validate(fields):
+        calls.append((dict(fields), upload._file_size))
+
+    stored = asyncio.run(upload.parse(validate))
+    assert calls == [({"category": "B"}, len(JPEG))]
+    assert storage.exists(stored.sha256)
+
+
+def test_validation_error_discards_blob(storage):
+    upload = make_upload(make_request(multipart_body([
+        ("category", b"A", None, None),
+        ("file", JPEG, "foto.jpg", "image/jpeg"),
+    ])))
+
+    async def validate(fields):
+        raise HTTPException(status_code=403, detail="Sem permissão")
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(upload.parse(validate))
+    assert exc.value.status_code == 403
+    assert stored_files(storage) == []
+
+
+@pytest.mark.parametrize("content_length", [True, False])
+def test_oversize_file_is_rejected(storage, content_length):
+    big = uploads.JPEG_MAGIC + os.urandom(uploads.FORM_OVERHEAD + 8000)
+    upload = make_upload(make_request(multipart_body([
+        ("category", b"A", None, None),
+        ("file", big, "foto.jpg", "image/jpeg"),
+    ]), content_length=content_length), max_file_size=4000)
+
+    async def validate(fields):
+        pass
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(upload.parse(validate))
+    assert exc.value.status_code == 413
+    assert stored_files(storage) == []
+
+
+def test_bad_magic_bytes_are_rejected(storage):
+    upload = make_upload(make_request(multipart_body([
+        ("category", b"A", None, None),
+        ("file", b"GIF89a" + os.urandom(3000), "foto.jpg", "image/jpeg"),
+    ])))
+
+    async def validate(fields):
+        pass
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(upload.parse(validate))
+    assert exc.value.status_code == 400
+    assert upload._file_size < 3000
+    assert stored_files(storage) == []
+
+
+def test_disallowed_content_type_and_missing_fields(storage):
+    async def validate(fields):
+        pass
+
+    upload = make_upload(make_request(multipart_body([
+        ("category", b"A", None, None),
+        ("file", JPEG, "foto.png", "image/png"),
+    ])))
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(upload.parse(validate))
+    assert exc.value.status_code == 400
+
+    upload = make_upload(make_request(multipart_body([("file", JPEG, "foto.jpg", "image/jpeg")])))
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(upload.parse(validate))
+    assert "category" in exc.value.detail
+    assert stored_files(storage) == []